@@ -3,6 +3,23 @@ import re
 import sys
 import os 
 import codecs
+import threading
+import time
+import mmap
+import struct
+import argparse
+import cStringIO
+import glob
+import array
+import itertools
+import bisect
+import json
+import cgi
+import hashlib
+import weakref
+import math
+from collections import OrderedDict
+import multiprocessing
 
 DICT='dict/words'
 
@@ -89,7 +106,7 @@ def regex_word_search_help(text):
 
   match = None
   match = WORD_PAT.search(text)
-  if not match: return []
+  if not match: return [],[]
   
   result_set = [match.group(0)]
   matchidx = [(match.start(),match.end())]
@@ -277,6 +294,99 @@ def normalize_text(result_set, matchidx, text):
       temp1.append(word)
     return temp1,temp2
         
+_POSSESSIVE = re.compile(u"[%s]s" % APOSTROPHES, re.UNICODE)
+_CONNECTOR_WORDS = frozenset(["the","a","of"])
+
+def fold_apostrophes(text):
+  '''Return "text" with every apostrophe in APOSTROPHES replaced by an ascii
+  one. Each is a single character, so offsets into the text are unchanged.'''
+  if isinstance(text, unicode):
+    for a in APOSTROPHES:
+      if a != "'": text = text.replace(a, u"'")
+  return text
+
+def _tokenize_spans(text, starts, ends):
+  '''Append the start and end of every normalized word of "text" to the
+  sequences "starts" and "ends". See tokenize().'''
+  add_start = starts.append
+  add_end = ends.append
+  possessive = _POSSESSIVE.match
+  connector_words = _CONNECTOR_WORDS
+
+  def emit(start, end):
+    if (text[end - 1] == 's' and end - start >= 2 and
+        possessive(text, end - 2, end)):
+      end -= 2
+    add_start(start)
+    add_end(end)
+
+  def flush(lastidx, connectors):
+    emit(*lastidx)
+    for idx in connectors: emit(*idx)
+
+  lastidx = None # start and end of the pending capitalized run
+  connectors = [] # positions of connector words following the run
+  for match in WORD_PAT.finditer(text):
+    start, end = match.span()
+    if text[start].isupper():
+      if lastidx is not None and connectors:
+        if text[connectors[-1][1]:start].isspace():
+          lastidx = lastidx[0], end
+        else:
+          flush(lastidx, connectors)
+          lastidx = start, end
+        connectors = []
+      elif lastidx is not None:
+        seperation = text[lastidx[1]:start]
+        if seperation.isspace() and count_newline(seperation) < 2:
+          lastidx = lastidx[0], end
+        else:
+          emit(*lastidx)
+          lastidx = start, end
+      else:
+        lastidx = start, end
+
+    elif (lastidx is not None and end - start <= 3 and
+          text[start:end] in connector_words):
+      if connectors: seperation = text[connectors[-1][1]:start]
+      else: seperation = text[lastidx[1]:start]
+      connectors.append((start, end))
+      if not seperation.isspace():
+        flush(lastidx, connectors)
+        lastidx = None
+        connectors = []
+
+    else:
+      if lastidx is not None:
+        flush(lastidx, connectors)
+        lastidx = None
+        connectors = []
+      #emit() inlined for the common case of a plain word
+      if (text[end - 1] == 's' and end - start >= 2 and
+          possessive(text, end - 2, end)):
+        end -= 2
+      add_start(start)
+      add_end(end)
+
+  if lastidx is not None:
+    flush(lastidx, connectors)
+
+def tokenize(text):
+  '''Single pass equivalent of regex_word_search_idx().
+
+  Matches of WORD_PAT are grouped into capitalized runs and stripped of
+  "'s" as they are found, following exactly the rules of normalize_text().
+  Runs and connector words are tracked as (start, end) offsets only: a
+  normalized word is always the slice between its offsets of the text
+  with its apostrophes folded, so it is only built once it is final.
+  Returns the list of normalized words and the list of their positions.'''
+  text = fold_apostrophes(text)
+  starts = []
+  ends = []
+  _tokenize_spans(text, starts, ends)
+  idxs = zip(starts, ends)
+  return [text[start:end] for start,end in idxs],idxs
+
 def load_words(dict):
     '''Load a dictionary at location "dict.
     Return the result as a frozen set of words.'''
@@ -292,6 +402,516 @@ def load_words(dict):
     dictfobj.close()
     return frozenset(words)
     
+#Compiled dictionaries start with this magic string followed by the number
+#of words, a table of count+1 little endian uint32 offsets into the string
+#data and the string data itself. The words are case-folded, utf-8 encoded
+#and sorted bytewise so a lookup is a binary search over the offsets.
+COMPILED_MAGIC = 'UWDICT1\n'
+_HEADER = struct.Struct('<I')
+_OFFSET = struct.Struct('<I')
+
+def compile_dictionary(dict, dest):
+  '''Compile the plain word list at "dict" into the binary format read by
+  MappedDictionary and write it to "dest". The file is written next to
+  "dest" and renamed into place so readers never map a partial file.'''
+  words = sorted(set(word.encode('utf-8') for word in load_words(dict)))
+
+  offsets = [0]
+  for word in words:
+    offsets.append(offsets[-1] + len(word))
+
+  tmp = dest + '.tmp'
+  f = open(tmp, 'wb')
+  try:
+    f.write(COMPILED_MAGIC)
+    f.write(_HEADER.pack(len(words)))
+    f.write(struct.pack('<%dI' % len(offsets), *offsets))
+    f.write(''.join(words))
+  finally:
+    f.close()
+  os.rename(tmp, dest)
+  #A filter built for what was there before would reject the new words.
+  try:
+    os.remove(filter_path(dest))
+  except OSError:
+    pass
+  return len(words)
+
+class MappedDictionary(object):
+  '''Read only dictionary backed by a memory mapped compiled word list.
+
+  Lookups binary search the file in place, so opening a dictionary costs
+  next to nothing and processes forked after it was opened share its pages.
+  Supports the same "in", len() and iteration operations as the frozenset
+  returned by load_words().'''
+
+  def __init__(self, path):
+    f = open(path, 'rb')
+    try:
+      self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+      f.close()
+    if self._map[:len(COMPILED_MAGIC)] != COMPILED_MAGIC:
+      raise ValueError('%s is not a compiled dictionary' % path)
+    self.path = path
+    self._count = _HEADER.unpack_from(self._map, len(COMPILED_MAGIC))[0]
+    self._offsets = len(COMPILED_MAGIC) + _HEADER.size
+    self._data = self._offsets + (self._count + 1) * _OFFSET.size
+
+  def _word(self, i):
+    start, end = struct.unpack_from('<2I', self._map,
+                                    self._offsets + i * _OFFSET.size)
+    return self._map[self._data + start:self._data + end]
+
+  def __contains__(self, word):
+    if isinstance(word, unicode):
+      word = word.encode('utf-8')
+    lo, hi = 0, self._count
+    while lo < hi:
+      mid = (lo + hi) // 2
+      probe = self._word(mid)
+      if probe < word:
+        lo = mid + 1
+      elif probe > word:
+        hi = mid
+      else:
+        return True
+    return False
+
+  def __len__(self):
+    return self._count
+
+  def __iter__(self):
+    for i in xrange(self._count):
+      yield self._word(i).decode('utf-8')
+
+  def close(self):
+    self._map.close()
+
+#A Bloom filter file starts with this magic string followed by the number
+#of hash functions, the number of bits, the number of words and the MD5
+#digest of the compiled dictionary it was built from, then the bits
+#themselves.
+BLOOM_MAGIC = 'UWBLOOM2\n'
+_BLOOM_HEADER = struct.Struct('<IQI16s')
+BLOOM_FALSE_POSITIVE_RATE = 0.01
+
+def _bloom_hashes(word):
+  '''Return the two 64 bit hashes combined into the filter's k hashes.'''
+  return struct.unpack('<QQ', hashlib.md5(word).digest())
+
+def file_digest(path):
+  '''Return the MD5 digest of the contents of the file at "path".'''
+  digest = hashlib.md5()
+  f = open(path, 'rb')
+  try:
+    for block in iter(lambda: f.read(1 << 20), ''):
+      digest.update(block)
+  finally:
+    f.close()
+  return digest.digest()
+
+def filter_path(dict):
+  '''Return where the Bloom filter for compiled dictionary "dict" is kept.'''
+  return dict + '.bloom'
+
+def compile_filter(dict, dest=None, rate=BLOOM_FALSE_POSITIVE_RATE):
+  '''Build a Bloom filter over the words of the compiled dictionary "dict"
+  with a false positive rate of about "rate" and write it to "dest"
+  (filter_path(dict) by default). Return the size of the filter in bytes.'''
+  store = MappedDictionary(dict)
+  count = len(store)
+  bits = max(int(math.ceil(-count * math.log(rate) / math.log(2) ** 2)), 8)
+  hashes = max(int(round(float(bits) / max(count, 1) * math.log(2))), 1)
+  filter = bytearray((bits + 7) // 8)
+  for i in xrange(count):
+    h1,h2 = _bloom_hashes(store._word(i))
+    for j in xrange(hashes):
+      pos = (h1 + j * h2) % bits
+      filter[pos >> 3] |= 1 << (pos & 7)
+  store.close()
+
+  dest = dest or filter_path(dict)
+  tmp = dest + '.tmp'
+  f = open(tmp, 'wb')
+  try:
+    f.write(BLOOM_MAGIC)
+    f.write(_BLOOM_HEADER.pack(hashes, bits, count, file_digest(dict)))
+    f.write(filter)
+  finally:
+    f.close()
+  os.rename(tmp, dest)
+  return len(filter)
+
+class BloomFilter(object):
+  '''Memory mapped Bloom filter written by compile_filter(). "in" is
+  False for every word not in the dictionary the filter was built from,
+  apart from a fraction (the false positive rate) of them, and True for
+  all the words in it.'''
+
+  def __init__(self, path):
+    f = open(path, 'rb')
+    try:
+      self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+      f.close()
+    if self._map[:len(BLOOM_MAGIC)] != BLOOM_MAGIC:
+      raise ValueError('%s is not a Bloom filter' % path)
+    self.path = path
+    self.hashes,self.bits,self.count,self.source_digest = \
+        _BLOOM_HEADER.unpack_from(self._map, len(BLOOM_MAGIC))
+    self._data = len(BLOOM_MAGIC) + _BLOOM_HEADER.size
+
+  def __contains__(self, word):
+    if isinstance(word, unicode):
+      word = word.encode('utf-8')
+    h1,h2 = _bloom_hashes(word)
+    data, base, bits = self._map, self._data, self.bits
+    for j in xrange(self.hashes):
+      pos = (h1 + j * h2) % bits
+      if not ord(data[base + (pos >> 3)]) & (1 << (pos & 7)):
+        return False
+    return True
+
+  def close(self):
+    self._map.close()
+
+class FilteredDictionary(object):
+  '''Compiled dictionary with a Bloom filter in front of it. Most unknown
+  words are turned away by the filter, which costs a hash and a few bit
+  tests instead of a binary search; the words it lets through are
+  confirmed against the exact dictionary. Both files are memory mapped,
+  so a worker's resident memory is only the pages it touched.'''
+
+  def __init__(self, filter, store):
+    self.filter = filter
+    self.store = store
+    self.path = store.path
+
+  def __contains__(self, word):
+    if isinstance(word, unicode):
+      word = word.encode('utf-8')
+    return word in self.filter and word in self.store
+
+  def __len__(self):
+    return len(self.store)
+
+  def __iter__(self):
+    return iter(self.store)
+
+  def close(self):
+    self.filter.close()
+    self.store.close()
+
+def load_dictionary(dict):
+  '''Load dictionary "dict", either a plain word list or a file written
+  by compile_dictionary(). A compiled dictionary is put behind the Bloom
+  filter written for it by compile_filter(), if there is one built from
+  exactly the dictionary as it is now: a filter for any other word list
+  would turn away words that are in this one.'''
+  f = open(dict, 'rb')
+  magic = f.read(len(COMPILED_MAGIC))
+  f.close()
+  if magic == COMPILED_MAGIC:
+    store = MappedDictionary(dict)
+    if os.path.exists(filter_path(dict)):
+      try:
+        filter = BloomFilter(filter_path(dict))
+      except ValueError:
+        return store #a filter in an older format
+      if (filter.count, filter.source_digest) == (len(store),
+                                                  file_digest(dict)):
+        return FilteredDictionary(filter, store)
+      filter.close()
+    return store
+  return load_words(dict)
+
+#Upper bounds of the histogram buckets, in seconds for latencies.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = tuple(64 * 4 ** i for i in range(10))
+RATE_BUCKETS = (0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+
+class Histogram(object):
+  '''Counts of observed values per bucket, with their sum and count.'''
+  def __init__(self, buckets):
+    self.buckets = buckets
+    self.counts = [0] * len(buckets)
+    self.sum = 0.0
+    self.count = 0
+
+  def observe(self, value):
+    i = bisect.bisect_left(self.buckets, value)
+    if i < len(self.counts): self.counts[i] += 1 #larger ones only in +Inf
+    self.sum += value
+    self.count += 1
+
+class Metrics(object):
+  '''Counters and histograms describing the work done by the checker, for
+  exporting in the Prometheus text format with render().
+
+  Recording does nothing unless "enabled" is set, and the call sites only
+  record once per document or per stage, never per word, so disabled
+  metrics cost a few attribute lookups per check. Stages are timed with
+  clock() and lap():
+
+    t = METRICS.clock()
+    ...tokenize...
+    t = METRICS.lap('tokenize', t)
+  '''
+
+  def __init__(self, enabled=False):
+    self.enabled = enabled
+    self._lock = threading.Lock()
+    self._counters = {}
+    self._histograms = {}
+    self._gauges = {}
+    self._help = {}
+
+  def describe(self, name, help):
+    self._help[name] = help
+
+  def inc(self, name, value=1, **labels):
+    if not self.enabled: return
+    key = (name, tuple(sorted(labels.items())))
+    with self._lock:
+      self._counters[key] = self._counters.get(key, 0) + value
+
+  def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+    if not self.enabled: return
+    key = (name, tuple(sorted(labels.items())))
+    with self._lock:
+      histogram = self._histograms.get(key)
+      if histogram is None:
+        histogram = self._histograms[key] = Histogram(buckets)
+      histogram.observe(value)
+
+  def counter(self, name, value, **labels):
+    '''Set a counter kept elsewhere, such as the hits of a cache, to its
+    current total.'''
+    if not self.enabled: return
+    with self._lock:
+      self._counters[(name, tuple(sorted(labels.items())))] = value
+
+  def gauge(self, name, value, **labels):
+    '''Set a value that is replaced rather than added to, such as the
+    current size of a cache.'''
+    if not self.enabled: return
+    with self._lock:
+      self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+  def clock(self):
+    '''Return the time to pass to lap(), or 0 when disabled.'''
+    return time.time() if self.enabled else 0
+
+  def lap(self, stage, start):
+    '''Record the time since "start" as the latency of "stage" and return
+    the current time, the start of the next stage.'''
+    if not start: return 0
+    now = time.time()
+    self.observe('uc_stage_seconds', now - start, stage=stage)
+    return now
+
+  def clear(self):
+    with self._lock:
+      self._counters = {}
+      self._histograms = {}
+      self._gauges = {}
+
+  def render(self):
+    '''Return everything recorded in the Prometheus text format.'''
+    def labels(pairs, extra=()):
+      pairs = list(pairs) + list(extra)
+      if not pairs: return ''
+      return '{%s}' % ','.join(
+        '%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+        for k,v in pairs)
+    def number(value):
+      return repr(float(value)) if isinstance(value, float) else str(value)
+
+    with self._lock:
+      counters = sorted(self._counters.items())
+      gauges = sorted(self._gauges.items())
+      histograms = sorted((k, (h.buckets, list(h.counts), h.sum, h.count))
+                          for k,h in self._histograms.items())
+    lines = []
+    described = set()
+    def header(name, type):
+      if name in described: return
+      described.add(name)
+      if name in self._help:
+        lines.append('# HELP %s %s' % (name, self._help[name]))
+      lines.append('# TYPE %s %s' % (name, type))
+
+    for (name,pairs),value in counters:
+      header(name, 'counter')
+      lines.append('%s%s %s' % (name, labels(pairs), number(value)))
+    for (name,pairs),value in gauges:
+      header(name, 'gauge')
+      lines.append('%s%s %s' % (name, labels(pairs), number(value)))
+    for (name,pairs),(buckets,counts,total,count) in histograms:
+      header(name, 'histogram')
+      cumulative = 0
+      for bound,n in zip(buckets, counts):
+        cumulative += n
+        lines.append('%s_bucket%s %d' % (name, labels(pairs,
+                                                      [('le', bound)]),
+                                         cumulative))
+      lines.append('%s_bucket%s %d' % (name, labels(pairs, [('le', '+Inf')]),
+                                       count))
+      lines.append('%s_sum%s %r' % (name, labels(pairs), total))
+      lines.append('%s_count%s %d' % (name, labels(pairs), count))
+    return '\n'.join(lines) + '\n'
+
+METRICS = Metrics()
+METRICS.describe('uc_stage_seconds', 'Time spent in each stage of a check.')
+METRICS.describe('uc_documents_total', 'Documents checked.')
+METRICS.describe('uc_document_characters', 'Size of checked documents.')
+METRICS.describe('uc_tokens_total', 'Words checked.')
+METRICS.describe('uc_unknown_tokens_total', 'Unrecognized words found.')
+METRICS.describe('uc_unknown_rate',
+                 'Fraction of the words of a document not recognized.')
+METRICS.describe('uc_hyphenated_tokens_total',
+                 'Hyphenated words resolved by processHyphenatedToken().')
+METRICS.describe('uc_dictionary_load_seconds', 'Time to load a dictionary.')
+
+def record_check(text, table):
+  '''Record the size and unknown word rate of a checked document.'''
+  if not METRICS.enabled: return
+  words = len(table)
+  unknown = table.count_unknown()
+  METRICS.inc('uc_documents_total')
+  METRICS.observe('uc_document_characters', len(text), SIZE_BUCKETS)
+  METRICS.inc('uc_tokens_total', words)
+  METRICS.inc('uc_unknown_tokens_total', unknown)
+  if words:
+    METRICS.observe('uc_unknown_rate', float(unknown) / words, RATE_BUCKETS)
+
+def file_version(path, st=None):
+  '''Return a string that changes whenever the file at "path" does.'''
+  if st is None: st = os.stat(path)
+  return '%x-%x' % (int(st.st_mtime * 1000), st.st_size)
+
+class _DictionaryEntry(object):
+  '''A loaded dictionary together with the file state it was loaded from.'''
+  def __init__(self, words, st, checked):
+    self.words = words
+    self.mtime = st.st_mtime
+    self.size = st.st_size
+    self.checked = checked
+    self.version = file_version(None, st)
+
+class DictionaryRegistry(object):
+  '''Process wide cache of loaded dictionaries.
+
+  Each dictionary file is loaded once per process and shared by every
+  caller. The file is stat'ed at most once every "check_interval" seconds
+  and when its mtime or size changed it is loaded again. The new copy is
+  swapped in with a single assignment so concurrent readers see either
+  the old or the new dictionary, never a partially built one.'''
+
+  def __init__(self, loader=None, check_interval=1.0):
+    self.loader = loader or load_dictionary
+    self.check_interval = check_interval
+    self._entries = {}
+    self._lock = threading.Lock()
+
+  def _entry(self, path):
+    entry = self._entries.get(path)
+    now = time.time()
+    if entry and now - entry.checked < self.check_interval:
+      return entry
+
+    st = os.stat(path)
+    if entry and (entry.mtime, entry.size) == (st.st_mtime, st.st_size):
+      entry.checked = now
+      return entry
+
+    #Only one thread loads a changed dictionary, the others wait for it and
+    #then pick up the fresh entry.
+    with self._lock:
+      current = self._entries.get(path)
+      if current is not entry and current is not None:
+        return current
+      words = self.loader(path)
+      if METRICS.enabled:
+        METRICS.observe('uc_dictionary_load_seconds', time.time() - now,
+                        dictionary=path)
+      entry = _DictionaryEntry(words, st, now)
+      self._entries[path] = entry
+      return entry
+
+  def get(self, path=DICT):
+    '''Return the words of dictionary "path", loading it if needed.'''
+    return self._entry(path).words
+
+  def version(self, path=DICT):
+    '''Return a string identifying the currently loaded copy of "path".'''
+    return self._entry(path).version
+
+  def warm(self, path=DICT):
+    '''Load "path" now so the first real lookup does not pay for it.'''
+    self._entry(path)
+
+  def clear(self):
+    with self._lock:
+      self._entries = {}
+
+REGISTRY = DictionaryRegistry()
+
+def get_dictionary(path=DICT):
+  '''Return the shared copy of dictionary "path". See DictionaryRegistry.'''
+  return REGISTRY.get(path)
+
+def warm_dictionary(path=DICT):
+  '''Load dictionary "path" into the shared registry ahead of time.'''
+  REGISTRY.warm(path)
+
+class LayeredDictionary(object):
+  '''Read only stack of dictionaries, such as a shared base dictionary,
+  domain dictionaries and a small per-request word list. A word is in the
+  stack if it is in any layer; lookups try the layers in order and stop at
+  the first that has it, so nothing is copied when a stack is made.
+
+  Verdict caches remember verdicts for "base", the first layer, which is
+  usually shared between requests, and only ask the other layers about
+  words the base does not know. See VerdictCache.known().'''
+
+  def __init__(self, base, *layers):
+    self.base = base
+    self.layers = (base,) + layers
+
+  def __contains__(self, word):
+    for layer in self.layers:
+      if word in layer: return True
+    return False
+
+  def __iter__(self):
+    seen = set()
+    for layer in self.layers:
+      for word in layer:
+        if word not in seen:
+          seen.add(word)
+          yield word
+
+  def __len__(self):
+    return sum(1 for word in self)
+
+def word_list(words):
+  '''Return the iterable "words" as a dictionary layer, case-folded like
+  the words of load_words().'''
+  return frozenset(w.strip().lower() for w in words if w.strip())
+
+def layered_dictionary(path=DICT, word_lists=(), words=()):
+  '''Return dictionary "path" from the registry, with the word list files
+  "word_lists" (also from the registry) and the iterable "words" layered on
+  top of it. Without extra words the registry's dictionary is returned.'''
+  layers = [get_dictionary(p) for p in word_lists]
+  words = word_list(words)
+  if words: layers.append(words)
+  if not layers: return get_dictionary(path)
+  return LayeredDictionary(get_dictionary(path), *layers)
+
 def word_in_dictionary(word, dict): 
     try:
         if word in dict: return True
@@ -300,7 +920,574 @@ def word_in_dictionary(word, dict):
         print "WARNING: " + word
 
 
-def printoutput_and_colorize(dict,text,isHTML):
+def word_is_known(word, dict):
+  '''Return True if the normalized "word" is recognized. Numbers are always
+  recognized and hyphenated tokens are resolved by processHyphenatedToken().'''
+  if word.isdigit(): return True #skip digits
+  hidx = word.find('-')
+  if hidx == -1:
+    return word_in_dictionary(word.lower(),dict)
+  if METRICS.enabled:
+    start = time.time()
+    known = processHyphenatedToken(word.lower(),hidx,dict)
+    METRICS.inc('uc_hyphenated_tokens_total')
+    METRICS.lap('hyphen', start)
+    return known
+  return processHyphenatedToken(word.lower(),hidx,dict)
+
+VERDICT_CACHE_SIZE = 100000
+
+def _uncached(dict):
+  return lambda word: bool(word_is_known(word, dict))
+
+class _Verdicts(object):
+  '''The verdicts a VerdictCache keeps for one dictionary. Only a weak
+  reference to the dictionary is held, since a strong one from the value
+  of a WeakKeyDictionary would keep its key alive. "dropped" is called
+  with the verdicts once the dictionary is collected.'''
+
+  def __init__(self, dict, size, dropped=None):
+    self.dropped = dropped
+    self.ref = weakref.ref(dict, lambda ref: self.dropped and
+                                             self.dropped(self))
+    self.generation = max(size // 2, 1)
+    self.hits = 0
+    self.misses = 0
+    self.young = {}
+    self.old = {}
+
+  def known(self, word):
+    verdict = self.young.get(word)
+    if verdict is not None:
+      self.hits += 1
+      return verdict
+
+    verdict = self.old.get(word)
+    if verdict is None:
+      self.misses += 1
+      verdict = bool(word_is_known(word, self.ref()))
+    else:
+      self.hits += 1
+    young = self.young
+    young[word] = verdict
+    if len(young) >= self.generation:
+      self.old, self.young = young, {}
+    return verdict
+
+class VerdictCache(object):
+  '''Bounded cache of word_is_known() verdicts keyed by the surface token.
+
+  Prose repeats the same few thousand tokens over and over, so remembering
+  the verdict for each saves lowercasing the token and probing the
+  dictionary again, several times for hyphenated tokens.
+
+  Tokens are kept in two generations of at most "size"/2 entries each.
+  New and recently used tokens go into the young generation; when it is
+  full it becomes the old one and the previous old generation, the least
+  recently used tokens, is dropped. This approximates LRU eviction with
+  plain dictionary operations, which is what makes a hit cheaper than a
+  lookup. The hit and miss counters are not locked and may undercount
+  slightly when several threads check at once. They add up over every
+  dictionary the cache has seen, collected ones included.
+
+  Verdicts are kept per dictionary object, for as long as the object is
+  alive, so threads checking against different dictionaries never see each
+  other's verdicts. A dictionary must not be changed in place while it is
+  cached.
+
+  lookup() is called once per text and returns the function that is
+  called per word, so a hit is two dictionary probes and no method
+  dispatch; that is what keeps it cheaper than even a frozenset lookup.'''
+
+  def __init__(self, size=VERDICT_CACHE_SIZE):
+    self.size = size
+    self.hits = 0 #of dictionaries since collected
+    self.misses = 0
+    self._lock = threading.Lock()
+    self._verdicts = weakref.WeakKeyDictionary()
+
+  def lookup(self, dict):
+    '''Return a function of a normalized word that returns whether the
+    word is known in "dict", remembering the verdicts.'''
+    if isinstance(dict, LayeredDictionary):
+      #Whatever the base knows the stack knows too, and overlays change
+      #from request to request, so only the base's verdicts are kept.
+      base = self.lookup(dict.base)
+      return lambda word: base(word) or bool(word_is_known(word, dict))
+    with self._lock:
+      try:
+        verdicts = self._verdicts.get(dict)
+        if verdicts is None:
+          verdicts = self._verdicts[dict] = _Verdicts(dict, self.size,
+                                                      self._dropped)
+      except TypeError:
+        return _uncached(dict) #cannot be weakly referenced
+    return verdicts.known
+
+  def known(self, word, dict):
+    return self.lookup(dict)(word)
+
+  def _dropped(self, verdicts):
+    #Called from the garbage collector, maybe while _lock is held.
+    self.hits += verdicts.hits
+    self.misses += verdicts.misses
+
+  def clear(self):
+    with self._lock:
+      for verdicts in self._verdicts.values(): verdicts.dropped = None
+      self._verdicts = weakref.WeakKeyDictionary()
+      self.hits = self.misses = 0
+
+  def stats(self):
+    '''Return the hit and miss counters and the current number of entries,
+    over all dictionaries.'''
+    with self._lock:
+      verdicts = self._verdicts.values()
+    return {'hits': self.hits + sum(v.hits for v in verdicts),
+            'misses': self.misses + sum(v.misses for v in verdicts),
+            'entries': sum(len(set(v.young) | set(v.old)) for v in verdicts),
+            'size': self.size}
+
+VERDICTS = VerdictCache()
+
+def verdict_lookup(dict, cache=VERDICTS):
+  '''Return a function telling whether a normalized word is known in
+  "dict", remembering verdicts in "cache" unless it is None.'''
+  if cache is None: return _uncached(dict)
+  return cache.lookup(dict)
+
+
+RESULT_CACHE_BYTES = 64 * 1024 * 1024
+
+class ResultCache(object):
+  '''Bounded cache of rendered check results.
+
+  Results are keyed by key(), a hash of the input text, the dictionary
+  version and the output format, so a new dictionary never serves stale
+  results. The cache holds at most "max_bytes" of results in memory and
+  evicts the least recently used ones first. When "directory" is given
+  results are also written there, up to "disk_bytes", and survive a
+  restart of the process: a result evicted from memory, or computed by an
+  earlier process, is read back from disk.'''
+
+  def __init__(self, max_bytes=RESULT_CACHE_BYTES, directory=None,
+               disk_bytes=None):
+    self.max_bytes = max_bytes
+    self.directory = directory
+    self.disk_bytes = disk_bytes if disk_bytes is not None else 4 * max_bytes
+    self.bytes = 0
+    self.hits = 0
+    self.disk_hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self._results = OrderedDict()
+    self._lock = threading.Lock()
+    self._disk = OrderedDict() #file sizes, least recently used first
+    self._disk_total = 0
+    if directory:
+      self._scan()
+
+  @staticmethod
+  def key(text, version, format):
+    if isinstance(text, unicode): text = text.encode('utf-8')
+    return hashlib.sha1('%s\0%s\0%s' % (version, format, text)).hexdigest()
+
+  def get(self, key):
+    with self._lock:
+      value = self._results.pop(key, None)
+      if value is not None:
+        self._results[key] = value
+        self.hits += 1
+        return value
+
+    value = self._read(key)
+    with self._lock:
+      if value is None:
+        self.misses += 1
+        return None
+      self.disk_hits += 1
+      self._store(key, value)
+    return value
+
+  def put(self, key, value):
+    with self._lock:
+      self._store(key, value)
+    self._write(key, value)
+
+  def _store(self, key, value):
+    if len(value) > self.max_bytes: return
+    old = self._results.pop(key, None)
+    if old is not None: self.bytes -= len(old)
+    self._results[key] = value
+    self.bytes += len(value)
+    while self.bytes > self.max_bytes:
+      evicted_key,evicted = self._results.popitem(last=False)
+      self.bytes -= len(evicted)
+      self.evictions += 1
+
+  def _path(self, key):
+    return os.path.join(self.directory, key[:2], key)
+
+  def _scan(self):
+    '''Index the results an earlier process left in the directory.'''
+    found = []
+    for root,dirs,names in os.walk(self.directory):
+      for name in names:
+        #Left behind by a write that did not finish
+        if name.endswith('.tmp'): continue
+        try: st = os.stat(os.path.join(root, name))
+        except OSError: continue
+        found.append((st.st_mtime, name, st.st_size))
+    for mtime,name,size in sorted(found):
+      self._disk[name] = size
+      self._disk_total += size
+    self._trim_disk()
+
+  def _read(self, key):
+    if not self.directory: return None
+    path = self._path(key)
+    #Another process sharing the directory may have written it since.
+    if key not in self._disk and not os.path.exists(path): return None
+    try:
+      f = open(path, 'rb')
+      try: value = f.read()
+      finally: f.close()
+      os.utime(path, None)
+    except (IOError, OSError):
+      return None
+    with self._lock:
+      if key in self._disk:
+        self._disk[key] = self._disk.pop(key)
+      else:
+        self._disk[key] = len(value)
+        self._disk_total += len(value)
+        self._trim_disk()
+    return value
+
+  def _write(self, key, value):
+    if not self.directory or key in self._disk: return
+    if len(value) > self.disk_bytes: return
+    path = self._path(key)
+    try:
+      if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+      tmp = '%s.%d.tmp' % (path, os.getpid())
+      f = open(tmp, 'wb')
+      try: f.write(value)
+      finally: f.close()
+      os.rename(tmp, path)
+    except (IOError, OSError):
+      return
+
+    with self._lock:
+      self._disk[key] = len(value)
+      self._disk_total += len(value)
+      self._trim_disk()
+
+  def _trim_disk(self):
+    '''Delete the least recently used results until the ones left on disk
+    fit in "disk_bytes".'''
+    while self._disk_total > self.disk_bytes:
+      evicted_key,size = self._disk.popitem(last=False)
+      self._disk_total -= size
+      try: os.remove(self._path(evicted_key))
+      except OSError: pass
+
+  def stats(self):
+    '''Return the hit, miss and eviction counters and the cache size.'''
+    return {'hits': self.hits, 'disk_hits': self.disk_hits,
+            'misses': self.misses, 'evictions': self.evictions,
+            'entries': len(self._results), 'bytes': self.bytes,
+            'disk_entries': len(self._disk), 'disk_bytes': self._disk_total}
+
+def find_unknown_words(words,idxs,dict,cache=VERDICTS):
+  '''Look up the normalized "words" found at positions "idxs".
+  Return the positions of the unrecognized words and the set of them.
+  Verdicts are remembered in "cache", a VerdictCache, unless it is None.'''
+  unknown_word_idx = []
+  unknown_word_set = set()
+  known = verdict_lookup(dict, cache)
+  for word,idx in zip(words,idxs):
+    if not known(word):
+      unknown_word_idx.append(idx)
+      unknown_word_set.add(word)
+  return unknown_word_idx,unknown_word_set
+
+class TokenTable(object):
+  '''Compact table of the normalized words of a text.
+
+  Positions are kept in two array('l') columns and the verdicts in a
+  bitmap with one bit per word, set for unrecognized words. A word is only
+  built, by slicing the text, when it is asked for, so a table costs about
+  17 bytes per word where lists of words and (start, end) tuples cost well
+  over a hundred. Iterating over a table yields its words.'''
+
+  def __init__(self, text, starts=None, ends=None):
+    self.text = text
+    self.starts = starts if starts is not None else array.array('l')
+    self.ends = ends if ends is not None else array.array('l')
+    self.unknown = bytearray((len(self.starts) + 7) // 8)
+
+  def __len__(self):
+    return len(self.starts)
+
+  def __getitem__(self, i):
+    return fold_apostrophes(self.text[self.starts[i]:self.ends[i]])
+
+  def __iter__(self):
+    text = fold_apostrophes(self.text)
+    for start,end in itertools.izip(self.starts, self.ends):
+      yield text[start:end]
+
+  def idx(self, i):
+    return self.starts[i], self.ends[i]
+
+  def idxs(self):
+    '''Iterate over the (start, end) positions of all words.'''
+    return itertools.izip(self.starts, self.ends)
+
+  def set_unknown(self, i, unknown=True):
+    if unknown: self.unknown[i >> 3] |= 1 << (i & 7)
+    else: self.unknown[i >> 3] &= ~(1 << (i & 7)) & 0xff
+
+  def is_unknown(self, i):
+    return bool(self.unknown[i >> 3] & (1 << (i & 7)))
+
+  def unknown_indices(self, first=0):
+    '''Iterate over the indices of the unrecognized words from "first" on.'''
+    for i in xrange(first >> 3, len(self.unknown)):
+      byte = self.unknown[i]
+      if not byte: continue
+      for bit in xrange(8):
+        j = (i << 3) | bit
+        if byte & (1 << bit) and j >= first:
+          yield j
+
+  def unknown_idxs(self):
+    '''Iterate over the positions of the unrecognized words.'''
+    for j in self.unknown_indices():
+      yield self.starts[j], self.ends[j]
+
+  def count_unknown(self):
+    '''Return the number of unrecognized words.'''
+    return sum(bin(byte).count('1') for byte in self.unknown)
+
+  def nbytes(self):
+    '''Return the memory used by the positions and verdicts, in bytes.'''
+    return (len(self.starts) * self.starts.itemsize +
+            len(self.ends) * self.ends.itemsize + len(self.unknown))
+
+def tokenize_table(text):
+  '''Like tokenize() but return the words of "text" as a TokenTable.'''
+  starts = array.array('l')
+  ends = array.array('l')
+  _tokenize_spans(fold_apostrophes(text), starts, ends)
+  return TokenTable(text, starts, ends)
+
+def check_table(table, dict, cache=VERDICTS):
+  '''Set the verdict of every word of the TokenTable "table". Return the
+  set of unrecognized words. See find_unknown_words().'''
+  unknown_word_set = set()
+  known = verdict_lookup(dict, cache)
+  for i,word in enumerate(table):
+    if not known(word):
+      table.set_unknown(i)
+      unknown_word_set.add(word)
+  return unknown_word_set
+
+def reference_table(text):
+  '''tokenize_table() done by regex_word_search_idx(), the original
+  implementation of the tokenizing and grouping rules.'''
+  words,idxs = regex_word_search_idx(text)
+  return TokenTable(text, array.array('l', [start for start,end in idxs]),
+                    array.array('l', [end for start,end in idxs]))
+
+def reference_check(table, dict, cache=None):
+  '''check_table() done by find_unknown_words(), which looks every word up
+  with word_is_known(); "cache" is ignored.'''
+  unknown_word_idx,unknown_word_set = find_unknown_words(
+    list(table), list(table.idxs()), dict, None)
+  unknown_word_idx = set(unknown_word_idx)
+  for i,idx in enumerate(table.idxs()):
+    if idx in unknown_word_idx: table.set_unknown(i)
+  return unknown_word_set
+
+def numpy_check(table, dict, cache=VERDICTS):
+  '''check_table() with the lookups done in batches, see ucvector.py.'''
+  import ucvector
+  return ucvector.check_table(table, dict, cache)
+
+def _numpy_available():
+  try:
+    import ucvector
+  except ImportError:
+    return False
+  return ucvector.available()
+
+class Engine(object):
+  '''A named way of checking text. "tokenize" returns the TokenTable of a
+  text, as tokenize_table() does, and "check" sets the verdicts of its
+  words and returns the set of unrecognized ones, as check_table() does.
+  "available", if given, says whether the engine can run here.'''
+
+  def __init__(self, name, tokenize, check, available=None):
+    self.name = name
+    self.tokenize = tokenize
+    self.check = check
+    self._available = available
+
+  def available(self):
+    return self._available is None or self._available()
+
+  def __call__(self, text, dict, cache=VERDICTS):
+    '''Check "text" and return its TokenTable, with the verdicts set.'''
+    table = self.tokenize(text)
+    self.check(table, dict, cache)
+    return table
+
+#Engines selectable by name with get_engine(). Every engine must give
+#exactly the words, positions and verdicts of "reference"; ucdiff.py
+#checks that they do.
+ENGINES = {}
+DEFAULT_ENGINE = 'table'
+
+def register_engine(engine):
+  ENGINES[engine.name] = engine
+  return engine
+
+register_engine(Engine('reference', reference_table, reference_check))
+register_engine(Engine('table', tokenize_table, check_table))
+register_engine(Engine('numpy', tokenize_table, numpy_check,
+                       _numpy_available))
+
+def get_engine(name=None):
+  '''Return the Engine called "name", DEFAULT_ENGINE if it is None. Raises
+  ValueError if there is no such engine or it cannot run here.'''
+  name = name or DEFAULT_ENGINE
+  engine = ENGINES.get(name)
+  if engine is None:
+    raise ValueError('unknown engine %r, use one of: %s' %
+                     (name, ', '.join(sorted(ENGINES))))
+  if not engine.available():
+    raise ValueError('engine %r cannot run here' % name)
+  return engine
+
+class CheckState(object):
+  '''The text of a document and its checked TokenTable, kept between edits
+  so that recheck() only needs to look at the part of the text an edit
+  touched.'''
+
+  def __init__(self, text, table, dict):
+    self.text = text
+    self.table = table
+    self.dict = dict
+
+  def unknown_idxs(self):
+    return self.table.unknown_idxs()
+
+class CheckDelta(object):
+  '''What an edit changed: the unrecognized words between "start" and "end"
+  of the new text are now exactly "unknown", and every position after the
+  region moved by "shift" characters. "end - shift" is where the region
+  ended in the old text.'''
+
+  def __init__(self, start, end, shift, unknown):
+    self.start = start
+    self.end = end
+    self.shift = shift
+    self.unknown = unknown
+
+def check_state(text, dict, cache=VERDICTS):
+  '''Check "text" and return a CheckState for later calls to recheck().'''
+  table = tokenize_table(text)
+  check_table(table, dict, cache)
+  return CheckState(text, table, dict)
+
+def recheck(state, offset, deleted, inserted, dict=None, cache=VERDICTS):
+  '''Apply an edit to a checked document and check only what it affects.
+
+  The edit replaces the "deleted" characters at "offset" by the string
+  "inserted". The text is tokenized again from the end of the last word
+  that ends grouping (see ends_grouping()) and ends at least two
+  characters before the edit, so no capitalized run is cut in half and
+  WORD_PAT's look ahead is not affected. Tokenizing stops at the first
+  word after the edit that ends grouping and was already a word of the
+  old text at the same place; every word after it is the old word
+  shifted by the change in length.
+
+  Returns the new CheckState and a CheckDelta. Passing a different "dict"
+  than the state was checked with checks the whole text again.'''
+  old = state.table
+  text = state.text
+  if offset < 0 or deleted < 0 or offset + deleted > len(text):
+    raise ValueError('edit outside of the text')
+  if dict is None: dict = state.dict
+  new_text = text[:offset] + inserted + text[offset + deleted:]
+  shift = len(inserted) - deleted
+  if dict is not state.dict:
+    new_state = check_state(new_text, dict, cache)
+    return new_state, CheckDelta(0, len(new_text), shift,
+                                 list(new_state.unknown_idxs()))
+
+  #Words up to and including old.starts[keep - 1] are left as they are.
+  keep = bisect.bisect_right(old.ends, offset - 2)
+  cut = 0
+  while keep > 0:
+    match = WORD_PAT.match(text, old.starts[keep - 1])
+    if match.end() <= offset - 2 and ends_grouping(match.group(0)):
+      cut = match.end()
+      break
+    keep -= 1
+
+  #Find where the new tokenization falls back in step with the old one.
+  resume = len(old)
+  region_end = len(new_text)
+  edit_end = offset + len(inserted)
+  for match in WORD_PAT.finditer(new_text, cut):
+    start = match.start()
+    if start < edit_end or not ends_grouping(match.group(0)): continue
+    k = bisect.bisect_left(old.starts, start - shift)
+    if k < len(old) and old.starts[k] == start - shift:
+      resume = k + 1
+      region_end = match.end()
+      break
+
+  region = tokenize_table(new_text[cut:region_end])
+  check_table(region, dict, cache)
+
+  starts = old.starts[:keep]
+  ends = old.ends[:keep]
+  starts.extend(start + cut for start in region.starts)
+  ends.extend(end + cut for end in region.ends)
+  starts.extend(start + shift for start in old.starts[resume:])
+  ends.extend(end + shift for end in old.ends[resume:])
+  table = TokenTable(new_text, starts, ends)
+
+  #Copy the verdicts. The bitmaps are sparse so only set bits are visited.
+  unknown = []
+  table.unknown[:keep >> 3] = old.unknown[:keep >> 3]
+  for i in old.unknown_indices(keep & ~7):
+    if i >= keep: break
+    table.set_unknown(i)
+  for i in region.unknown_indices():
+    table.set_unknown(keep + i)
+    unknown.append((region.starts[i] + cut, region.ends[i] + cut))
+  moved = keep + len(region) - resume
+  for i in old.unknown_indices(resume):
+    table.set_unknown(i + moved)
+
+  delta = CheckDelta(cut, region_end, shift, unknown)
+  return CheckState(new_text, table, dict), delta
+
+def stat_line(unknown_word_set, word_set):
+  '''Return the summary line printed below the checked text.'''
+  stat = 'Unrecognized unique words / unique Words (%d/%d): Percent %f' 
+  percentage = 0.0
+  if word_set:
+    percentage = (float(len(unknown_word_set)) / len(word_set)) * 100
+  return stat % (len(unknown_word_set),len(word_set), percentage)
+
+def printoutput_and_colorize(dict,text,isHTML,workers=None):
   '''Output input text but with unrecognized words highlighted.  Console or HTML.
 
   There is a bug that sometimes highlights the empty space at the end
@@ -314,73 +1501,334 @@ def printoutput_and_colorize(dict,text,isHTML):
   Viewing the output of this program with 'less -R' works properly though
   so it is probably a bug somewhere in whatever display mechanism konsole,
   gnome terminal and xterm share.
-  
+
+  With "workers" a large text is checked in that many processes, see
+  check_parallel().
   '''
 
-  words,idxs = regex_word_search_idx(text)
-  unknown_word_idx = []
-  unknown_word_set = set()
-  for word,idx in zip(words,idxs):
-        if word.isdigit(): continue #skip digits
-
-        hidx = word.find('-')
-        if hidx == -1 :
-            if not word_in_dictionary(word.lower(),dict):
-              unknown_word_idx.append(idx)
-              unknown_word_set.add(word)
-        elif not processHyphenatedToken(word.lower(),hidx,dict):
-          unknown_word_idx.append(idx)
-          unknown_word_set.add(word)
-
-  #Highlight unknown words 
-
-  if isHTML:
-    delim_begin = '<span class="unknownword">'
-    delim_end = '</span>'
+  if workers:
+    table,unknown_word_set,word_set = check_parallel(text, dict, workers)
   else:
-    #See more ANSI color codes here: 
-    #http://pueblo.sourceforge.net/doc/manual/ansi_color_codes.html
-    delim_begin = "\x1b[42m"
-    delim_end = "\x1b[0m"
+    table = tokenize_table(text)
+    unknown_word_set = check_table(table, dict)
+    word_set = set(table)
+  stat = stat_line(unknown_word_set, word_set)
 
+  out = cStringIO.StringIO()
+  if isHTML: renderer = HtmlRenderer(out)
+  else: renderer = AnsiRenderer(out)
+  render(renderer, text, table, stat)
+  return out.getvalue()
 
-  '''Force output to be in utf-8. On certain systems, including mine
+class Renderer(object):
+  '''Writes checked text to the file-like object "out".
+
+  Force output to be in utf-8. On certain systems, including mine
   the default encoding reported by 'sys.getdefaultencoding()' is ascii.
   What this means is that if you redirect the output of this program
   into a file it will attempt to first convert the output into ascii and
-  will crash. Instead, create byte strings and save these. 
-  See: http://bugs.python.org/issue4947 for a possible relation?'''
-
-  buf = []
-  def output(offset,uwidx_iter):
-    try: start,end = uwidx_iter.next()
-    except StopIteration: 
-      buf.append(text[offset:].encode('utf-8'))
-      return
-    buf.append(text[offset:start].encode('utf-8'))
-    buf.append(delim_begin)
-    buf.append(text[start:end].encode('utf-8'))
-    buf.append(delim_end)
-    output(end,uwidx_iter)
+  will crash. Instead, write byte strings.
+  See: http://bugs.python.org/issue4947 for a possible relation?
 
-  output(0,iter(unknown_word_idx))
+  A check is rendered by one call to begin(), any number of calls to
+  text() and unknown() in document order, and one call to end(). The
+  statistics line is passed to begin() when it is known up front, as
+  with printoutput_and_colorize(), and to end() in any case.'''
 
-  stat = 'Unrecognized unique words / unique Words (%d/%d): Percent %f' 
-  word_set = set(words)
-  percentage = (float(len(unknown_word_set)) / len(word_set)) * 100
+  def __init__(self, out, suggest=None):
+    self.out = out
+    self.pos = 0 #offset into the checked text of the next segment
+    #Optional function returning corrections for an unknown word, such as
+    #ucsuggest.SuggestionIndex.suggest.
+    self.suggest = suggest
 
-  stat = stat % (len(unknown_word_set),len(word_set), percentage)
+  def suggestions(self, segment):
+    if self.suggest is None: return []
+    return self.suggest(fold_apostrophes(segment))
 
-  if isHTML:
-    return generate_html() % (stat,''.join(buf))
-  else:
-    buf.append(os.linesep)
-    buf.append(stat)
-    return ''.join(buf)
+  def begin(self, stat=None):
+    pass
 
-def generate_html():
-  '''Generate html output'''
-  return '''
+  def text(self, segment):
+    self.out.write(segment.encode('utf-8'))
+    self.pos += len(segment)
+
+  def unknown(self, segment):
+    self.text(segment)
+
+  def end(self, stat):
+    pass
+
+class AnsiRenderer(Renderer):
+  '''Console output with unknown words on a green background.'''
+
+  #See more ANSI color codes here: 
+  #http://pueblo.sourceforge.net/doc/manual/ansi_color_codes.html
+  delim_begin = "\x1b[42m"
+  delim_end = "\x1b[0m"
+
+  def unknown(self, segment):
+    self.out.write(self.delim_begin)
+    self.text(segment)
+    self.out.write(self.delim_end)
+    suggestions = self.suggestions(segment)
+    if suggestions:
+      self.out.write('\x1b[2m[%s]\x1b[0m' %
+                     u', '.join(suggestions).encode('utf-8'))
+
+  def end(self, stat):
+    self.out.write(os.linesep)
+    self.out.write(stat)
+
+class HtmlRenderer(AnsiRenderer):
+  '''The page of generate_html(), written as a header, the highlighted
+  text and a footer. When the statistics line is only known at the end
+  it is placed below the text instead of above it.'''
+
+  delim_begin = '<span class="unknownword">'
+  delim_end = '</span>'
+
+  def unknown(self, segment):
+    suggestions = self.suggestions(segment)
+    if suggestions:
+      title = cgi.escape(u', '.join(suggestions), True).encode('utf-8')
+      self.out.write('<span class="unknownword" title="%s">' % title)
+    else:
+      self.out.write(self.delim_begin)
+    self.text(segment)
+    self.out.write(self.delim_end)
+
+  def begin(self, stat=None):
+    self.out.write(HTML_HEAD)
+    if stat is not None:
+      self.out.write(HTML_STAT % stat)
+    self.out.write(HTML_DOC_BEGIN)
+    self.stat_written = stat is not None
+
+  def end(self, stat):
+    self.out.write(HTML_DOC_END)
+    if not self.stat_written:
+      self.out.write('\n' + HTML_STAT % stat)
+    self.out.write(HTML_TAIL)
+
+class OffsetRenderer(Renderer):
+  '''One "start<TAB>end<TAB>word" line per unknown word followed by the
+  statistics line. Offsets count characters of the decoded text.'''
+
+  def text(self, segment):
+    self.pos += len(segment)
+
+  def unknown(self, segment):
+    line = '%d\t%d\t%s' % (self.pos, self.pos + len(segment),
+                           segment.encode('utf-8'))
+    suggestions = self.suggestions(segment)
+    if suggestions:
+      line += '\t' + u','.join(suggestions).encode('utf-8')
+    self.out.write(line + '\n')
+    self.pos += len(segment)
+
+  def end(self, stat):
+    self.out.write(stat)
+
+class JsonRenderer(Renderer):
+  '''Compact JSON: {"unknown":[[start,end],...],"stat":"..."}. Offsets
+  count characters of the decoded text. With suggestions there is also a
+  "suggestions" object mapping each unknown word to its corrections.'''
+
+  def begin(self, stat=None):
+    self.out.write('{"unknown":[')
+    self.first = True
+    self.corrections = {}
+
+  def text(self, segment):
+    self.pos += len(segment)
+
+  def unknown(self, segment):
+    if self.first: self.first = False
+    else: self.out.write(',')
+    self.out.write('[%d,%d]' % (self.pos, self.pos + len(segment)))
+    self.pos += len(segment)
+    word = fold_apostrophes(segment)
+    if self.suggest is not None and word not in self.corrections:
+      self.corrections[word] = self.suggest(word)
+
+  def end(self, stat):
+    self.out.write('],"stat":%s' % json.dumps(stat))
+    if self.suggest is not None:
+      self.out.write(',"suggestions":%s' %
+                     json.dumps(self.corrections, separators=(',', ':')))
+    self.out.write('}')
+
+RENDERERS = {'ansi': AnsiRenderer,
+             'html': HtmlRenderer,
+             'json': JsonRenderer,
+             'offsets': OffsetRenderer}
+
+def render(renderer, text, unknown_word_idx, stat):
+  '''Render "text" with the words at "unknown_word_idx" highlighted. The
+  positions may also be given as a checked TokenTable.'''
+  if isinstance(unknown_word_idx, TokenTable):
+    unknown_word_idx = unknown_word_idx.unknown_idxs()
+  renderer.begin(stat)
+  offset = 0
+  for start,end in unknown_word_idx:
+    renderer.text(text[offset:start])
+    renderer.unknown(text[start:end])
+    offset = end
+  renderer.text(text[offset:])
+  renderer.end(stat)
+
+def write_output(out, dict, text, format='html', suggest=None,
+                 engine=None, names=None):
+  '''Check "text" and write the result straight to the file-like object
+  "out", which may be a WSGI response, using the renderer named "format".
+  "suggest" is passed on to the renderer, see Renderer. "engine" names the
+  Engine that checks the text, see get_engine(). "names" is a
+  ucnames.Gazetteer: runs of capitalized words are split into the names it
+  knows and the words left over. Returns the checked TokenTable.'''
+  engine = get_engine(engine)
+  t = METRICS.clock()
+  table = engine.tokenize(text)
+  if names is not None:
+    table = names.split(table)
+    dict = LayeredDictionary(dict, names)
+  t = METRICS.lap('tokenize', t)
+  unknown_word_set = engine.check(table, dict, VERDICTS)
+  stat = stat_line(unknown_word_set, set(table))
+  t = METRICS.lap('lookup', t)
+  render(RENDERERS[format](out, suggest), text, table, stat)
+  METRICS.lap('render', t)
+  record_check(text, table)
+  return table
+
+CHUNK_SIZE = 64 * 1024
+MAX_PENDING = 1024 * 1024
+
+def read_chunks(fobj, chunk_size=CHUNK_SIZE, encoding='utf-8'):
+  '''Read the byte stream "fobj" and yield it decoded, "chunk_size" bytes
+  at a time. Multibyte characters split between reads are carried over.'''
+  decoder = codecs.getincrementaldecoder(encoding)()
+  while True:
+    data = fobj.read(chunk_size)
+    if not data: break
+    chunk = decoder.decode(data)
+    if chunk: yield chunk
+  chunk = decoder.decode('', final=True)
+  if chunk: yield chunk
+
+def ends_grouping(word):
+  '''Return True if normalize_text() can never join the raw token "word"
+  with the tokens around it. Such a token is neither capitalized nor a
+  connector, so once it has been seen no capitalized run is pending and
+  the text before and after it can be normalized independently.'''
+  return not word[0].isupper() and not adjacent_connector(word)
+
+def safe_split(text, start=0):
+  '''Return the largest offset in "text" after "start" at which the text
+  can be cut without changing how either half is tokenized and normalized,
+  or None if there is no such offset.
+
+  The cut is placed right after a token that ends grouping (see
+  ends_grouping()). WORD_PAT may look up to two characters past the end
+  of a match to rule out a longer one, so the token must end at least two
+  characters before the end of "text" for its match to be final.'''
+  cut = None
+  limit = len(text) - 2
+  for match in WORD_PAT.finditer(text, start):
+    if match.end() > limit: break
+    if ends_grouping(match.group(0)):
+      cut = match.end()
+  return cut
+
+class CheckStats(object):
+  '''Unique words and unrecognized unique words seen by a streaming check.'''
+  def __init__(self):
+    self.words = set()
+    self.unknown = set()
+
+  def line(self):
+    return stat_line(self.unknown, self.words)
+
+def stream_segments(chunks, dict, stats=None, max_pending=MAX_PENDING,
+                    engine=None, names=None):
+  '''Check the text made of the unicode strings "chunks" and yield it back
+  as (segment, unknown) pairs where "unknown" is True for unrecognized words.
+
+  Text is held back only until a safe split point (see safe_split()) is
+  seen, so memory use depends on the chunk size rather than the size of
+  the document. Should a capitalized run grow past "max_pending"
+  characters it is split at the last white space instead, and only that
+  run may be grouped differently than by printoutput_and_colorize().
+  Unique word statistics are collected into
+  "stats", a CheckStats object, when given. "engine" and "names" are as
+  for write_output().'''
+  engine = get_engine(engine)
+  if names is not None: dict = LayeredDictionary(dict, names)
+  pending = u''
+  for chunk in chunks:
+    pending += chunk
+    cut = safe_split(pending)
+    if cut is None and len(pending) > max_pending:
+      cut = max(pending.rfind(u' '), pending.rfind(u'\n')) + 1 or len(pending)
+    if cut:
+      for segment in _check_segment(pending[:cut], dict, stats, engine,
+                                    names):
+        yield segment
+      pending = pending[cut:]
+  for segment in _check_segment(pending, dict, stats, engine, names):
+    yield segment
+
+def _check_segment(text, dict, stats, engine, names):
+  table = engine.tokenize(text)
+  if names is not None: table = names.split(table)
+  unknown_word_set = engine.check(table, dict, VERDICTS)
+  if stats is not None:
+    stats.words.update(table)
+    stats.unknown.update(unknown_word_set)
+
+  offset = 0
+  for start,end in table.unknown_idxs():
+    if start > offset: yield text[offset:start], False
+    yield text[start:end], True
+    offset = end
+  if offset < len(text): yield text[offset:], False
+
+class _Collector(list):
+  '''File-like object that keeps everything written to it.'''
+  write = list.append
+
+def stream_render(fobj, dict, renderer, chunk_size=CHUNK_SIZE, engine=None,
+                  names=None):
+  '''Check the utf-8 byte stream "fobj" chunk by chunk and pass the text
+  to "renderer" as it is checked. See stream_segments().'''
+  stats = CheckStats()
+  renderer.begin()
+  for segment,unknown in stream_segments(read_chunks(fobj, chunk_size),
+                                         dict, stats, engine=engine,
+                                         names=names):
+    if unknown: renderer.unknown(segment)
+    else: renderer.text(segment)
+  renderer.end(stats.line())
+
+def stream_check(fobj, dict, chunk_size=CHUNK_SIZE, format='ansi'):
+  '''Generator version of printoutput_and_colorize(). Reads the utf-8 byte
+  stream "fobj" in chunks and yields the output of the renderer named
+  "format" as utf-8 byte strings, finishing with the statistics line.'''
+  buf = _Collector()
+  renderer = RENDERERS[format](buf)
+  stats = CheckStats()
+  renderer.begin()
+  for segment,unknown in stream_segments(read_chunks(fobj, chunk_size),
+                                         dict, stats):
+    if unknown: renderer.unknown(segment)
+    else: renderer.text(segment)
+    if buf:
+      yield ''.join(buf)
+      del buf[:]
+  renderer.end(stats.line())
+  yield ''.join(buf)
+
+HTML_HEAD = '''
 <html>
   <head>
     <meta http-equiv="Content-Type" content="text/html; charset=UTF-8"/>
@@ -419,27 +1867,393 @@ def generate_html():
 
   </head>
   <body>
-    <pre id="stat">%s</pre>
-    <pre id="doc">%s</pre>
+'''
+HTML_STAT = '''    <pre id="stat">%s</pre>
+'''
+HTML_DOC_BEGIN = '''    <pre id="doc">'''
+HTML_DOC_END = '''</pre>'''
+HTML_TAIL = '''
   </body>
 </html>'''
 
-def html_output(text):
-  '''Return html output with unknown words are highlighted.'''
-  dict = load_words(DICT)
+def generate_html():
+  '''Generate html output'''
+  return (HTML_HEAD + HTML_STAT + HTML_DOC_BEGIN + '%s' + HTML_DOC_END +
+          HTML_TAIL)
+
+def html_output(text, words=(), word_lists=()):
+  '''Return html output with unknown words are highlighted. The iterable
+  "words" and the files "word_lists" name extra words to recognize.'''
+  dict = layered_dictionary(DICT, word_lists, words)
   return printoutput_and_colorize(dict,text,isHTML=True)
 
-if __name__ == '__main__':
-    '''Script called manually, print output to the terminal'''
-    if len(sys.argv) < 2:
-        print 'usage: uc.py textfile'
-        sys.exit(1)
+def expand_paths(patterns):
+  '''Return the files named by "patterns". A pattern may be a file, a
+  directory, which is searched recursively, or a glob. Each file is listed
+  once, in the order it was first named.'''
+  seen = set()
+  files = []
+  def add(path):
+    if path not in seen:
+      seen.add(path)
+      files.append(path)
+
+  for pattern in patterns:
+    matches = sorted(glob.glob(pattern)) or [pattern]
+    for path in matches:
+      if os.path.isdir(path):
+        for root,dirs,names in os.walk(path):
+          dirs.sort()
+          for name in sorted(names):
+            add(os.path.join(root, name))
+      else:
+        add(path)
+  return files
+
+def check_file(path, dict, format='ansi', names=None):
+  '''Check the utf-8 text file "path" and return the rendered output.
+  "names" is as for write_output().'''
+  textf = codecs.open(path, encoding='utf-8')
+  text = textf.read()
+  textf.close()
+  out = cStringIO.StringIO()
+  write_output(out, dict, text, format, names=names)
+  return out.getvalue()
 
-    textf = codecs.open(sys.argv[1], encoding='utf-8')
+_batch_names = None #gazetteer shared with forked workers
+
+def _batch_check(job):
+  '''Check one file of a batch. Runs in a worker process, where the
+  dictionary comes from the registry the parent warmed before forking.'''
+  path,dict_path,word_lists,format = job
+  try:
+    dict = layered_dictionary(dict_path, word_lists)
+    return path, check_file(path, dict, format, _batch_names), None
+  except (IOError, OSError, UnicodeError), e:
+    return path, None, str(e)
+
+def check_batch(paths, dict_path=DICT, workers=None, chunksize=1,
+                ordered=True, format='ansi', word_lists=(), names=None):
+  '''Check many files with one dictionary, plus the word list files
+  "word_lists", and a pool of "workers" processes (one per CPU by default).
+  The dictionaries are loaded once, before the pool forks, so every worker
+  shares the parent's copy.
+
+  Yields a (path, output, error) tuple per file, in the order of "paths"
+  when "ordered" is True and as soon as each file is done otherwise. When
+  a file cannot be read "output" is None and "error" says why. Files are
+  handed to the workers "chunksize" at a time. "names", a
+  ucnames.Gazetteer, also reaches the workers by the fork and is used as
+  by write_output().'''
+  global _batch_names
+  for path in [dict_path] + list(word_lists):
+    warm_dictionary(path)
+  jobs = [(path, dict_path, word_lists, format) for path in paths]
+  _batch_names = names
+  try:
+    if workers == 1:
+      for job in jobs:
+        yield _batch_check(job)
+      return
+
+    pool = multiprocessing.Pool(workers)
+    try:
+      if ordered: results = pool.imap(_batch_check, jobs, chunksize)
+      else: results = pool.imap_unordered(_batch_check, jobs, chunksize)
+      for result in results:
+        yield result
+      pool.close()
+    finally:
+      pool.terminate()
+      pool.join()
+  finally:
+    _batch_names = None
+
+#Documents shorter than this are not split for check_parallel().
+PARALLEL_MIN_CHUNK = 256 * 1024
+
+_BLANK_LINE = re.compile(u'\n[^\\S\n]*\n')
+
+def _last_token(text, end):
+  '''Return the last WORD_PAT match ending at or before "end", or None.
+  Tokens never contain white space, so the search only has to start at
+  the white space before the last non-space character.'''
+  while end > 0:
+    start = end
+    while start > 0 and not text[start - 1].isspace(): start -= 1
+    last = None
+    for last in WORD_PAT.finditer(text, start, end): pass
+    if last is not None: return last
+    end = start
+    while end > 0 and text[end - 1].isspace(): end -= 1
+  return None
+
+def paragraph_splits(text, parts, min_chunk=PARALLEL_MIN_CHUNK):
+  '''Return the offsets, including 0, at which "text" can be cut into
+  about "parts" pieces of at least "min_chunk" characters, each checked on
+  its own with the same result as checking the whole text.
+
+  Cuts are made at blank lines, at the start of the next paragraph. A cut
+  is safe when the last token before it ends grouping (see
+  ends_grouping()), or when it is capitalized and so is the first token
+  after it, since normalize_text() does not join capitalized words across
+  two or more newlines. Paragraph breaks without a safe cut are skipped.'''
+  size = max(len(text) // max(parts, 1), min_chunk)
+  cuts = [0]
+  target = size
+  for gap in _BLANK_LINE.finditer(text, size):
+    if gap.start() < target: continue
+    if len(text) - gap.end() < min_chunk: break
+    cut = gap.end()
+    while cut < len(text) and text[cut].isspace(): cut += 1
+    before = _last_token(text, gap.start())
+    if before is None or before.start() < cuts[-1]: continue
+    after = WORD_PAT.search(text, cut)
+    word = before.group(0)
+    if not ends_grouping(word):
+      if adjacent_connector(word) or after is None: continue
+      if not (after.group(0)[0].isupper() and
+              count_newline(text[before.end():after.start()]) >= 2):
+        continue
+    cuts.append(cut)
+    target = cut + size
+  return cuts
+
+_parallel = None #text, dictionary, engine and names shared with workers
+
+def _check_part(span):
+  start,end = span
+  text,dict,engine,names = _parallel
+  table = engine.tokenize(text[start:end])
+  if names is not None: table = names.split(table)
+  unknown_word_set = engine.check(table, dict, VERDICTS)
+  offsets = array.array('l')
+  for s,e in table.unknown_idxs():
+    offsets.append(s + start)
+    offsets.append(e + start)
+  return offsets, set(table), unknown_word_set
+
+def check_parallel(text, dict, workers=None, min_chunk=PARALLEL_MIN_CHUNK,
+                   engine=None, names=None):
+  '''Check one large document in a pool of "workers" processes (one per
+  CPU by default), split with paragraph_splits(). Returns the positions
+  of the unrecognized words, the set of them and the set of all words,
+  exactly as checking the whole text at once would.
+
+  The text and "dict", which may be any dictionary object, reach the
+  workers by being in memory when the pool forks, so only offsets and
+  results are sent between processes. "engine" names the Engine each
+  worker checks its part with, and "names" is as for write_output(); no
+  capitalized run crosses a split, so its names are split alike.'''
+  global _parallel
+  engine = get_engine(engine)
+  if names is not None: dict = LayeredDictionary(dict, names)
+  workers = workers or multiprocessing.cpu_count()
+  cuts = paragraph_splits(text, workers, min_chunk)
+  spans = zip(cuts, cuts[1:] + [len(text)])
+  _parallel = (text, dict, engine, names)
+  try:
+    if len(spans) == 1 or workers == 1:
+      results = map(_check_part, spans)
+    else:
+      pool = multiprocessing.Pool(min(workers, len(spans)))
+      try:
+        results = pool.map(_check_part, spans)
+        pool.close()
+      finally:
+        pool.terminate()
+        pool.join()
+  finally:
+    _parallel = None
+
+  unknown_word_idx = []
+  word_set = set()
+  unknown_word_set = set()
+  for offsets,words,unknown in results:
+    unknown_word_idx.extend(zip(offsets[::2], offsets[1::2]))
+    word_set.update(words)
+    unknown_word_set.update(unknown)
+  return unknown_word_idx, unknown_word_set, word_set
+
+def main(argv=None):
+  '''Command line entry point.'''
+  parser = argparse.ArgumentParser(
+    description='Print a text file with unrecognized words highlighted.')
+  parser.add_argument('textfile', nargs='*',
+                      help='file to check; with --batch, files, directories '
+                           'or globs')
+  parser.add_argument('--dict', default=DICT,
+                      help='word list or compiled dictionary to check against')
+  parser.add_argument('--words', metavar='FILE', action='append',
+                      default=[],
+                      help='also recognize the words listed in FILE; may be '
+                           'given more than once')
+  parser.add_argument('--compile', metavar='DEST',
+                      help='compile the --dict word list into DEST and exit')
+  parser.add_argument('--bloom', metavar='RATE', type=float,
+                      help='with --compile, also write a Bloom filter with '
+                           'this false positive rate to DEST.bloom')
+  parser.add_argument('--stream', action='store_true',
+                      help='check the file in chunks with bounded memory')
+  parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                      help='bytes read at a time by --stream')
+  parser.add_argument('--format', choices=sorted(RENDERERS), default='ansi',
+                      help='output format (default: ansi)')
+  parser.add_argument('--names', metavar='FILE',
+                      help='split runs of capitalized words into the names '
+                           'listed in FILE (a gazetteer) and other words')
+  parser.add_argument('--engine', choices=sorted(ENGINES),
+                      default=DEFAULT_ENGINE,
+                      help='how to check the text (default: %(default)s); '
+                           'see ucdiff.py')
+  parser.add_argument('--numpy', action='store_true',
+                      help='same as --engine numpy')
+  parser.add_argument('--suggest', action='store_true',
+                      help='show corrections for unknown words, building '
+                           'the suggestion index first if needed')
+  parser.add_argument('--parallel', action='store_true',
+                      help='split one large file at paragraph breaks and '
+                           'check the parts in --workers processes')
+  parser.add_argument('--batch', action='store_true',
+                      help='check every file named, in a process pool')
+  parser.add_argument('--workers', type=int, default=None,
+                      help='worker processes for --batch and --parallel '
+                           '(default: CPUs)')
+  parser.add_argument('--batch-chunk-size', type=int, default=1,
+                      help='files handed to a worker at a time by --batch')
+  parser.add_argument('--unordered', action='store_true',
+                      help='with --batch, print results as they complete')
+  parser.add_argument('--profile', action='store_true',
+                      help='profile the check and save the profile, see '
+                           'ucprofile.py')
+  parser.add_argument('--profile-dir', metavar='DIR',
+                      help='where --profile saves profiles (default: '
+                           '$UC_PROFILE_DIR or ./profiles)')
+  parser.add_argument('--daemon', action='store_true',
+                      help='keep the dictionary loaded and serve checks on '
+                           'a Unix socket, see ucdaemon.py')
+  parser.add_argument('--client', action='store_true',
+                      help='have the daemon check the file, or check it '
+                           'here if no daemon is running')
+  parser.add_argument('--socket',
+                      help='daemon socket (default: $UC_SOCKET or one per '
+                           'user in the temp directory)')
+  args = parser.parse_args(argv)
+
+  if args.profile:
+    import ucprofile
+    name = os.path.basename(args.textfile[0]) if args.textfile else 'uc'
+    with ucprofile.Profile(args.profile_dir, name) as profile:
+      status = run(args, parser, profile)
+    print >> sys.stderr, 'profile saved to %s.*' % profile.path
+    return status
+  return run(args, parser)
+
+def run(args, parser, profile=None):
+  '''Carry out the parsed command line "args". The documents checked are
+  counted in the ucprofile.Profile "profile", if given.'''
+  if args.daemon:
+    import ucdaemon
+    try:
+      return ucdaemon.serve(args.socket, [os.path.abspath(args.dict)])
+    except EnvironmentError, e:
+      print >> sys.stderr, 'cannot start daemon: %s' % e
+      return 1
+
+  if args.compile:
+    count = compile_dictionary(args.dict, args.compile)
+    print 'compiled %d words into %s' % (count, args.compile)
+    if args.bloom:
+      size = compile_filter(args.compile, rate=args.bloom)
+      print 'wrote a %d byte Bloom filter to %s' % (size,
+                                                    filter_path(args.compile))
+    return 0
+
+  if args.batch:
+    names = None
+    if args.names:
+      import ucnames
+      names = ucnames.load_gazetteer(args.names)
+    status = 0
+    for path,output,error in check_batch(expand_paths(args.textfile),
+                                         args.dict, args.workers,
+                                         args.batch_chunk_size,
+                                         not args.unordered, args.format,
+                                         args.words, names):
+      if error:
+        print >> sys.stderr, '%s: %s' % (path, error)
+        status = 1
+        continue
+      print '==> %s <==' % path
+      print output
+    return status
+
+  if len(args.textfile) != 1:
+    parser.print_usage()
+    return 1
+  args.textfile = args.textfile[0]
+
+  if args.client:
+    import ucdaemon
+    textf = codecs.open(args.textfile, encoding='utf-8')
     text = textf.read()
     textf.close()
+    try:
+      sys.stdout.write(ucdaemon.check(text, args.dict, args.format,
+                                      args.suggest, args.socket, args.words,
+                                      names=args.names))
+      print
+      return 0
+    except ucdaemon.DaemonUnavailable:
+      pass #check it here instead
+    except ucdaemon.DaemonError, e:
+      print >> sys.stderr, '%s: %s' % (args.textfile, e)
+      return 1
+
+  dict = layered_dictionary(args.dict, args.words)
+  suggest = None
+  if args.suggest:
+    import ucsuggest
+    suggest = ucsuggest.load_index(args.dict).suggest
+  if args.numpy: args.engine = 'numpy'
+  try:
+    get_engine(args.engine)
+  except ValueError, e:
+    print >> sys.stderr, e
+    return 1
+  names = None
+  if args.names:
+    import ucnames
+    names = ucnames.load_gazetteer(args.names)
+
+  renderer = RENDERERS[args.format](sys.stdout, suggest)
+  if args.stream:
+    textf = open(args.textfile, 'rb')
+    stream_render(textf, dict, renderer, args.chunk_size, args.engine, names)
+    textf.close()
+    print
+    return 0
 
-    dict = load_words(DICT)
-    print printoutput_and_colorize(dict,text,False)
-    sys.exit(0)
+  textf = codecs.open(args.textfile, encoding='utf-8')
+  text = textf.read()
+  textf.close()
 
+  if args.parallel:
+    unknown_word_idx,unknown_word_set,word_set = check_parallel(
+      text, dict, args.workers, engine=args.engine, names=names)
+    if profile is not None:
+      profile.count(text, unknown=len(unknown_word_idx))
+    render(RENDERERS[args.format](sys.stdout, suggest), text,
+           unknown_word_idx, stat_line(unknown_word_set, word_set))
+    print
+    return 0
+
+  table = write_output(sys.stdout, dict, text, args.format, suggest,
+                       args.engine, names)
+  if profile is not None: profile.count(text, table)
+  print
+  return 0
+
+if __name__ == '__main__':
+    '''Script called manually, print output to the terminal'''
+    sys.exit(main())
@@ -1,7 +1,24 @@
 # coding=utf-8
 import unittest
 import uc
+import ucsuggest
+import ucdaemon
+import ucstats
+import ucvector
+import ucnames
+import ucprofile
+import ucserver
+import ucdiff
+import threading
+import httplib
+import time
+import json
+import pstats
+import webob
 import os 
+import shutil
+import tempfile
+from StringIO import StringIO
 
 class UCTest(unittest.TestCase):
 
@@ -155,6 +172,789 @@ class UCTest(unittest.TestCase):
             r = uc.regex_word_search(x[0])
             self.checkEqual(r,x[1])
 
+    def testDictionaryRegistryReload(self):
+        '''Test the registry loads a dictionary once and reloads it on change'''
+        path = self.makeDictionary(['apple', 'Pear'])
+        registry = uc.DictionaryRegistry(check_interval=0)
+        first = registry.get(path)
+        self.assert_('pear' in first)
+        self.assert_(registry.get(path) is first)
+
+        version = registry.version(path)
+        self.makeDictionary(['apple', 'pear', 'plum'], path)
+        os.utime(path, (0, 0))
+        second = registry.get(path)
+        self.assert_(second is not first)
+        self.assert_('plum' in second)
+        self.assertNotEqual(registry.version(path), version)
+
+    def testCompiledDictionary(self):
+        '''Test a compiled dictionary answers like the frozenset it came from'''
+        path = self.makeDictionary(['Apple', 'pear', "mobile's", 'clich\xe9'])
+        compiled = path + '.uwd'
+        uc.compile_dictionary(path, compiled)
+        wordset = uc.load_words(path)
+        mapped = uc.load_dictionary(compiled)
+        self.assert_(isinstance(mapped, uc.MappedDictionary))
+        for word in [u'apple', 'apple', 'Apple', 'pear', "mobile's", u'clich\xe9',
+                     'zebra', 'a', '']:
+            self.assertEqual(word in mapped, word in wordset, repr(word))
+        self.assertEqual(len(mapped), len(wordset))
+        self.assertEqual(set(mapped), set(wordset))
+        mapped.close()
+
+    def testStreamingMatchesWholeDocument(self):
+        '''Test chunked checking gives the same output for any chunk size'''
+        wordset = frozenset(['the', 'of', 'dog', 'dog\'s', 'rode', 'american',
+                             'united', 'states'])
+        text = (u"The United States of\nAmerica dog\u2019s amer-\nican "
+                u"rode.\n\nThe Unknwn of the\r\n\r\nDog zorb-ican 42 caf\xe9")
+        expected = uc.printoutput_and_colorize(wordset, text, False)
+        for chunk_size in (1, 2, 3, 7, 1024):
+            data = StringIO(text.encode('utf-8'))
+            got = ''.join(uc.stream_check(data, wordset, chunk_size))
+            self.assertEqual(got, expected, 'chunk size %d' % chunk_size)
+
+    def testRenderManyUnknownWords(self):
+        '''Test output with more unknown words than the recursion limit'''
+        text = u' '.join([u'zq'] * 5000)
+        got = uc.printoutput_and_colorize(frozenset(), text, False)
+        self.assertEqual(got.count('\x1b[42mzq\x1b[0m'), 5000)
+
+        out = StringIO()
+        uc.render(uc.OffsetRenderer(out), text, [(0, 2), (3, 5)], 'stat')
+        self.assertEqual(out.getvalue(), '0\t2\tzq\n3\t5\tzq\nstat')
+
+    def testJsonOutput(self):
+        '''Test the JSON renderer reports unknown word spans'''
+        import json
+        out = StringIO()
+        uc.write_output(out, frozenset(['cat']), u'cat zq\u2019s cat zx',
+                        'json')
+        got = json.loads(out.getvalue())
+        self.assertEqual(got['unknown'], [[4, 6], [13, 15]])
+        self.assert_(got['stat'].startswith('Unrecognized'))
+
+    def testStreamingHtml(self):
+        '''Test the streamed html page wraps the same highlighted text'''
+        text = u'The cat zat.'
+        got = ''.join(uc.stream_check(StringIO(text), frozenset(['cat']),
+                                      format='html'))
+        self.assert_(got.startswith(uc.HTML_HEAD))
+        self.assert_(got.endswith(uc.HTML_TAIL))
+        self.assert_('<span class="unknownword">zat</span>.</pre>' in got)
+        self.assert_('(2/3)' in got)
+
+    def testBatchCheck(self):
+        '''Test a batch run matches checking each file on its own'''
+        path = self.makeDictionary(['cat', 'sat'])
+        tmpdir = os.path.dirname(path)
+        files = []
+        for i in range(4):
+            name = os.path.join(tmpdir, 'doc%d.txt' % i)
+            f = open(name, 'w')
+            f.write('cat sat ' + 'zq ' * i)
+            f.close()
+            files.append(name)
+
+        self.assertEqual(uc.expand_paths([os.path.join(tmpdir, 'doc*.txt')]),
+                         files)
+        wordset = uc.load_words(path)
+        got = list(uc.check_batch(files, path, workers=2, format='offsets'))
+        self.assertEqual([g[0] for g in got], files)
+        for name,output,error in got:
+            self.assertEqual(error, None)
+            self.assertEqual(output, uc.check_file(name, wordset, 'offsets'))
+        missing = list(uc.check_batch(['/nonexistent'], path, workers=1))
+        self.assertEqual(missing[0][1], None)
+
+        names = ucnames.Gazetteer.build([u'Cat Sat'])
+        f = open(files[0], 'w')
+        f.write('Cat Sat zq')
+        f.close()
+        got = list(uc.check_batch(files[:1], path, workers=2,
+                                  format='offsets', names=names))
+        self.assertEqual(got[0][1], uc.check_file(files[0], wordset,
+                                                  'offsets', names))
+        self.assertEqual(got[0][1].splitlines()[0], '8\t10\tzq')
+
+    def testVerdictCache(self):
+        '''Test verdicts are cached, evicted and kept apart per dictionary'''
+        cache = uc.VerdictCache(size=4)
+        first = frozenset(['cat', 'co-op'])
+        self.assertTrue(cache.known(u'Cat', first))
+        self.assertTrue(cache.known(u'Cat', first))
+        self.assertTrue(cache.known(u'co-op', first))
+        self.assertFalse(cache.known(u'dog', first))
+        self.assertEqual(cache.stats(),
+                         {'hits': 1, 'misses': 3, 'entries': 3, 'size': 4})
+
+        for word in [u'e', u'f', u'g']:
+            cache.known(word, first)
+        self.assertTrue(cache.stats()['entries'] <= 4)
+        self.assertTrue(cache.known(u'Cat', first))
+        self.assertEqual(cache.stats()['misses'], 7)
+
+        second = frozenset(['dog'])
+        self.assertTrue(cache.known(u'dog', second))
+        self.assertFalse(cache.known(u'Cat', second))
+        self.assertEqual(cache.stats()['misses'], 9)
+
+        #Threads checking against different dictionaries at once each get
+        #the verdicts of their own.
+        text = u' '.join([u'cat dog'] * 50)
+        wrong = []
+        def check(dict, unknown):
+            for i in range(100):
+                table = uc.tokenize_table(text)
+                if uc.check_table(table, dict, cache) != unknown:
+                    wrong.append(dict)
+        threads = [threading.Thread(target=check, args=(first, set([u'dog']))),
+                   threading.Thread(target=check, args=(second, set([u'cat'])))]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        self.assertEqual(wrong, [])
+
+        #The verdicts of a dictionary go with it, but not its counts.
+        before = cache.stats()
+        del second, threads
+        after = cache.stats()
+        self.assertEqual((after['hits'], after['misses']),
+                         (before['hits'], before['misses']))
+        self.assertTrue(after['entries'] < before['entries'])
+
+    def testBenchmarkCorpus(self):
+        '''Test benchmark corpora are reproducible and regressions found'''
+        import ucbench
+        text = ucbench.generate_corpus(5000, seed=7, unknown_rate=0.5)
+        self.assertEqual(len(text), 5000)
+        self.assertEqual(text, ucbench.generate_corpus(5000, seed=7,
+                                                       unknown_rate=0.5))
+        self.assertNotEqual(text, ucbench.generate_corpus(5000, seed=8))
+
+        baseline = {'stages': {'lookup': {'mb_per_s': 10.0, 'peak_kb': 100}}}
+        results = {'stages': {'lookup': {'mb_per_s': 8.0, 'peak_kb': 100}}}
+        self.assertEqual(len(ucbench.compare(results, baseline, 0.1)), 1)
+        self.assertEqual(ucbench.compare(results, baseline, 0.25), [])
+
+    def testFusedTokenizer(self):
+        '''Test the single pass tokenizer agrees with regex_word_search_idx'''
+        for s in [u"once upon a time there lived a buddah in a grassy cavern",
+                  "here laYeth 4.51", u'\u30c1\u30e0 4.57',
+                  "So that's the straight dope: She hit him, he ran;",
+                  "[Ever] wonder 100% & gather $100 ~ {filthy} <hobby>",
+                  u"\u2018thats\u2019\u201a \u201btoo \u201cfunny\u201d",
+                  u"clich\xe9s", u"hamstrung\u2019re", "'whatever'",
+                  "a-b-c;ab-c're;anti-flag;strong-bad-fun",
+                  "a-b-c's a-b-c anti-death co-dependent amer-ican",
+                  "Once in Hong Kong and New   York, Sable rode.",
+                  "rated Number One  Worldwide", "Number One the Groupen",
+                  "the United States of America Hammer",
+                  "United States of America the", "United States of, America",
+                  "the United of the Front, Ace",
+                  "the United of the, Front, Ace", "Not ar Connector",
+                  u"The Dog\u2019s\n\nHouse of\r\n\r\nthe Rising a's",
+                  "", " ,. "]:
+            self.assertEqual(uc.tokenize(s), uc.regex_word_search_idx(s), s)
+
+    def testTokenTable(self):
+        '''Test the compact token table holds the same words and verdicts'''
+        text = u"The Dog\u2019s owner, Ann of Arc, zq co-op xx-yy 42"
+        words,idxs = uc.tokenize(text)
+        table = uc.tokenize_table(text)
+        self.assertEqual(list(table), words)
+        self.assertEqual(list(table.idxs()), idxs)
+        self.assertEqual(table[1], words[1])
+
+        wordset = frozenset(['owner', 'co', 'op'])
+        unknown = uc.check_table(table, wordset, None)
+        unknown_idx,expected = uc.find_unknown_words(words, idxs, wordset,
+                                                     None)
+        self.assertEqual(unknown, expected)
+        self.assertEqual(list(table.unknown_idxs()), unknown_idx)
+        self.assertFalse(table.is_unknown(1))
+        table.set_unknown(1, False)
+        self.assertEqual(table.nbytes(), len(table) * 2 *
+                         table.starts.itemsize + 1)
+
+    def testIncrementalRecheck(self):
+        '''Test rechecking after edits agrees with checking from scratch'''
+        wordset = frozenset(['the', 'of', 'dog', 'rode', 'united', 'states'])
+        state = uc.check_state(u"the dog rode. The United States of Amerca "
+                               u"rode the dog home, zq dog zq", wordset)
+        for offset,deleted,inserted in [(4, 3, u'cat'), (0, 0, u'Zq '),
+                                        (18, 0, u'\n\n'), (30, 0, u' of'),
+                                        (65, 2, u''), (9, 20, u'dog, '),
+                                        (0, 0, u'')]:
+            old = state
+            state,delta = uc.recheck(state, offset, deleted, inserted)
+            expected = uc.check_state(state.text, wordset)
+            self.assertEqual(list(state.table.idxs()),
+                             list(expected.table.idxs()))
+            self.assertEqual(list(state.unknown_idxs()),
+                             list(expected.unknown_idxs()))
+
+            #Patch the old highlights with the delta as a client would.
+            shown = [(s, e) for s,e in old.unknown_idxs() if e <= delta.start]
+            shown += delta.unknown
+            shown += [(s + delta.shift, e + delta.shift)
+                      for s,e in old.unknown_idxs()
+                      if s >= delta.end - delta.shift]
+            self.assertEqual(shown, list(expected.unknown_idxs()))
+        self.assertRaises(ValueError, uc.recheck, state, 0, 1000, u'')
+
+    def testResultCache(self):
+        '''Test results are evicted by size and survive on disk'''
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        cache = uc.ResultCache(max_bytes=10, directory=tmpdir)
+        a = cache.key(u'some text', 'v1', 'html')
+        self.assertNotEqual(a, cache.key(u'some text', 'v2', 'html'))
+        b = cache.key(u'other text', 'v1', 'html')
+        self.assertEqual(cache.get(a), None)
+        cache.put(a, 'x' * 6)
+        cache.put(b, 'y' * 6)
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual(cache.get(b), 'y' * 6)
+        self.assertEqual(cache.get(a), 'x' * 6)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['disk_hits'], stats['misses']),
+                         (1, 1, 1))
+
+        restarted = uc.ResultCache(max_bytes=10, directory=tmpdir)
+        self.assertEqual(restarted.get(b), 'y' * 6)
+        self.assertEqual(restarted.stats()['disk_entries'], 2)
+
+        #Results written by another process sharing the directory are found,
+        #unfinished writes are skipped and the directory is trimmed on start.
+        c = cache.key(u'third text', 'v1', 'html')
+        cache.put(c, 'z' * 6)
+        self.assertEqual(restarted.get(c), 'z' * 6)
+        self.assertEqual(restarted.stats()['disk_entries'], 3)
+        open(os.path.join(tmpdir, a[:2], a + '.1.tmp'), 'wb').write('x')
+        small = uc.ResultCache(max_bytes=10, directory=tmpdir, disk_bytes=12)
+        self.assertEqual(small.stats()['disk_entries'], 2)
+        self.assertEqual(sum(len(names) for root,dirs,names
+                             in os.walk(tmpdir)), 3)
+
+    def testSuggestions(self):
+        '''Test corrections come from a saved suggestion index'''
+        path = self.makeDictionary(['the', 'receive', 'believe', 'time'])
+        index = ucsuggest.load_index(path)
+        self.assertTrue(os.path.exists(ucsuggest.index_path(path)))
+        index = ucsuggest.load_index(path, build=False)
+        self.assertEqual(index.suggest(u'recieve'), [u'receive', u'believe'])
+        self.assertEqual(index.suggest(u'Teh'), [u'The'])
+        self.assertEqual(index.suggest(u'New Yrok'), [])
+        self.assertEqual(ucsuggest.edit_distance(u'teh', u'the', 2), 1)
+
+        out = StringIO()
+        uc.write_output(out, uc.get_dictionary(path), u'teh tiem', 'json',
+                        index.suggest)
+        import json
+        self.assertEqual(json.loads(out.getvalue())['suggestions'],
+                         {u'teh': [u'the'], u'tiem': [u'time', u'the']})
+
+    def testDaemon(self):
+        '''Test the daemon gives the same output as checking in-process'''
+        path = self.makeDictionary(['the', 'dog', 'rode'])
+        sock = os.path.join(os.path.dirname(path), 'uc.sock')
+        self.assertRaises(ucdaemon.DaemonUnavailable, ucdaemon.check,
+                          u'the dog', path, path=sock)
+        server = ucdaemon.make_server(sock, [path])
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        text = u'the dog rode the Zq\u2019s bike'
+        for format in ['ansi', 'json']:
+            out = StringIO()
+            uc.write_output(out, uc.get_dictionary(path), text, format)
+            self.assertEqual(ucdaemon.check(text, path, format, path=sock),
+                             out.getvalue())
+        self.assertRaises(ucdaemon.DaemonError, ucdaemon.check, text,
+                          path + '.missing', path=sock)
+
+        names = self.makeDictionary([u'Zq Bike'],
+                                    os.path.join(os.path.dirname(path),
+                                                 'names'))
+        text = u'the Zq Bike rode'
+        out = StringIO()
+        uc.write_output(out, uc.get_dictionary(path), text, 'json',
+                        names=ucnames.load_gazetteer(names))
+        self.assertEqual(ucdaemon.check(text, path, 'json', path=sock,
+                                        names=names), out.getvalue())
+
+    def testLayeredDictionary(self):
+        '''Test extra word lists are recognized without copying the base'''
+        base = frozenset(['the', 'dog', 'rode'])
+        team = self.makeDictionary(['Zq', 'bike'])
+        uc.REGISTRY.clear()
+        dict = uc.layered_dictionary(self.makeDictionary(base), [team],
+                                     [u'Wug'])
+        self.assertTrue(isinstance(dict, uc.LayeredDictionary))
+        self.assertTrue(u'zq' in dict and u'wug' in dict and u'dog' in dict)
+        self.assertEqual(len(dict), 6)
+
+        cache = uc.VerdictCache()
+        text = u'the Wugs rode the wug-bike, zq dog'
+        idxs,unknown = uc.find_unknown_words(*(uc.tokenize(text) +
+                                               (dict, cache)))
+        self.assertEqual(unknown, set([u'Wugs']))
+        #The verdicts kept are those of the shared base alone.
+        self.assertEqual(cache._verdicts.keys(), [dict.base])
+        idxs,unknown = uc.find_unknown_words(*(uc.tokenize(text) +
+                                               (dict.base, cache)))
+        self.assertEqual(unknown, set([u'Wugs', u'wug-bike', u'zq']))
+
+    def testBloomFilter(self):
+        '''Test a Bloom filter in front of a compiled dictionary'''
+        words = ['w%d' % i for i in range(2000)]
+        path = self.makeDictionary(words)
+        compiled = path + '.uwd'
+        uc.compile_dictionary(path, compiled)
+        uc.compile_filter(compiled, rate=0.01)
+        dict = uc.load_dictionary(compiled)
+        self.assertTrue(isinstance(dict, uc.FilteredDictionary))
+        self.assertTrue(all(w in dict.filter for w in words))
+        self.assertTrue(all(w in dict for w in words))
+        others = ['x%d' % i for i in range(2000)]
+        self.assertFalse(any(w in dict for w in others))
+        false_positives = sum(1 for w in others if w in dict.filter)
+        self.assertTrue(false_positives < 60, false_positives)
+        self.assertEqual(len(dict), 2000)
+        dict.close()
+
+        #Compiling again removes the filter, and a filter built for another
+        #version of the dictionary, even one of the same size, is ignored.
+        shutil.copy(uc.filter_path(compiled), compiled + '.old')
+        uc.compile_dictionary(self.makeDictionary(words[:-1] + ['y1999'],
+                                                  path), compiled)
+        self.assertFalse(os.path.exists(uc.filter_path(compiled)))
+        os.rename(compiled + '.old', uc.filter_path(compiled))
+        dict = uc.load_dictionary(compiled)
+        self.assertTrue(isinstance(dict, uc.MappedDictionary))
+        self.assertTrue('y1999' in dict)
+        dict.close()
+
+    def testCorpusStats(self):
+        '''Test unknown word counts are merged and resumed exactly'''
+        path = self.makeDictionary(['the', 'dog', 'rode'])
+        tmpdir = os.path.dirname(path)
+        corpus = os.path.join(tmpdir, 'corpus')
+        os.mkdir(corpus)
+        texts = ['the zq dog zq', 'zq rode', 'the dog xy', 'nothing']
+        for i,text in enumerate(texts):
+            f = open(os.path.join(corpus, '%d.txt' % i), 'w')
+            f.write(text)
+            f.close()
+
+        stats = ucstats.corpus_stats([corpus], path, workers=1, share=3)
+        self.assertEqual(stats.top(), [(u'zq', 3, 2), (u'nothing', 1, 1),
+                                       (u'xy', 1, 1)])
+        self.assertEqual((stats.files, stats.words, stats.unknown),
+                         (4, 10, 5))
+
+        state = os.path.join(tmpdir, 'state.json')
+        ucstats.corpus_stats([os.path.join(corpus, '[01].txt')], path,
+                             workers=1, state=state)
+        resumed = ucstats.corpus_stats([corpus], path, workers=1,
+                                       state=state)
+        self.assertEqual(resumed.top(), stats.top())
+        self.assertEqual(resumed.files, 4)
+        self.assertEqual(len(open(state).readlines()), 3)
+
+        words = self.makeDictionary(['zq'], os.path.join(tmpdir, 'extra'))
+        self.assertRaises(ValueError, ucstats.corpus_stats, [corpus], path,
+                          [words], workers=1, state=state)
+        header = open(state).readline()
+        for old in [json.dumps(stats.to_json()), header[:len(header) // 2]]:
+            f = open(state, 'w')
+            f.write(old)
+            f.close()
+            self.assertRaisesRegexp(ValueError, 'not a state file',
+                                    ucstats.load_state, state)
+
+    @unittest.skipUnless(ucvector.available(), 'NumPy is not installed')
+    def testVectorizedLookup(self):
+        '''Test batched lookups give the same verdicts as check_table'''
+        wordset = frozenset([u'the', u'dog', u'rode', u'co', u'op',
+                             u'hat-trick', u'bi-cycle', u'don\'t'])
+        text = (u"The dog rode the Dog's bike, co-op hat-trick a-b-c 42 "
+                u"bicy-cle\n\u0663\u0664 dogs Don\u2019t THE-DOG -the "
+                u"x" * 60 + u" the New York co-op-op")
+        for i in range(3):
+            expected = uc.tokenize_table(text)
+            expected_set = uc.check_table(expected, wordset, None)
+            table = uc.tokenize_table(text)
+            self.assertEqual(ucvector.check_table(table, wordset, None),
+                             expected_set)
+            self.assertEqual(table.unknown, expected.unknown)
+            text = text.replace(u'dog', u'the')
+
+    def testGazetteer(self):
+        '''Test capitalized runs are split into known names'''
+        path = self.makeDictionary([u'United States of America',
+                                    u'Hong Kong', u'San Francisco',
+                                    u'San Francisco Bay Area'])
+        gazetteer = ucnames.load_gazetteer(path)
+        self.assertTrue(os.path.exists(ucnames.index_path(path)))
+        gazetteer = ucnames.load_gazetteer(path, build=False)
+        self.assertEqual(len(gazetteer), 4)
+        self.assertTrue(u'hong  kong' in gazetteer)
+        self.assertFalse(u'san francisco bay' in gazetteer)
+
+        text = (u"The United States of America Hammer met Hong\nKong "
+                u"in San Francisco Bay Area and San Francisco Bay.")
+        table = gazetteer.split(uc.tokenize_table(text))
+        self.assertEqual(list(table),
+                         [u'The', u'United States of America', u'Hammer',
+                          u'met', u'Hong\nKong', u'in',
+                          u'San Francisco Bay Area', u'and',
+                          u'San Francisco', u'Bay'])
+        out = StringIO()
+        uc.write_output(out, frozenset([u'the', u'met', u'in', u'and']),
+                        text, 'offsets', names=gazetteer)
+        self.assertEqual(out.getvalue().splitlines()[:2],
+                         ['29\t35\tHammer', '94\t97\tBay'])
+
+        dict = frozenset([u'the', u'met', u'in', u'and'])
+        streamed = StringIO()
+        uc.stream_render(StringIO(text.encode('utf-8')), dict,
+                         uc.RENDERERS['offsets'](streamed), 16,
+                         names=gazetteer)
+        self.assertEqual(streamed.getvalue(), out.getvalue())
+        text = u'\n\n'.join([text] * 4)
+        table = gazetteer.split(uc.tokenize_table(text))
+        unknown_word_set = uc.check_table(table, uc.LayeredDictionary(
+            dict, gazetteer))
+        self.assertEqual(uc.check_parallel(text, dict, 2, min_chunk=10,
+                                           names=gazetteer),
+                         (list(table.unknown_idxs()), unknown_word_set,
+                          set(table)))
+
+        #A possessive inside a run is cut off the word it follows.
+        text = u"The Queen\u2019s Hong Kong visit and Hong Kong's Victoria"
+        table = gazetteer.split(uc.tokenize_table(text))
+        self.assertEqual(list(table),
+                         [u'The', u'Queen', u'Hong Kong', u'visit', u'and',
+                          u'Hong Kong', u'Victoria'])
+        self.assertEqual(uc.check_table(table, frozenset(
+            [u'the', u'queen', u'visit', u'and', u'hong kong'])),
+                         set([u'Victoria']))
+
+    def testParallelCheck(self):
+        '''Test checking paragraphs in parallel matches a serial check'''
+        wordset = frozenset(['the', 'dog', 'rode', 'home'])
+        text = (u"the dog rode home.\n\nThe Zq of\n\nthe Dog\n\n"
+                u"Smith\n\nJones rode xy\n \nOf dog\n\nhome zq") * 5
+        cuts = uc.paragraph_splits(text, 20, min_chunk=10)
+        self.assertTrue(len(cuts) > 5, cuts)
+        for cut in cuts[1:]:
+            self.assertEqual(text[cut - 2:cut].strip(), u'')
+
+        table = uc.tokenize_table(text)
+        unknown_word_set = uc.check_table(table, wordset)
+        self.assertEqual(uc.check_parallel(text, wordset, 3, min_chunk=10),
+                         (list(table.unknown_idxs()), unknown_word_set,
+                          set(table)))
+
+    def testMetrics(self):
+        '''Test stage timings and counts are exported only when enabled'''
+        metrics = uc.Metrics()
+        t = metrics.clock()
+        self.assertEqual(metrics.lap('tokenize', t), 0)
+        metrics.inc('uc_tokens_total', 5)
+        self.assertEqual(metrics.render(), '\n')
+
+        metrics.enabled = True
+        metrics.describe('uc_tokens_total', 'Words checked.')
+        metrics.inc('uc_tokens_total', 5)
+        metrics.inc('uc_tokens_total', 2)
+        metrics.observe('uc_stage_seconds', 0.002, (0.001, 0.01),
+                        stage='lookup')
+        metrics.observe('uc_stage_seconds', 3, (0.001, 0.01), stage='lookup')
+        self.assertEqual(metrics.render().splitlines(), [
+            '# HELP uc_tokens_total Words checked.',
+            '# TYPE uc_tokens_total counter',
+            'uc_tokens_total 7',
+            '# TYPE uc_stage_seconds histogram',
+            'uc_stage_seconds_bucket{stage="lookup",le="0.001"} 0',
+            'uc_stage_seconds_bucket{stage="lookup",le="0.01"} 1',
+            'uc_stage_seconds_bucket{stage="lookup",le="+Inf"} 2',
+            'uc_stage_seconds_sum{stage="lookup"} 3.002',
+            'uc_stage_seconds_count{stage="lookup"} 2'])
+
+    def testIncrementalCheckPage(self):
+        '''Test a document is checked once and then only where it is edited'''
+        uglytext = self.uglytext()
+        def post(**fields):
+            request = webob.Request.blank('/checktext/edit', POST=fields)
+            response = request.get_response(uglytext.app)
+            return response.status_int, json.loads(response.body)
+
+        self.assertEqual(post(doc='d1', text='the zq sat'),
+                         (200, {'doc': 'd1', 'start': 0, 'end': 10,
+                                'shift': 0, 'unknown': [[4, 6]]}))
+        status,delta = post(doc='d1', offset='4', deleted='2', inserted='cat')
+        self.assertEqual((status, delta['shift'], delta['unknown']),
+                         (200, 1, []))
+        status,delta = post(doc='d1', offset='0', inserted='xq ')
+        self.assertEqual((status, delta['unknown']), (200, [[0, 2]]))
+        self.assertEqual(post(doc='d2', offset='0', inserted='x')[0], 404)
+        self.assertEqual(post(doc='', text='the cat')[0], 400)
+        self.assertEqual(post(doc='d1', offset='x')[0], 400)
+
+        #States are dropped by size, and when the dictionary is replaced.
+        dict = frozenset(['the', 'cat'])
+        state = uc.check_state(u'the cat sat', dict)
+        size = len(state.text) + state.table.nbytes()
+        store = uglytext.DocumentStore(max_bytes=2 * size)
+        for doc in ['a', 'b', 'c']: store.put(doc, state)
+        self.assertEqual((store.get('a'), store.bytes), (None, 2 * size))
+        store.put('c', uc.check_state(u'the cat sat', set(dict)))
+        self.assertEqual((store.get('b'), store.bytes), (None, size))
+
+    def testMetricsPage(self):
+        '''Test cache hits are exported as counters and sizes as gauges'''
+        uglytext = self.uglytext()
+        for i in range(2):
+            request = webob.Request.blank('/checktext',
+                                          POST={'text': 'the cat zq'})
+            self.assertEqual(request.get_response(uglytext.app).status_int,
+                             200)
+        body = webob.Request.blank('/metrics').get_response(uglytext.app).body
+        lines = body.splitlines()
+        hits = uglytext.RESULTS.stats()['hits']
+        self.assertTrue(hits >= 1)
+        for line in ['# TYPE uglytext_result_cache_hits_total counter',
+                     'uglytext_result_cache_hits_total %d' % hits,
+                     '# TYPE uglytext_result_cache_evictions_total counter',
+                     '# TYPE uglytext_result_cache_entries gauge',
+                     '# TYPE uc_verdict_cache_misses_total counter',
+                     '# TYPE uc_verdict_cache_size gauge']:
+            self.assertTrue(line in lines, line)
+        self.assertFalse('uglytext_result_cache_hits' in body.split())
+
+    def testCheckApiETags(self):
+        '''Test the gzip and identity replies have their own ETags and
+        either one gets a 304'''
+        uglytext = self.uglytext()
+        def post(**headers):
+            request = webob.Request.blank('/api/check',
+                                          POST={'text': 'the cat zq'},
+                                          headers=headers)
+            return request.get_response(uglytext.app)
+        plain = post()
+        gzipped = post(**{'Accept-Encoding': 'gzip'})
+        self.assertEqual(json.loads(plain.body)['unknown'], [[8, 10]])
+        self.assertEqual(gzipped.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzipped.etag, plain.etag + '-gzip')
+        for etag in [plain.etag, gzipped.etag]:
+            for encoding in ['identity', 'gzip']:
+                self.assertEqual(post(**{'If-None-Match': '"%s"' % etag,
+                                         'Accept-Encoding': encoding}).status_int,
+                                 304)
+        self.assertEqual(post(**{'If-None-Match': '"other"'}).status_int, 200)
+        for encoding in ['gzip;q=0', 'identity', 'deflate']:
+            refused = post(**{'Accept-Encoding': encoding})
+            self.assertEqual((refused.etag, refused.body),
+                             (plain.etag, plain.body))
+        self.assertEqual(post(**{'Accept-Encoding': '*;q=0.5'}).etag,
+                         gzipped.etag)
+
+        #An index built while the app runs is used from the next request on,
+        #and the new replies get other ETags.
+        self.assertFalse('suggestions' in json.loads(plain.body))
+        ucsuggest.load_index('dict/words')
+        suggested = post(**{'If-None-Match': '"%s"' % plain.etag})
+        self.assertEqual(suggested.status_int, 200)
+        self.assertEqual(json.loads(suggested.body)['suggestions'],
+                         {u'zq': []})
+
+    def testDictionaryDownload(self):
+        '''Test the dictionary is served with validators, gzip and ranges'''
+        uglytext = self.uglytext()
+        def get(**headers):
+            request = webob.Request.blank('/dict/words', headers=headers)
+            return request.get_response(uglytext.app)
+        data = open('dict/words', 'rb').read()
+        full = get()
+        self.assertEqual((full.status_int, full.body), (200, data))
+        etag,modified = full.etag, full.headers['Last-Modified']
+
+        gzipped = get(**{'Accept-Encoding': 'gzip'})
+        self.assertEqual(gzipped.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzipped.etag, etag + '-gzip')
+        gzipped.decode_content()
+        self.assertEqual(gzipped.body, data)
+
+        for validator in [etag, etag + '-gzip']:
+            self.assertEqual(get(**{'If-None-Match': '"%s"' % validator})
+                             .status_int, 304)
+        self.assertEqual(get(**{'If-None-Match': '"stale"'}).status_int, 200)
+        self.assertEqual(get(**{'If-Modified-Since': modified}).status_int,
+                         304)
+        self.assertEqual(get(**{'If-Modified-Since':
+                                'Thu, 01 Jan 1970 00:00:00 GMT'}).status_int,
+                         200)
+
+        part = get(Range='bytes=4-6')
+        self.assertEqual((part.status_int, part.body), (206, data[4:7]))
+        self.assertEqual(part.headers['Content-Range'],
+                         'bytes 4-6/%d' % len(data))
+        missing = get(Range='bytes=%d-' % (len(data) + 10))
+        self.assertEqual(missing.status_int, 416)
+        self.assertEqual(missing.headers['Content-Range'],
+                         'bytes */%d' % len(data))
+        for validator in ['"%s"' % etag, modified]:
+            resumed = get(Range='bytes=4-', **{'If-Range': validator})
+            self.assertEqual((resumed.status_int, resumed.body),
+                             (206, data[4:]))
+        stale = get(Range='bytes=4-', **{'If-Range': '"stale"'})
+        self.assertEqual((stale.status_int, stale.body), (200, data))
+
+        self.makeDictionary(['the', 'cat', 'sat', 'mat'], 'dict/words')
+        changed = get(**{'If-None-Match': '"%s"' % etag})
+        self.assertEqual(changed.status_int, 200)
+        self.assertTrue(changed.body.endswith('mat\n'))
+
+    def testProfile(self):
+        '''Test a profile is saved with the words checked and old ones go'''
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        dict = set(['the', 'cat'])
+        paths = []
+        for name in ['a', 'a', 'c']:
+            text = u'the cat sta on the mta'
+            with ucprofile.Profile(tmpdir, name, keep=2) as profile:
+                profile.count(text, uc.write_output(StringIO(), dict, text,
+                                                    'ansi'))
+            paths.append(profile.path)
+        self.assertFalse(uc.METRICS.enabled)
+        self.assertEqual(len(os.listdir(tmpdir)), 6)
+        self.assertFalse(os.path.exists(paths[0] + '.pstats'))
+        self.assertTrue(os.path.exists(paths[1] + '.pstats'))
+        info = json.load(open(profile.path + '.json'))
+        self.assertEqual((info['name'], info['documents'], info['characters'],
+                          info['tokens'], info['unknown']),
+                         ('c', 1, 22, 6, 3))
+        stats = pstats.Stats(profile.path + '.pstats')
+        self.assertTrue(any(func[2] == 'write_output' for func in stats.stats))
+        for line in open(profile.path + '.collapsed'):
+            stack,count = line.rsplit(' ', 1)
+            self.assertTrue(int(count) > 0)
+
+    def testServer(self):
+        '''Test the server runs requests in its workers and refuses more
+        than it takes'''
+        def app(environ, start_response):
+            body = environ['wsgi.input'].read(int(environ['CONTENT_LENGTH']))
+            if body == 'slow': time.sleep(0.5)
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return [environ['PATH_INFO'] + ' ' + body]
+        server = ucserver.Server(('127.0.0.1', 0), app, workers=1, queue=0,
+                                 max_body=100, log=None)
+        serving = threading.Thread(target=server.serve_forever)
+        serving.start()
+        self.addCleanup(serving.join)
+        self.addCleanup(server.stop)
+        def post(path, body, replies=None):
+            connection = httplib.HTTPConnection(*server.address)
+            connection.request('POST', path, body)
+            response = connection.getresponse()
+            reply = (response.status, response.read())
+            if replies is not None: replies.append(reply)
+            return reply
+
+        self.assertEqual(post('/checktext', 'text'), (200, '/checktext text'))
+        self.assertEqual(post('/checktext', 'x' * 101)[0], 413)
+        replies = []
+        slow = threading.Thread(target=post, args=('/', 'slow', replies))
+        slow.start()
+        while not server.pending: time.sleep(0.01)
+        self.assertEqual(post('/', 'fast')[0], 503)
+        slow.join()
+        self.assertEqual(replies, [(200, '/ slow')])
+
+    def testServerLostRequests(self):
+        '''Test the server answers requests whose worker died or hung, and
+        that they do not keep their places in the pool'''
+        def app(environ, start_response):
+            body = environ['wsgi.input'].read(int(environ['CONTENT_LENGTH']))
+            if body == 'crash': os._exit(1)
+            if body == 'hang': time.sleep(60)
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return [body]
+        server = ucserver.Server(('127.0.0.1', 0), app, workers=1, queue=0,
+                                 request_timeout=1.0, log=None)
+        serving = threading.Thread(target=server.serve_forever)
+        serving.start()
+        self.addCleanup(serving.join)
+        self.addCleanup(server.stop)
+        def post(body):
+            connection = httplib.HTTPConnection(*server.address)
+            connection.request('POST', '/', body)
+            response = connection.getresponse()
+            return response.status, response.read()
+
+        self.assertEqual(post('crash')[0], 502)
+        self.assertEqual(post('crash')[0], 502)
+        self.assertEqual(post('hang')[0], 504)
+        self.assertEqual(post('fine'), (200, 'fine'))
+        self.assertEqual(server.pending, 0)
+
+    def testEngines(self):
+        '''Test the engines check random texts as the reference does, and
+        that an engine that does not is caught'''
+        uc.register_engine(uc.Engine('lenient', uc.tokenize_table,
+                                     lambda table, dict, cache: set()))
+        self.addCleanup(uc.ENGINES.pop, 'lenient')
+        wordset = frozenset([u'the', u'cat', u'sat', u'mat', u'a', u'of'])
+        texts = [('case %d' % case, ucdiff.random_case(0, case, list(wordset)),
+                  False) for case in range(200)]
+        engines = [name for name,engine in uc.ENGINES.items()
+                   if engine.available()]
+        stats = ucdiff.compare_engines(texts, wordset, engines)
+        for name in engines:
+            if name != 'lenient':
+                self.assertEqual(stats[name].divergences, [], name)
+        divergence = stats['lenient'].divergences[0]
+        self.assertEqual((divergence.what, divergence.expected,
+                          divergence.got), ('verdict', True, False))
+
+    def uglytext(self):
+        '''Import the web app in a directory of its own with a small
+        dictionary, and return it. uc.METRICS is on, as the app turns it
+        on, until the end of the test.'''
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        os.mkdir(os.path.join(tmpdir, 'dict'))
+        self.makeDictionary(['the', 'cat', 'sat'],
+                            os.path.join(tmpdir, 'dict', 'words'))
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(tmpdir)
+        self.addCleanup(uc.METRICS.clear)
+        self.addCleanup(setattr, uc.METRICS, 'enabled', uc.METRICS.enabled)
+        self.addCleanup(uc.REGISTRY.clear)
+        uc.REGISTRY.clear()
+        import uglytext
+        uc.METRICS.enabled = True
+        return uglytext
+
+    def makeDictionary(self, words, path=None):
+        '''Write "words" to a dictionary file removed after the test.'''
+        if path is None:
+            tmpdir = tempfile.mkdtemp()
+            self.addCleanup(shutil.rmtree, tmpdir)
+            path = os.path.join(tmpdir, 'words')
+        f = open(path, 'w')
+        f.write('\n'.join(words) + '\n')
+        f.close()
+        return path
+
     def checkEqual(self,got,expected):
         self.assertEqual(got, expected, 
                          os.linesep + str(got) + os.linesep + str(expected))
@@ -0,0 +1,264 @@
+# coding=utf-8
+'''Stage level benchmarks for uc.
+
+Generates a reproducible synthetic corpus, times each stage of a check on
+its own (tokenizing, grouping, dictionary lookup, rendering) as well as a
+whole check, and reports throughput and peak memory. Results are written
+as JSON so a later run can be compared against a stored baseline:
+
+  python ucbench.py --size 4M --output baseline.json
+  python ucbench.py --size 4M --baseline baseline.json
+
+The second run exits with status 1 when a stage got slower, or used more
+memory, than the baseline by more than --tolerance.
+'''
+import sys
+import os
+import gc
+import json
+import time
+import random
+import resource
+import argparse
+import platform
+import cStringIO
+
+import uc
+import ucvector
+
+#Used when no dictionary is given to draw words from.
+VOCABULARY = u'''the of a and to in is was he for it with as his on be at by
+had are but from or have an they which one you were her all she there would
+their we him been has when who will more no if out so said what up its about
+into than them can only other new some could time these two may then do first
+any my now such like our over man me even most made after also did many before
+must through back years where much your way well down should because each just
+those people how too little state good very make world still own see men work
+long get here between both life being under never day same another know while
+last might us great old year off come since against go came right used take
+three city house garden river letter window morning evening mother father
+country question number small large early young point water room place night
+story story's mother's father's'''.split()
+
+CAPITALIZED = u'''Hong Kong New York United States America Sable Paris London
+Anna Maria Jones Smith River Thames Mount Royal Bank Street Park'''.split()
+
+CONNECTORS = [u'of', u'the', u'a']
+
+SEPARATORS = [u' '] * 12 + [u', ', u'. ', u'; ', u'\n']
+
+def parse_size(size):
+  '''Parse a byte count such as "512K" or "4M".'''
+  units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+  size = size.strip().upper()
+  if size and size[-1] in units:
+    return int(float(size[:-1]) * units[size[-1]])
+  return int(size)
+
+def generate_corpus(size, seed=0, vocabulary=None, capitalized_rate=0.05,
+                    hyphen_rate=0.02, apostrophe_rate=0.03, unknown_rate=0.02,
+                    paragraph_rate=0.01):
+  '''Return about "size" characters of synthetic text.
+
+  The same arguments always produce the same text. The rates are the
+  probabilities, per generated word, of starting a run of capitalized
+  words (possibly joined by connector words), of splitting a word with a
+  hyphen as a line break would, of a unicode apostrophe ("\\u2019s" or
+  "n\\u2019t"), of an unknown word made of random letters, and of a
+  paragraph break after the word.'''
+  rng = random.Random(seed)
+  vocabulary = vocabulary or VOCABULARY
+  letters = u'bcdfghjklmnpqrstvwxz'
+  buf = []
+  length = 0
+  while length < size:
+    r = rng.random()
+    if r < capitalized_rate:
+      run = [rng.choice(CAPITALIZED)]
+      for i in range(rng.randint(1, 3)):
+        if rng.random() < 0.3: run.append(rng.choice(CONNECTORS))
+        run.append(rng.choice(CAPITALIZED))
+      word = u' '.join(run)
+    elif r < capitalized_rate + unknown_rate:
+      word = u''.join(rng.choice(letters) for i in range(rng.randint(4, 9)))
+    else:
+      word = rng.choice(vocabulary)
+
+    if rng.random() < hyphen_rate and len(word) > 3 and u' ' not in word:
+      cut = rng.randint(1, len(word) - 1)
+      word = word[:cut] + u'-' + word[cut:]
+    if rng.random() < apostrophe_rate:
+      word += rng.choice([u'’s', u'n’t'])
+
+    if rng.random() < paragraph_rate: sep = u'.\n\n'
+    else: sep = rng.choice(SEPARATORS)
+    buf.append(word)
+    buf.append(sep)
+    length += len(word) + len(sep)
+  return u''.join(buf)[:size]
+
+def peak_memory(func):
+  '''Run "func" in a forked child and return the child's peak resident
+  set size in kilobytes, as reported by getrusage().'''
+  rfd, wfd = os.pipe()
+  pid = os.fork()
+  if pid == 0:
+    os.close(rfd)
+    try:
+      func()
+      os.write(wfd, str(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+    finally:
+      os._exit(0)
+  os.close(wfd)
+  data = os.read(rfd, 64)
+  os.close(rfd)
+  os.waitpid(pid, 0)
+  return int(data) if data else None
+
+def best_time(func, repeat):
+  '''Return the fastest of "repeat" runs of "func" in seconds.'''
+  best = None
+  for i in range(repeat):
+    gc.collect()
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    if best is None or elapsed < best: best = elapsed
+  return best
+
+def stages(text, dict):
+  '''Return (name, function) pairs, one per stage of a check of "text".
+  Every stage gets the output of the previous ones precomputed so it is
+  timed on its own. "tokenize_fused" does the work of both "tokenize" and
+  "normalize". "lookup_numpy" is only run when NumPy is installed.'''
+  raw_words,raw_idxs = uc.regex_word_search_help(text)
+  words,idxs = uc.normalize_text(raw_words, raw_idxs, text)
+  unknown_word_idx,unknown_word_set = uc.find_unknown_words(words, idxs,
+                                                            dict, None)
+  stat = uc.stat_line(unknown_word_set, set(words))
+
+  def lookup_cached():
+    uc.find_unknown_words(words, idxs, dict, uc.VerdictCache())
+
+  def render():
+    uc.render(uc.AnsiRenderer(cStringIO.StringIO()), text,
+              unknown_word_idx, stat)
+
+  def end_to_end():
+    uc.write_output(cStringIO.StringIO(), dict, text, 'ansi')
+
+  table = uc.tokenize_table(text)
+  def lookup_numpy():
+    ucvector.check_table(table, dict, None)
+
+  stages = [
+    ('tokenize', lambda: uc.regex_word_search_help(text)),
+    ('normalize', lambda: uc.normalize_text(raw_words, raw_idxs, text)),
+    ('tokenize_fused', lambda: uc.tokenize(text)),
+    ('lookup', lambda: uc.find_unknown_words(words, idxs, dict, None)),
+    ('lookup_cached', lookup_cached),
+    ('render', render),
+    ('end_to_end', end_to_end),
+    ]
+  if ucvector.available():
+    stages.append(('lookup_numpy', lookup_numpy))
+  return stages
+
+def run(text, dict, repeat=3, memory=True):
+  '''Benchmark every stage on "text" and return the results as a dict.'''
+  size = len(text.encode('utf-8'))
+  tokens = len(uc.regex_word_search_help(text)[0])
+  results = {}
+  for name,func in stages(text, dict):
+    seconds = best_time(func, repeat)
+    result = {'seconds': seconds,
+              'mb_per_s': size / seconds / 1e6 if seconds else None,
+              'tokens_per_s': tokens / seconds if seconds else None}
+    if memory:
+      result['peak_kb'] = peak_memory(func)
+    results[name] = result
+  return {'bytes': size, 'tokens': tokens, 'stages': results}
+
+def compare(results, baseline, tolerance):
+  '''Return a list of messages, one per stage of "results" that is slower
+  or uses more memory than the same stage of "baseline" by more than the
+  fraction "tolerance".'''
+  regressions = []
+  for name,base in sorted(baseline['stages'].items()):
+    got = results['stages'].get(name)
+    if got is None: continue
+    if base.get('mb_per_s') and got.get('mb_per_s') is not None:
+      if got['mb_per_s'] < base['mb_per_s'] * (1 - tolerance):
+        regressions.append('%s: %.2f MB/s, baseline %.2f MB/s' %
+                           (name, got['mb_per_s'], base['mb_per_s']))
+    if base.get('peak_kb') and got.get('peak_kb') is not None:
+      if got['peak_kb'] > base['peak_kb'] * (1 + tolerance):
+        regressions.append('%s: peak %d KB, baseline %d KB' %
+                           (name, got['peak_kb'], base['peak_kb']))
+  return regressions
+
+def report(results):
+  '''Return the results as a human readable table.'''
+  lines = ['%d bytes, %d tokens' % (results['bytes'], results['tokens']),
+           '%-14s %10s %10s %14s %10s' % ('stage', 'seconds', 'MB/s',
+                                          'tokens/s', 'peak KB')]
+  for name,r in sorted(results['stages'].items()):
+    lines.append('%-14s %10.4f %10.2f %14.0f %10s' %
+                 (name, r['seconds'], r['mb_per_s'] or 0,
+                  r['tokens_per_s'] or 0, r.get('peak_kb', '-')))
+  return '\n'.join(lines)
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Benchmark the stages of uc.')
+  parser.add_argument('--dict', default=uc.DICT,
+                      help='dictionary to check against')
+  parser.add_argument('--size', default='1M', type=parse_size,
+                      help='corpus size, e.g. 512K or 4M (default: 1M)')
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--capitalized-rate', type=float, default=0.05)
+  parser.add_argument('--hyphen-rate', type=float, default=0.02)
+  parser.add_argument('--apostrophe-rate', type=float, default=0.03)
+  parser.add_argument('--unknown-rate', type=float, default=0.02)
+  parser.add_argument('--repeat', type=int, default=3,
+                      help='time each stage this many times, keep the best')
+  parser.add_argument('--no-memory', action='store_true',
+                      help='skip the peak memory measurements')
+  parser.add_argument('--output', help='write the results to this JSON file')
+  parser.add_argument('--baseline', help='JSON results to compare against')
+  parser.add_argument('--tolerance', type=float, default=0.1,
+                      help='allowed regression as a fraction (default: 0.1)')
+  args = parser.parse_args(argv)
+
+  dict = uc.get_dictionary(args.dict)
+  params = {'size': args.size, 'seed': args.seed,
+            'capitalized_rate': args.capitalized_rate,
+            'hyphen_rate': args.hyphen_rate,
+            'apostrophe_rate': args.apostrophe_rate,
+            'unknown_rate': args.unknown_rate}
+  text = generate_corpus(**params)
+
+  results = run(text, dict, args.repeat, not args.no_memory)
+  results['params'] = params
+  results['dictionary'] = uc.REGISTRY.version(args.dict)
+  results['python'] = platform.python_version()
+  print report(results)
+
+  if args.output:
+    f = open(args.output, 'w')
+    json.dump(results, f, indent=2, sort_keys=True)
+    f.close()
+
+  if args.baseline:
+    f = open(args.baseline)
+    baseline = json.load(f)
+    f.close()
+    if baseline.get('params') != params:
+      print >> sys.stderr, 'warning: baseline was run with other parameters'
+    regressions = compare(results, baseline, args.tolerance)
+    for message in regressions:
+      print >> sys.stderr, 'REGRESSION ' + message
+    if regressions: return 1
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,217 @@
+# coding=utf-8
+'''Checker daemon and its client.
+
+Starting uc.py for every check pays for the interpreter, the imports and
+loading the dictionary before any text is looked at, which is too slow for
+editor save hooks and git pre-commit hooks. The daemon keeps dictionaries
+(and suggestion indexes) loaded and answers checks over a Unix domain
+socket, one thread per connection:
+
+  python uc.py --daemon &
+  python uc.py --client README
+
+With --client, uc.py checks the file in-process when no daemon is running.
+
+A request is a line of JSON giving the dictionary, output format and the
+length in bytes of the utf-8 text that follows it. The reply is a line of
+JSON giving either the length of the output that follows or an error.
+'''
+import os
+import sys
+import json
+import errno
+import socket
+import signal
+import tempfile
+import threading
+import cStringIO
+import SocketServer
+
+import uc
+
+#Requests larger than this are refused.
+MAX_REQUEST = 64 * 1024 * 1024
+MAX_HEADER = 1024 * 1024
+
+def default_socket():
+  '''Return the socket path from UC_SOCKET, or a per-user default.'''
+  return os.environ.get('UC_SOCKET') or os.path.join(
+    tempfile.gettempdir(), 'uglywords-%d.sock' % os.getuid())
+
+class DaemonUnavailable(EnvironmentError):
+  '''No daemon is listening on the socket.'''
+
+class DaemonError(Exception):
+  '''The daemon could not check the text.'''
+
+def _send(wfile, header, body):
+  header['length'] = len(body)
+  wfile.write(json.dumps(header) + '\n')
+  wfile.write(body)
+  wfile.flush()
+
+def _receive(rfile):
+  '''Read a header line and the body that follows it. Returns (header,
+  body), or (None, None) at the end of the stream.'''
+  line = rfile.readline(MAX_HEADER)
+  if not line: return None, None
+  if not line.endswith('\n'):
+    raise ValueError('header longer than %d bytes' % MAX_HEADER)
+  header = json.loads(line)
+  length = header.get('length', 0)
+  if not 0 <= length <= MAX_REQUEST:
+    raise ValueError('request too large: %d bytes' % length)
+  body = rfile.read(length)
+  if len(body) != length:
+    raise ValueError('connection closed after %d of %d bytes' %
+                     (len(body), length))
+  return header, body
+
+class CheckHandler(SocketServer.StreamRequestHandler):
+  '''Answers the requests sent on one connection.'''
+
+  def handle(self):
+    while True:
+      try:
+        header,body = _receive(self.rfile)
+        if header is None: return
+        output = self.server.check(header, body)
+        reply = {}
+      except socket.error:
+        return
+      except Exception, e:
+        output = ''
+        reply = {'error': '%s: %s' % (type(e).__name__, e)}
+      try:
+        _send(self.wfile, reply, output)
+      except socket.error:
+        return
+
+class CheckServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+  '''Threaded server holding the loaded dictionaries. Dictionaries come
+  from uc.REGISTRY, so an edited word list is still picked up.'''
+
+  daemon_threads = True
+
+  def __init__(self, path):
+    SocketServer.UnixStreamServer.__init__(self, path, CheckHandler)
+    self._indexes = {}
+    self._gazetteers = {}
+    self._lock = threading.Lock()
+
+  def suggestion_index(self, dict):
+    with self._lock:
+      index = self._indexes.get(dict)
+      if index is None or index.source != uc.file_version(dict):
+        import ucsuggest
+        index = self._indexes[dict] = ucsuggest.load_index(dict)
+      return index
+
+  def gazetteer(self, path):
+    with self._lock:
+      gazetteer = self._gazetteers.get(path)
+      if gazetteer is None or gazetteer.source != uc.file_version(path):
+        import ucnames
+        gazetteer = self._gazetteers[path] = ucnames.load_gazetteer(path)
+      return gazetteer
+
+  def check(self, header, body):
+    '''Return the output for one request.'''
+    dict = header.get('dict') or uc.DICT
+    format = header.get('format', 'ansi')
+    if format not in uc.RENDERERS:
+      raise ValueError('unknown format %r' % format)
+    suggest = None
+    if header.get('suggest'):
+      suggest = self.suggestion_index(dict).suggest
+    names = None
+    if header.get('names'):
+      names = self.gazetteer(header['names'])
+    dict = uc.layered_dictionary(dict, header.get('word_lists', ()),
+                                 header.get('words', ()))
+    out = cStringIO.StringIO()
+    uc.write_output(out, dict, body.decode('utf-8'), format, suggest,
+                    names=names)
+    return out.getvalue()
+
+def _listening(path):
+  '''Return True if a daemon answers on the socket "path".'''
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    sock.connect(path)
+    return True
+  except socket.error:
+    return False
+  finally:
+    sock.close()
+
+def make_server(path=None, dicts=()):
+  '''Bind the socket "path", replacing a stale one left by a daemon that
+  died, and load "dicts" so the first requests do not wait for them.'''
+  path = path or default_socket()
+  if os.path.exists(path):
+    if _listening(path):
+      raise EnvironmentError(errno.EADDRINUSE,
+                             'a daemon is already listening', path)
+    os.unlink(path)
+  old_umask = os.umask(0077) #only the owner may connect
+  try:
+    server = CheckServer(path)
+  finally:
+    os.umask(old_umask)
+  for dict in dicts:
+    uc.warm_dictionary(dict)
+  return server
+
+def serve(path=None, dicts=()):
+  '''Run the daemon until it is interrupted or sent SIGTERM.'''
+  server = make_server(path, dicts)
+  def stop(signum, frame):
+    raise KeyboardInterrupt
+  signal.signal(signal.SIGTERM, stop)
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+    try:
+      os.unlink(server.server_address)
+    except OSError:
+      pass
+  return 0
+
+def check(text, dict=None, format='ansi', suggest=False, path=None,
+          word_lists=(), words=(), timeout=None, names=None):
+  '''Have the daemon listening on "path" check the unicode "text" and
+  return its output as utf-8 bytes. "word_lists" and "words" are extra
+  word list files and words, see uc.layered_dictionary(), and "names" a
+  gazetteer file, see uc.write_output(). Raises
+  DaemonUnavailable if there is no daemon, and DaemonError if it could not
+  check the text.'''
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  sock.settimeout(timeout)
+  try:
+    try:
+      sock.connect(path or default_socket())
+    except socket.error, e:
+      raise DaemonUnavailable(e.errno, e.strerror, path or default_socket())
+    f = sock.makefile('rwb')
+    header = {'format': format, 'suggest': suggest}
+    if dict: header['dict'] = os.path.abspath(dict)
+    if word_lists: header['word_lists'] = map(os.path.abspath, word_lists)
+    if words: header['words'] = list(words)
+    if names: header['names'] = os.path.abspath(names)
+    _send(f, header, text.encode('utf-8'))
+    reply,output = _receive(f)
+    f.close()
+  finally:
+    sock.close()
+  if reply is None:
+    raise DaemonError('connection closed without a reply')
+  if 'error' in reply:
+    raise DaemonError(reply['error'])
+  return output
+
+if __name__ == '__main__':
+  sys.exit(serve(sys.argv[1] if len(sys.argv) > 1 else None, [uc.DICT]))
@@ -0,0 +1,233 @@
+# coding=utf-8
+'''Differential tests of the check engines.
+
+Every engine in uc.ENGINES has to find exactly the words, positions and
+verdicts of the "reference" engine, the original regex_word_search_idx()
+and find_unknown_words(). The grouping rules are easy to get subtly wrong,
+so this runs texts through all engines and reports, for each text and
+engine, the first word, position or verdict that differs from the
+reference. The texts are random ones built to exercise the rules
+(capitalized runs, connector words, apostrophes, "'s", hyphens, every kind
+of newline), a synthetic corpus (see ucbench.generate_corpus()) and any
+files given. The engines are timed on the synthetic corpus and the files,
+so the report also gives the speedup of each over the reference:
+
+  python ucdiff.py --cases 2000 corpus/*.txt
+
+Exits with status 1 if any engine diverged. A random text is printed with
+--print-case and the case number and seed of the report.
+'''
+import sys
+import time
+import json
+import codecs
+import random
+import argparse
+
+import uc
+import ucbench
+
+CONNECTORS = [u'of', u'the', u'a', u'Of', u'The', u'A']
+
+TRICKY = [u"didn't", u"didn’t", u"cat's", u"Cat’s", u"sus'", u"'tis",
+          u"o'clock", u"James's", u"James'", u"s", u"'s", u"’s", u"x's's",
+          u"co-dependent", u"anti-crime", u"amer-\nican", u"a-b-c",
+          u"mother-in-law's", u"Jean-Luc", u"rock-'n'-roll", u"-", u"--",
+          u"1984", u"3-4", u"2nd", u"café", u"Ça", u"naïve", u"Über",
+          u"I", u"O'Neil", u"McDonald’s", u"don’t-care", u"_", u"x_y"]
+
+SEPARATORS = [u' '] * 10 + [
+  u'  ', u'\t', u'\n', u'\n\n', u' \n \n', u'\r\n', u'\r\n\r\n', u'\r',
+  u'\r\r', u'\n\r', u'\n\r\n\r', u', ', u'. ', u'.\n\n', u'; ', u' - ',
+  u'"', u' "', u'" ', u"'", u" '", u"' ", u'’', u' (', u') ', u'\xa0',
+  u'\u2028', u'...']
+
+def random_text(rng, vocabulary, words=40):
+  '''Return a text of "words" words and separators drawn with "rng".'''
+  letters = u'bcdfghjklmnpqrstvwxz'
+  parts = []
+  for i in xrange(words):
+    r = rng.random()
+    if r < 0.25: word = rng.choice(ucbench.CAPITALIZED)
+    elif r < 0.4: word = rng.choice(CONNECTORS)
+    elif r < 0.55: word = rng.choice(TRICKY)
+    elif r < 0.6:
+      word = u''.join(rng.choice(letters) for i in range(rng.randint(1, 6)))
+    else: word = rng.choice(vocabulary)
+    if rng.random() < 0.1: word += rng.choice([u"'s", u'’s', u"'", u'-'])
+    parts.append(word)
+    parts.append(rng.choice(SEPARATORS))
+  return u''.join(parts)
+
+def random_case(seed, case, vocabulary):
+  '''Return random text number "case" of the run with "seed".'''
+  rng = random.Random(seed * 1000003 + case)
+  return random_text(rng, vocabulary, rng.randint(1, 60))
+
+def first_difference(reference, table):
+  '''Return (what, index, expected, got) for the first word, position or
+  verdict in which the checked TokenTable "table" differs from
+  "reference", or None if they are the same.'''
+  for what,expected,got in [
+      ('word', list(reference), list(table)),
+      ('position', list(reference.idxs()), list(table.idxs())),
+      ('verdict', [reference.is_unknown(i) for i in xrange(len(reference))],
+                  [table.is_unknown(i) for i in xrange(len(table))])]:
+    for i in xrange(max(len(expected), len(got))):
+      e = expected[i] if i < len(expected) else None
+      g = got[i] if i < len(got) else None
+      if e != g: return what, i, e, g
+  return None
+
+class Divergence(object):
+  '''An engine that did not check the text "source" as the reference did.'''
+
+  def __init__(self, engine, source, text, what, index, expected, got):
+    self.engine = engine
+    self.source = source
+    self.text = text
+    self.what = what
+    self.index = index
+    self.expected = expected
+    self.got = got
+
+  def context(self, reference):
+    '''Return the text around the word at "index" of the reference.'''
+    if self.index < len(reference):
+      start,end = reference.idx(self.index)
+    else:
+      start = end = len(self.text)
+    return self.text[max(start - 30, 0):end + 30]
+
+  def to_json(self):
+    return {'engine': self.engine, 'source': self.source, 'what': self.what,
+            'index': self.index, 'expected': self.expected, 'got': self.got}
+
+class EngineStats(object):
+  '''Time taken by one engine on the timed texts, and its divergences from
+  the reference on all texts.'''
+
+  def __init__(self, name):
+    self.name = name
+    self.seconds = 0.0
+    self.characters = 0
+    self.texts = 0
+    self.divergences = []
+
+  def to_json(self):
+    return {'seconds': self.seconds, 'characters': self.characters,
+            'texts': self.texts, 'divergent': len(self.divergences)}
+
+def compare_engines(texts, dict, engines, repeat=1, log=None):
+  '''Check every (source, text, timed) of "texts" with each engine of
+  "engines" (names, "reference" is added) and compare the results with
+  those of the reference. Returns a dictionary of EngineStats by engine
+  name. Each check gets a new VerdictCache, so no engine profits from an
+  earlier one. Texts that are "timed" are checked "repeat" times and the
+  best time is counted. Divergences are written to "log" as they are
+  found.'''
+  names = ['reference'] + [name for name in engines if name != 'reference']
+  engines = [uc.get_engine(name) for name in names]
+  stats = {name: EngineStats(name) for name in names}
+  for source,text,timed in texts:
+    reference = None
+    for engine in engines:
+      best = None
+      for i in xrange(repeat if timed else 1):
+        start = time.time()
+        table = engine(text, dict, uc.VerdictCache())
+        elapsed = time.time() - start
+        if best is None or elapsed < best: best = elapsed
+      engine_stats = stats[engine.name]
+      engine_stats.texts += 1
+      if timed:
+        engine_stats.seconds += best
+        engine_stats.characters += len(text)
+      if reference is None:
+        reference = table
+        continue
+      difference = first_difference(reference, table)
+      if difference is not None:
+        divergence = Divergence(engine.name, source, text, *difference)
+        engine_stats.divergences.append(divergence)
+        if log is not None:
+          print >> log, '%s: %s: %s %d is %r, not %r, in %r' % (
+            engine.name, source, divergence.what, divergence.index,
+            divergence.got, divergence.expected, divergence.context(reference))
+  return stats
+
+def report(stats):
+  '''Return the EngineStats "stats" as a human readable table.'''
+  reference = stats['reference']
+  lines = ['%-12s %10s %10s %10s %10s' % ('engine', 'divergent', 'seconds',
+                                          'MB/s', 'speedup')]
+  for name in sorted(stats, key=lambda name: (name != 'reference', name)):
+    s = stats[name]
+    mb_per_s = s.characters / s.seconds / 1e6 if s.seconds else 0
+    speedup = reference.seconds / s.seconds if s.seconds else 0
+    lines.append('%-12s %10d %10.4f %10.2f %9.2fx' %
+                 (name, len(s.divergences), s.seconds, mb_per_s, speedup))
+  return '\n'.join(lines)
+
+def read_text(path):
+  f = codecs.open(path, encoding='utf-8')
+  try:
+    return f.read()
+  finally:
+    f.close()
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(
+    description='Compare the check engines with the reference engine.')
+  parser.add_argument('corpus', nargs='*', help='utf-8 text files to check')
+  parser.add_argument('--dict', default=uc.DICT,
+                      help='dictionary to check against')
+  parser.add_argument('--engine', action='append', choices=sorted(uc.ENGINES),
+                      help='engine to compare; may be given more than once '
+                           '(default: all that can run here)')
+  parser.add_argument('--cases', type=int, default=1000,
+                      help='random texts to check (default: %(default)s)')
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--size', default='256K', type=ucbench.parse_size,
+                      help='size of the synthetic corpus, 0 for none '
+                           '(default: 256K)')
+  parser.add_argument('--repeat', type=int, default=3,
+                      help='time each check this many times, keep the best')
+  parser.add_argument('--print-case', type=int, metavar='N',
+                      help='print random text N and exit')
+  parser.add_argument('--output', help='write the results to this JSON file')
+  args = parser.parse_args(argv)
+
+  dict = uc.get_dictionary(args.dict)
+  vocabulary = sorted(random.Random(args.seed).sample(
+    [word for word in dict], min(len(dict), 500)))
+  if args.print_case is not None:
+    sys.stdout.write(random_case(args.seed, args.print_case,
+                                 vocabulary).encode('utf-8'))
+    return 0
+
+  engines = args.engine or [name for name,engine in sorted(uc.ENGINES.items())
+                            if engine.available()]
+  def texts():
+    for case in xrange(args.cases):
+      yield ('case %d (seed %d)' % (case, args.seed),
+             random_case(args.seed, case, vocabulary), False)
+    if args.size:
+      yield ('synthetic corpus',
+             ucbench.generate_corpus(args.size, args.seed), True)
+    for path in args.corpus:
+      yield path, read_text(path), True
+
+  stats = compare_engines(texts(), dict, engines, args.repeat, sys.stderr)
+  print report(stats)
+  if args.output:
+    f = open(args.output, 'w')
+    json.dump({'engines': {name: s.to_json() for name,s in stats.items()},
+               'divergences': [d.to_json() for s in stats.values()
+                               for d in s.divergences]},
+              f, indent=2, sort_keys=True)
+    f.close()
+  return 1 if any(s.divergences for s in stats.values()) else 0
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,211 @@
+# coding=utf-8
+'''Multi-word proper names from a gazetteer.
+
+normalize_text() joins runs of capitalized words, and the connectors
+between them, into single words such as "United States of America Hammer",
+and such a run is almost never in a dictionary of single words. A
+gazetteer lists known names, one per line ("United States of America",
+"Hong Kong"). Its names are kept in a token trie: each word of a name is a
+step down the trie, so all the names inside a run are found in one pass
+over its words, trying the longest name first at each word.
+
+split_runs() replaces each run of a TokenTable by the names found in it and
+the words left over, and a Gazetteer is also a dictionary of its names, so
+layering it over the dictionary recognizes them (see uc.write_output()):
+
+  python uc.py --names dict/places textfile
+
+The trie is built once and saved next to the gazetteer.
+'''
+import sys
+import os
+import marshal
+import codecs
+import array
+import argparse
+
+import uc
+
+INDEX_VERSION = 1
+_END = '' #trie key marking the end of a name
+
+def name_words(name):
+  '''Return the lowercase words of "name", as a run is split into.'''
+  return [m.group(0).lower() for m in uc.WORD_PAT.finditer(name)]
+
+class Gazetteer(object):
+  '''Token trie of the names of a gazetteer.'''
+
+  def __init__(self, trie, count, source=None):
+    self.trie = trie
+    self.count = count
+    self.source = source #version of the gazetteer the trie was built from
+
+  @classmethod
+  def build(cls, names, source=None):
+    '''Index the iterable of "names".'''
+    trie = {}
+    count = 0
+    for name in names:
+      words = name_words(uc.fold_apostrophes(name))
+      if not words: continue
+      node = trie
+      for word in words:
+        node = node.setdefault(word, {})
+      if _END not in node:
+        node[_END] = True
+        count += 1
+    return cls(trie, count, source)
+
+  def save(self, path):
+    '''Write the trie to "path" in marshal format, which loads quickly.'''
+    tmp = path + '.tmp'
+    f = open(tmp, 'wb')
+    try:
+      marshal.dump((INDEX_VERSION, self.source, self.count, self.trie), f, 2)
+    finally:
+      f.close()
+    os.rename(tmp, path)
+
+  @classmethod
+  def load(cls, path):
+    f = open(path, 'rb')
+    try:
+      data = marshal.load(f)
+    finally:
+      f.close()
+    if data[0] != INDEX_VERSION:
+      raise ValueError('%s: unsupported index version %r' % (path, data[0]))
+    version,source,count,trie = data
+    return cls(trie, count, source)
+
+  def __len__(self):
+    return self.count
+
+  def __iter__(self):
+    '''Iterate over the names, lowercase and with single spaces.'''
+    stack = [(self.trie, [])]
+    while stack:
+      node,words = stack.pop()
+      if _END in node: yield u' '.join(words)
+      for word,child in node.iteritems():
+        if word != _END: stack.append((child, words + [word]))
+
+  def __contains__(self, name):
+    node = self.trie
+    for word in name_words(name):
+      node = node.get(word)
+      if node is None: return False
+    return _END in node
+
+  def match(self, words):
+    '''Return the (first, last) word indices, last exclusive, of the names
+    in the list of lowercase "words". At each word the longest name
+    starting there is taken and the search goes on after it.'''
+    found = []
+    i = 0
+    while i < len(words):
+      node = self.trie
+      end = None
+      j = i
+      while j < len(words):
+        node = node.get(words[j])
+        if node is None: break
+        j += 1
+        if _END in node: end = j
+      if end is None:
+        i += 1
+      else:
+        found.append((i, end))
+        i = end
+    return found
+
+  def split(self, table):
+    return split_runs(table, self)
+
+def strip_possessive(word, span):
+  '''Return "span" of "word" without a trailing possessive 's, as the
+  tokenizer cuts it off the last word of a run.'''
+  start, end = span
+  if end - start > 2 and uc._POSSESSIVE.match(word, end - 2, end):
+    end -= 2
+  return start, end
+
+def split_runs(table, gazetteer):
+  '''Return a TokenTable like "table" with every run of several words
+  split into the names "gazetteer" finds in it and, one by one, the words
+  left over. Other words are kept as they are.'''
+  text = uc.fold_apostrophes(table.text)
+  starts = array.array('l')
+  ends = array.array('l')
+  for start,end in table.idxs():
+    word = text[start:end]
+    if not any(c.isspace() for c in word):
+      starts.append(start)
+      ends.append(end)
+      continue
+    spans = [strip_possessive(word, m.span())
+             for m in uc.WORD_PAT.finditer(word)]
+    names = gazetteer.match([word[s:e].lower() for s,e in spans])
+    i = 0
+    for first,last in names + [(len(spans), len(spans))]:
+      for s,e in spans[i:first]:
+        starts.append(start + s)
+        ends.append(start + e)
+      if first < last:
+        starts.append(start + spans[first][0])
+        ends.append(start + spans[last - 1][1])
+      i = last
+  return type(table)(table.text, starts, ends)
+
+def index_path(gazetteer):
+  '''Return where the trie for gazetteer file "gazetteer" is kept.'''
+  return gazetteer + '.trie'
+
+def read_names(path):
+  f = codecs.open(path, encoding='utf-8')
+  try:
+    return [line.strip() for line in f if line.strip()]
+  finally:
+    f.close()
+
+def load_gazetteer(path, index=None, build=True):
+  '''Return the Gazetteer of the names in the file "path". A saved trie is
+  used when it was built from the file as it is now; otherwise the trie is
+  built and saved, or None is returned if "build" is False.'''
+  index = index or index_path(path)
+  version = uc.file_version(path)
+  if os.path.exists(index):
+    gazetteer = Gazetteer.load(index)
+    if gazetteer.source == version: return gazetteer
+  if not build: return None
+  gazetteer = Gazetteer.build(read_names(path), source=version)
+  gazetteer.save(index)
+  return gazetteer
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(
+    description='Build a gazetteer trie or find the names in text.')
+  parser.add_argument('gazetteer', help='file of names, one per line')
+  parser.add_argument('text', nargs='*', help='text to find names in')
+  parser.add_argument('--build', action='store_true',
+                      help='build the trie even if it is up to date')
+  args = parser.parse_args(argv)
+
+  if args.build:
+    gazetteer = Gazetteer.build(read_names(args.gazetteer),
+                                source=uc.file_version(args.gazetteer))
+    gazetteer.save(index_path(args.gazetteer))
+    print 'indexed %d names' % len(gazetteer)
+  else:
+    gazetteer = load_gazetteer(args.gazetteer)
+  for text in args.text:
+    text = text.decode('utf-8')
+    spans = [m.span() for m in uc.WORD_PAT.finditer(text)]
+    names = gazetteer.match([text[s:e].lower() for s,e in spans])
+    for first,last in names:
+      print text[spans[first][0]:spans[last - 1][1]].encode('utf-8')
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
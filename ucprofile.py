@@ -0,0 +1,146 @@
+# coding=utf-8
+'''Profiles of single checks.
+
+Profile runs a block of code under cProfile while a sampling thread
+records the stack of the profiled thread every few milliseconds. On exit
+it writes, to a profile directory:
+
+  NAME.pstats     cProfile statistics, for pstats or snakeviz
+  NAME.collapsed  sampled stacks, one "frame;frame;frame count" line each,
+                  the input of flamegraph.pl and speedscope
+  NAME.json       the size of the input and the words and unknown words
+                  checked, as counted with Profile.count()
+
+Only the newest "keep" profiles are kept in the directory.
+
+  python uc.py --profile textfile
+'''
+import os
+import sys
+import json
+import time
+import thread
+import itertools
+import threading
+import cProfile
+
+PROFILE_DIR = os.environ.get('UC_PROFILE_DIR', 'profiles')
+PROFILE_KEEP = int(os.environ.get('UC_PROFILE_KEEP', 20))
+SAMPLE_INTERVAL = 0.005
+
+#Numbers the profiles of this process, which may be saved within a second.
+_serial = itertools.count()
+
+class StackSampler(threading.Thread):
+  '''Counts the stacks of thread "ident" every "interval" seconds.'''
+
+  def __init__(self, ident, interval=SAMPLE_INTERVAL):
+    threading.Thread.__init__(self)
+    self.daemon = True
+    self.ident_ = ident
+    self.interval = interval
+    self.stacks = {}
+    self._stopped = False
+
+  def run(self):
+    while not self._stopped:
+      #Event.wait() polls with growing sleeps in Python 2, so sleep here.
+      time.sleep(self.interval)
+      frame = sys._current_frames().get(self.ident_)
+      if frame is None: continue
+      stack = []
+      while frame is not None:
+        code = frame.f_code
+        stack.append('%s:%s' % (os.path.basename(code.co_filename),
+                                code.co_name))
+        frame = frame.f_back
+      key = ';'.join(reversed(stack))
+      self.stacks[key] = self.stacks.get(key, 0) + 1
+
+  def stop(self):
+    self._stopped = True
+    self.join()
+
+  def collapsed(self):
+    '''Return the samples in the collapsed stack format.'''
+    return ''.join('%s %d\n' % item for item in sorted(self.stacks.items()))
+
+class Profile(object):
+  '''Context manager profiling its block, see the module documentation.
+  "name" is worked into the file names; anything put in "info" is saved
+  with the profile. The code profiled counts the documents it checks with
+  count(). "path" is the common path of the files once written.'''
+
+  def __init__(self, directory=None, name='uc', keep=None):
+    self.directory = directory or PROFILE_DIR
+    self.name = ''.join(c if c.isalnum() or c in '-_.' else '_'
+                        for c in name)[:60]
+    self.keep = PROFILE_KEEP if keep is None else keep
+    self.info = {'documents': 0, 'characters': 0, 'tokens': 0, 'unknown': 0}
+    self.path = None
+
+  def count(self, text, table=None, unknown=None):
+    '''Count the document "text" as checked. "table" is the checked
+    uc.TokenTable; without one, "unknown" is the number of unknown words.'''
+    self.info['documents'] += 1
+    self.info['characters'] += len(text)
+    if table is not None:
+      self.info['tokens'] += len(table)
+      unknown = table.count_unknown()
+    self.info['unknown'] += unknown or 0
+
+  def __enter__(self):
+    self._sampler = StackSampler(thread.get_ident())
+    self._profiler = cProfile.Profile()
+    self._started = time.time()
+    self._sampler.start()
+    self._profiler.enable()
+    return self
+
+  def __exit__(self, *exc_info):
+    self._profiler.disable()
+    self._sampler.stop()
+    elapsed = time.time() - self._started
+    info = {'name': self.name, 'seconds': elapsed,
+            'samples': sum(self._sampler.stacks.values()),
+            'sample_interval': self._sampler.interval}
+    info.update(self.info)
+    self.save(info)
+
+  def save(self, info):
+    if not os.path.isdir(self.directory):
+      os.makedirs(self.directory)
+    self.path = os.path.join(self.directory, '%s-%d-%04d-%s' % (
+      time.strftime('%Y%m%d-%H%M%S'), os.getpid(), next(_serial),
+      self.name))
+    self._profiler.dump_stats(self.path + '.pstats')
+    f = open(self.path + '.collapsed', 'w')
+    try:
+      f.write(self._sampler.collapsed())
+    finally:
+      f.close()
+    f = open(self.path + '.json', 'w')
+    try:
+      json.dump(info, f, indent=1, sort_keys=True)
+    finally:
+      f.close()
+    prune(self.directory, self.keep)
+
+def prune(directory, keep):
+  '''Delete all but the newest "keep" profiles in "directory".'''
+  profiles = []
+  for name in os.listdir(directory):
+    if name.endswith('.pstats'):
+      path = os.path.join(directory, name[:-len('.pstats')])
+      try:
+        profiles.append((os.path.getmtime(path + '.pstats'), path))
+      except OSError:
+        #Pruned by another process since it was listed
+        continue
+  profiles.sort(reverse=True)
+  for mtime,path in profiles[keep:]:
+    for suffix in ('.pstats', '.collapsed', '.json'):
+      try:
+        os.remove(path + suffix)
+      except OSError:
+        pass
@@ -0,0 +1,518 @@
+# coding=utf-8
+'''Standalone HTTP server for uglytext.py.
+
+uglytext.app is a WSGI application written for App Engine. This server
+runs it, and so serves the same routes, on a plain host:
+
+  python ucserver.py --port 8080 --workers 4
+
+One process reads requests and writes responses with asyncore, so a slow
+client only costs a buffer. Complete requests are handed to a pool of
+worker processes, each of which imports the application when it starts,
+which loads the dictionary (see uc.warm_dictionary()), and then runs
+requests one at a time. Everything the application keeps in memory, the
+result cache and the numbers served at /metrics included, is per worker.
+
+Requests are refused early rather than queued without limit:
+
+  413  the body is larger than --max-body bytes
+  431  the request line and headers are larger than MAX_HEADER bytes
+  411  a request with a body has no Content-Length
+  408  the request did not arrive within --timeout seconds
+  503  --queue requests are already waiting for a worker (with Retry-After)
+
+and requests a worker does not answer are given up on:
+
+  502  the worker running the request died
+  504  no answer within --request-timeout seconds; the worker is killed
+
+SIGHUP replaces the workers with new ones, which import the application and
+load the dictionary as they are now; requests the old workers have are
+still answered by them. SIGTERM and SIGINT close the listening socket and
+exit once the requests in progress are answered.
+'''
+import os
+import sys
+import time
+import fcntl
+import errno
+import signal
+import socket
+import urllib
+import asyncore
+import argparse
+import importlib
+import threading
+import traceback
+import cStringIO
+import collections
+import multiprocessing
+from email.utils import formatdate
+
+MAX_HEADER = 64 * 1024
+MAX_BODY = 16 * 1024 * 1024
+TIMEOUT = 30.0
+REQUEST_TIMEOUT = 60.0
+QUEUE = 16
+RETRY_AFTER = 1
+_CHUNK = 65536
+_POLL = 0.25 #seconds between checks of deadlines and workers
+
+REASONS = {
+  400: 'Bad Request', 408: 'Request Timeout', 411: 'Length Required',
+  413: 'Request Entity Too Large', 431: 'Request Header Fields Too Large',
+  500: 'Internal Server Error', 501: 'Not Implemented', 502: 'Bad Gateway',
+  503: 'Service Unavailable', 504: 'Gateway Timeout',
+  505: 'HTTP Version Not Supported'}
+
+#Headers the server sets itself.
+_HOP_BY_HOP = frozenset(['connection', 'content-length', 'keep-alive',
+                         'transfer-encoding'])
+
+class HTTPError(Exception):
+  '''A request the server answers itself, with "status".'''
+  def __init__(self, status, headers=()):
+    Exception.__init__(self, status)
+    self.status = status
+    self.headers = list(headers)
+
+def error_response(status, headers=()):
+  '''Return (status line, headers, body) for an error the server answers.'''
+  reason = REASONS[status]
+  return ('%d %s' % (status, reason),
+          [('Content-Type', 'text/plain')] + list(headers), reason + '\n')
+
+def parse_head(head, max_body=MAX_BODY):
+  '''Return the WSGI environ, without wsgi.input and wsgi.errors, for the
+  request line and headers "head". Raises HTTPError for requests that are
+  not served.'''
+  lines = head.split('\r\n')
+  try:
+    method,target,version = lines[0].split(' ')
+  except ValueError:
+    raise HTTPError(400)
+  if not version.startswith('HTTP/1.'): raise HTTPError(505)
+  path,_,query = target.partition('?')
+  environ = {'REQUEST_METHOD': method, 'SCRIPT_NAME': '',
+             'PATH_INFO': urllib.unquote(path), 'QUERY_STRING': query,
+             'SERVER_PROTOCOL': version}
+  for line in lines[1:]:
+    name,colon,value = line.partition(':')
+    if not colon or not name or name != name.strip(): raise HTTPError(400)
+    key = name.upper().replace('-', '_')
+    if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'): key = 'HTTP_' + key
+    value = value.strip()
+    if key in environ: environ[key] += ',' + value
+    else: environ[key] = value
+
+  if 'HTTP_TRANSFER_ENCODING' in environ:
+    raise HTTPError(411) #chunked bodies are not read
+  length = environ.get('CONTENT_LENGTH')
+  if length is None:
+    if method in ('POST', 'PUT'): raise HTTPError(411)
+    environ['CONTENT_LENGTH'] = '0'
+  else:
+    if not length.isdigit(): raise HTTPError(400)
+    if int(length) > max_body: raise HTTPError(413)
+  return environ
+
+_app = None
+_slots = None
+
+def _start_worker(app, slots):
+  '''Set up a worker process: leave the signals to the server, which stops
+  the workers itself, and load the application.'''
+  global _app, _slots
+  _slots = slots
+  for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+    signal.signal(signum, signal.SIG_IGN)
+  if isinstance(app, basestring):
+    module,_,name = app.partition(':')
+    app = getattr(importlib.import_module(module), name or 'app')
+  _app = app
+
+def _run(slot, environ, body):
+  '''Answer one request in a worker. Returns (status line, headers, body).
+  While it runs, the worker's pid is in "slot" of the shared slot array,
+  which tells the server which request was lost if the worker dies.'''
+  _slots[slot] = os.getpid()
+  try:
+    return _respond(environ, body)
+  finally:
+    _slots[slot] = 0
+
+def _respond(environ, body):
+  environ['wsgi.version'] = (1, 0)
+  environ['wsgi.url_scheme'] = 'http'
+  environ['wsgi.input'] = cStringIO.StringIO(body)
+  environ['wsgi.errors'] = sys.stderr
+  environ['wsgi.multithread'] = False
+  environ['wsgi.multiprocess'] = True
+  environ['wsgi.run_once'] = False
+  out = cStringIO.StringIO()
+  response = []
+  def start_response(status, headers, exc_info=None):
+    response[:] = [status, headers]
+    return out.write
+  try:
+    result = _app(environ, start_response)
+    try:
+      for data in result:
+        out.write(data)
+    finally:
+      if hasattr(result, 'close'): result.close()
+    status,headers = response
+  except Exception:
+    traceback.print_exc()
+    return error_response(500)
+  return status, [(str(name), str(value)) for name,value in headers
+                  if name.lower() not in _HOP_BY_HOP], out.getvalue()
+
+#States of a Connection.
+READING, WAITING, WRITING, DRAINING = range(4)
+
+class Connection(asyncore.dispatcher):
+  '''One client connection, which carries one request.'''
+
+  def __init__(self, sock, addr, server):
+    asyncore.dispatcher.__init__(self, sock, server.map)
+    self.server = server
+    self.client = addr
+    self.state = READING
+    self.deadline = time.time() + server.timeout
+    self.head = ''
+    self.environ = None
+    self.chunks = []
+    self.received = 0
+    self.output = ''
+    self.sent = 0
+    self.closed = False
+    self.slot = None #of the server, while a worker has the request
+    self.ticket = None #tells the answer to the request from a late one
+    self.result = None #the pool's AsyncResult for the request
+
+  def readable(self):
+    return self.state in (READING, DRAINING)
+
+  def writable(self):
+    return self.sent < len(self.output)
+
+  def handle_read(self):
+    data = self.recv(_CHUNK)
+    if self.state == DRAINING or not data: return
+    try:
+      if self.environ is None:
+        self.head += data
+        end = self.head.find('\r\n\r\n')
+        if end < 0:
+          if len(self.head) > MAX_HEADER: raise HTTPError(431)
+          return
+        data = self.head[end + 4:]
+        self.environ = parse_head(self.head[:end], self.server.max_body)
+        self.head = self.head[:end]
+        if self.environ.get('HTTP_EXPECT', '').lower() == '100-continue':
+          self.output = 'HTTP/1.1 100 Continue\r\n\r\n'
+      if data:
+        self.chunks.append(data)
+        self.received += len(data)
+      if self.received >= int(self.environ['CONTENT_LENGTH']):
+        self.state = WAITING
+        self.server.submit(self, self.environ, ''.join(self.chunks))
+        self.chunks = []
+    except HTTPError, e:
+      self.respond(*error_response(e.status, e.headers))
+
+  def respond(self, status, headers, body):
+    '''Send the response and close the connection once it is sent.'''
+    if self.closed: return
+    method = (self.environ or {}).get('REQUEST_METHOD')
+    lines = ['HTTP/1.1 ' + status,
+             'Date: ' + formatdate(usegmt=True),
+             'Content-Length: %d' % len(body),
+             'Connection: close']
+    lines.extend('%s: %s' % header for header in headers)
+    unread = self.state == READING
+    self.output = self.output[self.sent:] + '\r\n'.join(lines) + '\r\n\r\n'
+    if method != 'HEAD': self.output += body
+    self.sent = 0
+    self.state = DRAINING if unread else WRITING
+    self.deadline = time.time() + self.server.timeout
+    self.server.log(self, status, len(body))
+
+  def handle_write(self):
+    sent = self.send(buffer(self.output, self.sent, _CHUNK))
+    if sent: self.deadline = time.time() + self.server.timeout
+    self.sent += sent
+    if self.sent < len(self.output) or self.state == READING: return
+    if self.state == WRITING:
+      self.close()
+    elif self.state == DRAINING:
+      #The client may still be sending the request; closing now could reset
+      #the connection before it reads the answer, so read until it closes.
+      try:
+        self.socket.shutdown(socket.SHUT_WR)
+      except socket.error:
+        self.close()
+
+  def expire(self, now):
+    '''Give up on a client, or a worker, that took too long.'''
+    if now < self.deadline: return
+    if self.state == READING:
+      self.respond(*error_response(408))
+    elif self.state == WAITING:
+      self.server.abandon(self, 504)
+    else:
+      self.close()
+
+  def handle_close(self):
+    self.close()
+
+  def handle_error(self):
+    self.server.log(self, 'error: %s' % sys.exc_info()[1], 0)
+    self.close()
+
+  def close(self):
+    self.closed = True
+    asyncore.dispatcher.close(self)
+
+class WorkerLost(Exception):
+  '''The result of a request a worker died running or was killed for.'''
+
+class Waker(asyncore.file_dispatcher):
+  '''Self-pipe that wakes the asyncore loop from other threads.'''
+
+  def __init__(self, map):
+    r,self.w = os.pipe()
+    fcntl.fcntl(self.w, fcntl.F_SETFL, os.O_NONBLOCK)
+    asyncore.file_dispatcher.__init__(self, r, map)
+    os.close(r) #file_dispatcher keeps a duplicate
+    self.callbacks = collections.deque()
+
+  def call(self, function, *args):
+    '''Have the loop run function(*args). Safe to call from any thread.'''
+    self.callbacks.append((function, args))
+    try:
+      os.write(self.w, 'x')
+    except OSError, e:
+      if e.errno != errno.EAGAIN: raise #already woken up
+
+  def readable(self):
+    return True
+
+  def writable(self):
+    return False
+
+  def handle_read(self):
+    self.recv(4096)
+    while self.callbacks:
+      function,args = self.callbacks.popleft()
+      try:
+        function(*args)
+      except Exception:
+        traceback.print_exc()
+
+class Server(asyncore.dispatcher):
+  '''Accepts connections on "address" and answers them with "app", a WSGI
+  application or the "module:name" of one, run by "workers" processes.'''
+
+  def __init__(self, address, app='uglytext:app', workers=None, queue=QUEUE,
+               max_body=MAX_BODY, timeout=TIMEOUT,
+               request_timeout=REQUEST_TIMEOUT, log=sys.stderr):
+    self.map = {}
+    asyncore.dispatcher.__init__(self, map=self.map)
+    self.app = app
+    self.workers = workers or multiprocessing.cpu_count()
+    self.queue = queue
+    self.max_body = max_body
+    self.timeout = timeout
+    self.request_timeout = request_timeout
+    self.logfile = log
+    #A request holds one of the slots from when it is handed to the pool
+    #until it is answered or given up on, so at most workers + queue are
+    #ever in the pool. The shared array has the pid of the worker running
+    #the request of each slot, and is inherited by every pool.
+    self.slots = multiprocessing.RawArray('l', self.workers + queue)
+    self.free = range(self.workers + queue)
+    self.waiting = {} #connections by slot
+    self.stopping = False
+    self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+    self.set_reuse_addr()
+    self.bind(address)
+    self.listen(128)
+    self.address = self.socket.getsockname()
+    self.waker = Waker(self.map)
+    self.pool = self.start_pool()
+
+  @property
+  def pending(self):
+    '''Requests handed to the pool and not yet answered.'''
+    return len(self.waiting)
+
+  def start_pool(self):
+    return multiprocessing.Pool(self.workers, _start_worker,
+                                (self.app, self.slots))
+
+  def handle_accept(self):
+    pair = self.accept()
+    if pair is not None:
+      Connection(pair[0], pair[1], self)
+
+  def submit(self, connection, environ, body):
+    '''Have a worker answer the request of "connection", unless too many
+    requests are waiting already.'''
+    if not self.free:
+      connection.respond(*error_response(
+        503, [('Retry-After', str(RETRY_AFTER))]))
+      return
+    environ['SERVER_NAME'],port = self.address[:2]
+    environ['SERVER_PORT'] = str(port)
+    environ['REMOTE_ADDR'] = connection.client[0]
+    slot = connection.slot = self.free.pop()
+    ticket = connection.ticket = object()
+    self.waiting[slot] = connection
+    connection.deadline = time.time() + self.request_timeout
+    def done(response):
+      self.waker.call(self.finish, connection, ticket, response)
+    connection.result = self.pool.apply_async(_run, (slot, environ, body),
+                                              callback=done)
+
+  def release(self, connection):
+    '''Free the slot of "connection"; a late answer is then ignored.'''
+    del self.waiting[connection.slot]
+    self.slots[connection.slot] = 0
+    self.free.append(connection.slot)
+    connection.slot = connection.ticket = connection.result = None
+
+  def finish(self, connection, ticket, response):
+    if connection.ticket is not ticket: return #given up on already
+    self.release(connection)
+    connection.respond(*response)
+
+  def abandon(self, connection, status):
+    '''Answer the request of "connection", which a worker has, with the
+    error "status". A worker still running it is killed, so that it does
+    not go on taking up a place in the pool.'''
+    pid = self.slots[connection.slot]
+    if pid:
+      try:
+        os.kill(pid, signal.SIGKILL)
+      except OSError:
+        pass
+    #Python 2's Pool waits for the tasks of dead workers forever, and then
+    #never finishes closing, so mark the request as failed.
+    try:
+      connection.result._set(None, (False, WorkerLost(status)))
+    except KeyError:
+      pass #answered meanwhile; finish() ignores the answer
+    self.release(connection)
+    connection.respond(*error_response(status))
+
+  def check_workers(self):
+    '''Give up on the requests of workers that died while running them.
+    The pool replaces the workers but drops their requests.'''
+    for slot,connection in self.waiting.items():
+      pid = self.slots[slot]
+      if not pid: continue
+      try:
+        os.kill(pid, 0)
+      except OSError, e:
+        if e.errno != errno.ESRCH: raise
+        self.log(None, 'worker %d died running a request' % pid, 0)
+        self.abandon(connection, 502)
+
+  def restart(self):
+    '''Replace the workers; may be called from any thread.'''
+    self.waker.call(self._restart)
+
+  def _restart(self):
+    old,self.pool = self.pool,self.start_pool()
+    old.close() #the old workers exit once their requests are answered
+    reaper = threading.Thread(target=old.join)
+    reaper.daemon = True
+    reaper.start()
+    self.log(None, 'workers restarted', 0)
+
+  def stop(self):
+    '''Stop accepting connections and return from serve_forever() once the
+    requests in progress are answered; may be called from any thread.'''
+    self.waker.call(self._stop)
+
+  def _stop(self):
+    if not self.stopping:
+      self.stopping = True
+      self.close()
+
+  def connections(self):
+    return [c for c in self.map.values() if isinstance(c, Connection)]
+
+  def serve_forever(self):
+    try:
+      while not self.stopping or self.pending or self.connections():
+        asyncore.loop(_POLL, True, self.map, 1)
+        self.check_workers()
+        now = time.time()
+        #Waiting connections the client closed still hold their slots.
+        for connection in set(self.connections() + self.waiting.values()):
+          connection.expire(now)
+    finally:
+      self.pool.close()
+      self.pool.join()
+      self.waker.close()
+      if not self.stopping: self.close()
+
+  def log(self, connection, status, size):
+    if self.logfile is None: return
+    if connection is None:
+      self.logfile.write('%s\n' % status)
+      return
+    self.logfile.write('%s - - [%s] "%s" %s %d\n' % (
+      connection.client[0], time.strftime('%d/%b/%Y:%H:%M:%S'),
+      connection.head.split('\r\n', 1)[0][:200].encode('string_escape'),
+      status.split(' ')[0], size))
+
+def serve(address, app='uglytext:app', **options):
+  '''Run a Server until it is sent SIGTERM or SIGINT; SIGHUP restarts its
+  workers.'''
+  server = Server(address, app, **options)
+  signal.signal(signal.SIGHUP, lambda signum, frame: server.restart())
+  for signum in (signal.SIGTERM, signal.SIGINT):
+    signal.signal(signum, lambda signum, frame: server.stop())
+  print >> sys.stderr, 'serving %s on %s:%d with %d workers' % (
+    app, server.address[0], server.address[1], server.workers)
+  server.serve_forever()
+  return 0
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(
+    description='Serve uglytext.py over HTTP.')
+  parser.add_argument('--host', default='127.0.0.1',
+                      help='address to listen on (default: %(default)s)')
+  parser.add_argument('--port', type=int, default=8080,
+                      help='port to listen on (default: %(default)s)')
+  parser.add_argument('--app', default='uglytext:app',
+                      help='WSGI application to serve (default: %(default)s)')
+  parser.add_argument('--workers', type=int,
+                      help='worker processes (default: one per CPU)')
+  parser.add_argument('--queue', type=int, default=QUEUE,
+                      help='requests waiting for a worker before others are '
+                           'refused (default: %(default)s)')
+  parser.add_argument('--max-body', type=int, default=MAX_BODY,
+                      help='largest request body in bytes '
+                           '(default: %(default)s)')
+  parser.add_argument('--timeout', type=float, default=TIMEOUT,
+                      help='seconds a client has to send its request '
+                           '(default: %(default)s)')
+  parser.add_argument('--request-timeout', type=float,
+                      default=REQUEST_TIMEOUT,
+                      help='seconds a worker has to answer a request '
+                           '(default: %(default)s)')
+  parser.add_argument('--quiet', action='store_true',
+                      help='do not log requests')
+  args = parser.parse_args(argv)
+  return serve((args.host, args.port), args.app, workers=args.workers,
+               queue=args.queue, max_body=args.max_body, timeout=args.timeout,
+               request_timeout=args.request_timeout,
+               log=None if args.quiet else sys.stderr)
+
+if __name__ == '__main__':
+  sys.exit(main())
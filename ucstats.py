@@ -0,0 +1,255 @@
+# coding=utf-8
+'''Unknown word statistics over a whole corpus.
+
+Checks every file under the given paths in a pool of worker processes and
+counts, for each unrecognized word, how often it occurs (its frequency)
+and in how many documents (its document frequency). Each worker counts a
+share of the files and the counts are merged as they come back, so the
+words worth adding to the dictionary can be picked from millions of
+documents:
+
+  python ucstats.py corpus/ --top 100 --format csv
+  python ucstats.py corpus/ --state corpus.json --format json
+
+With --state the counts of every --checkpoint files are appended to a
+state file and a later run with the same state file, dictionary and
+--words lists skips the files already counted.
+'''
+import sys
+import os
+import json
+import codecs
+import argparse
+import multiprocessing
+from collections import Counter
+
+import uc
+
+CHECKPOINT = 1000
+
+class CorpusStats(object):
+  '''Mergeable unknown word counts for a set of documents.'''
+
+  def __init__(self):
+    self.frequency = Counter()  #occurrences of each unknown word
+    self.documents = Counter()  #documents each unknown word occurs in
+    self.files = 0
+    self.words = 0
+    self.unknown = 0
+    self.errors = {}
+    self.done = set()
+
+  def add_text(self, path, text, dict):
+    '''Count the unknown words of the document "text" read from "path".'''
+    table = uc.tokenize_table(text)
+    uc.check_table(table, dict)
+    seen = set()
+    for i in table.unknown_indices():
+      word = table[i]
+      self.frequency[word] += 1
+      self.unknown += 1
+      seen.add(word)
+    self.documents.update(seen)
+    self.files += 1
+    self.words += len(table)
+    self.done.add(path)
+
+  def merge(self, other):
+    '''Add the counts of the CorpusStats "other" to these.'''
+    self.frequency.update(other.frequency)
+    self.documents.update(other.documents)
+    self.files += other.files
+    self.words += other.words
+    self.unknown += other.unknown
+    self.errors.update(other.errors)
+    self.done.update(other.done)
+    return self
+
+  def top(self, n=None):
+    '''Return up to "n" (word, frequency, documents) rows, most frequent
+    first.'''
+    return [(word, count, self.documents[word])
+            for word,count in self.frequency.most_common(n)]
+
+  def to_json(self):
+    return {'frequency': self.frequency, 'documents': self.documents,
+            'files': self.files, 'words': self.words,
+            'unknown': self.unknown, 'errors': self.errors,
+            'done': sorted(self.done)}
+
+  @classmethod
+  def from_json(cls, data):
+    stats = cls()
+    stats.frequency.update(data['frequency'])
+    stats.documents.update(data['documents'])
+    stats.files = data['files']
+    stats.words = data['words']
+    stats.unknown = data['unknown']
+    stats.errors = data['errors']
+    stats.done = set(data['done'])
+    return stats
+
+def _count_files(job):
+  '''Count the unknown words of a share of the files. Runs in a worker
+  process, where the dictionary comes from the registry the parent warmed
+  before forking.'''
+  paths,dict_path,word_lists = job
+  dict = uc.layered_dictionary(dict_path, word_lists)
+  stats = CorpusStats()
+  for path in paths:
+    try:
+      textf = codecs.open(path, encoding='utf-8')
+      try:
+        text = textf.read()
+      finally:
+        textf.close()
+    except (IOError, OSError, UnicodeError), e:
+      stats.errors[path] = str(e)
+      stats.done.add(path)
+      continue
+    stats.add_text(path, text, dict)
+  return stats
+
+#A state file is a log of JSON lines: the versions of the dictionary and
+#word lists counted with, then the CorpusStats of each checkpoint's files.
+#Checkpoints only append, so saving costs the same however many files
+#were counted before.
+
+def load_state(path):
+  '''Return the merged CorpusStats and the dictionary versions saved in
+  "path". A line cut short by a crash, and so the line appended after it,
+  is skipped: its files were not counted, and are counted again.'''
+  f = open(path)
+  try:
+    lines = f.read().split('\n')
+  finally:
+    f.close()
+  try:
+    versions = json.loads(lines[0])['dictionaries']
+  except (KeyError, TypeError, ValueError):
+    #Saved by an older version as a single object, or cut short
+    raise ValueError('%s is not a state file of this version' % path)
+  stats = CorpusStats()
+  for line in lines[1:]:
+    try:
+      stats.merge(CorpusStats.from_json(json.loads(line)))
+    except ValueError:
+      continue
+  return stats, versions
+
+def start_state(path, versions):
+  '''Start the state file "path" for the dictionary "versions".'''
+  f = open(path, 'w')
+  try:
+    f.write(json.dumps({'dictionaries': versions}) + '\n')
+  finally:
+    f.close()
+
+def save_state(path, stats):
+  '''Append the counts "stats" to the state file "path".'''
+  f = open(path, 'a')
+  try:
+    f.write(json.dumps(stats.to_json()) + '\n')
+    f.flush()
+    os.fsync(f.fileno())
+  finally:
+    f.close()
+
+def corpus_stats(paths, dict_path=uc.DICT, word_lists=(), workers=None,
+                 share=100, state=None, checkpoint=CHECKPOINT):
+  '''Count the unknown words of the files "paths" (see uc.expand_paths())
+  in "workers" processes, "share" files at a time, and return the merged
+  CorpusStats. When "state" names a file the counts are resumed from it,
+  if it exists, and those of every "checkpoint" files and of the last ones
+  are added to it.'''
+  dict_paths = [dict_path] + list(word_lists)
+  for path in dict_paths:
+    uc.warm_dictionary(path)
+  versions = [uc.REGISTRY.version(path) for path in dict_paths]
+  stats = CorpusStats()
+  if state and os.path.exists(state):
+    stats,saved_versions = load_state(state)
+    if saved_versions != versions:
+      raise ValueError('%s was counted with other versions of %s' %
+                       (state, ', '.join(dict_paths)))
+  elif state:
+    start_state(state, versions)
+
+  files = [p for p in uc.expand_paths(paths) if p not in stats.done]
+  jobs = [(files[i:i + share], dict_path, word_lists)
+          for i in xrange(0, len(files), share)]
+  if workers == 1:
+    results = (_count_files(job) for job in jobs)
+    pool = None
+  else:
+    pool = multiprocessing.Pool(workers)
+    results = pool.imap_unordered(_count_files, jobs)
+  unsaved = CorpusStats()
+  try:
+    for result in results:
+      stats.merge(result)
+      unsaved.merge(result)
+      if state and len(unsaved.done) >= checkpoint:
+        save_state(state, unsaved)
+        unsaved = CorpusStats()
+    if pool is not None: pool.close()
+  finally:
+    if pool is not None:
+      pool.terminate()
+      pool.join()
+  if state and unsaved.done: save_state(state, unsaved)
+  return stats
+
+def write_csv(out, rows):
+  '''Write the (word, frequency, documents) "rows" as CSV.'''
+  out.write('word,frequency,documents\r\n')
+  for word,count,documents in rows:
+    if any(c in word for c in u',"\r\n'):
+      word = u'"%s"' % word.replace(u'"', u'""')
+    out.write((u'%s,%d,%d\r\n' % (word, count, documents)).encode('utf-8'))
+
+def write_json(out, stats, rows):
+  '''Write the totals of "stats" and the "rows" as JSON.'''
+  json.dump({'files': stats.files, 'words': stats.words,
+             'unknown': stats.unknown, 'errors': len(stats.errors),
+             'top': [{'word': w, 'frequency': c, 'documents': d}
+                     for w,c,d in rows]}, out, indent=1)
+  out.write('\n')
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(
+    description='Count unknown words across a corpus.')
+  parser.add_argument('paths', nargs='+',
+                      help='files, directories or globs to count')
+  parser.add_argument('--dict', default=uc.DICT)
+  parser.add_argument('--words', metavar='FILE', action='append', default=[],
+                      help='also recognize the words listed in FILE')
+  parser.add_argument('--workers', type=int, default=None,
+                      help='worker processes (default: CPUs)')
+  parser.add_argument('--share', type=int, default=100,
+                      help='files handed to a worker at a time')
+  parser.add_argument('--state', help='save counts to, and resume from, '
+                                      'this file')
+  parser.add_argument('--checkpoint', type=int, default=CHECKPOINT,
+                      help='with --state, save every this many files')
+  parser.add_argument('--top', type=int, default=50,
+                      help='number of words to report (0 for all)')
+  parser.add_argument('--format', choices=['csv', 'json'], default='csv')
+  parser.add_argument('--output', help='write the report here, not stdout')
+  args = parser.parse_args(argv)
+
+  stats = corpus_stats(args.paths, args.dict, args.words, args.workers,
+                       args.share, args.state, args.checkpoint)
+  for path,error in sorted(stats.errors.items()):
+    print >> sys.stderr, '%s: %s' % (path, error)
+  rows = stats.top(args.top or None)
+  out = open(args.output, 'wb') if args.output else sys.stdout
+  try:
+    if args.format == 'csv': write_csv(out, rows)
+    else: write_json(out, stats, rows)
+  finally:
+    if args.output: out.close()
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,204 @@
+# coding=utf-8
+'''Spelling suggestions for unrecognized words.
+
+Uses the symmetric delete method (as in SymSpell): every dictionary word
+is indexed under each string that can be made from it by deleting up to
+"max_distance" characters. The candidates for a misspelled word are then
+found by looking up the strings made by deleting characters from it,
+instead of comparing it with every dictionary word. Only the first
+"prefix_length" characters are indexed, which keeps the index small
+while still finding every word within the edit distance.
+
+Building the index takes a while, so it is built once and saved next to
+the dictionary:
+
+  python ucsuggest.py --dict dict/words --build
+  python ucsuggest.py --dict dict/words teh recieve
+'''
+import sys
+import os
+import marshal
+import argparse
+
+import uc
+
+INDEX_VERSION = 1
+MAX_DISTANCE = 2
+PREFIX_LENGTH = 7
+MEMO_SIZE = 10000
+
+def deletes(word, max_distance):
+  '''Return the set of strings made by deleting up to "max_distance"
+  characters from "word", including "word" itself.'''
+  result = set([word])
+  edge = [word]
+  for distance in range(max_distance):
+    next_edge = []
+    for w in edge:
+      if len(w) <= 1: continue
+      for i in range(len(w)):
+        d = w[:i] + w[i + 1:]
+        if d not in result:
+          result.add(d)
+          next_edge.append(d)
+    edge = next_edge
+  return result
+
+def edit_distance(a, b, max_distance):
+  '''Return the optimal string alignment distance between "a" and "b"
+  (Levenshtein distance where swapping two adjacent characters counts as
+  one edit), or max_distance + 1 if it is larger than "max_distance".'''
+  if abs(len(a) - len(b)) > max_distance: return max_distance + 1
+  previous2 = None
+  previous = range(len(b) + 1)
+  for i in range(1, len(a) + 1):
+    current = [i] + [0] * len(b)
+    lowest = i
+    for j in range(1, len(b) + 1):
+      cost = 0 if a[i - 1] == b[j - 1] else 1
+      d = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+      if (previous2 is not None and j > 1 and a[i - 1] == b[j - 2] and
+          a[i - 2] == b[j - 1]):
+        d = min(d, previous2[j - 2] + 1)
+      current[j] = d
+      if d < lowest: lowest = d
+    if lowest > max_distance: return max_distance + 1
+    previous2, previous = previous, current
+  return previous[len(b)]
+
+class SuggestionIndex(object):
+  '''Symmetric delete index over the words of a dictionary.'''
+
+  def __init__(self, words, deletes, max_distance=MAX_DISTANCE,
+               prefix_length=PREFIX_LENGTH, source=None):
+    self.words = words
+    self.deletes = deletes
+    self.max_distance = max_distance
+    self.prefix_length = prefix_length
+    self.source = source #version of the dictionary the index was built from
+    self._memo = {}
+
+  @classmethod
+  def build(cls, words, max_distance=MAX_DISTANCE,
+            prefix_length=PREFIX_LENGTH, source=None):
+    '''Index the iterable of lowercase "words".'''
+    words = sorted(set(w for w in words if w))
+    index = {}
+    for i,word in enumerate(words):
+      for d in deletes(word[:prefix_length], max_distance):
+        ids = index.get(d)
+        if ids is None: index[d] = i
+        elif isinstance(ids, list): ids.append(i)
+        else: index[d] = [ids, i]
+    return cls(words, index, max_distance, prefix_length, source)
+
+  def save(self, path):
+    '''Write the index to "path" in marshal format, which loads quickly.'''
+    tmp = path + '.tmp'
+    f = open(tmp, 'wb')
+    try:
+      marshal.dump((INDEX_VERSION, self.max_distance, self.prefix_length,
+                    self.source, self.words, self.deletes), f, 2)
+    finally:
+      f.close()
+    os.rename(tmp, path)
+
+  @classmethod
+  def load(cls, path):
+    f = open(path, 'rb')
+    try:
+      data = marshal.load(f)
+    finally:
+      f.close()
+    if data[0] != INDEX_VERSION:
+      raise ValueError('%s: unsupported index version %r' % (path, data[0]))
+    version,max_distance,prefix_length,source,words,index = data
+    return cls(words, index, max_distance, prefix_length, source)
+
+  def lookup(self, word, k=5):
+    '''Return up to "k" (distance, word) pairs for the dictionary words
+    within max_distance of the lowercase "word", closest first. Among words
+    at the same distance, anagrams of "word" (swapped letters are the most
+    common typo) and then words of the same length come first.'''
+    max_distance = self.max_distance
+    prefix = word[:self.prefix_length]
+    letters = sorted(word)
+    seen = set()
+    found = []
+    for d in deletes(prefix, max_distance):
+      ids = self.deletes.get(d)
+      if ids is None: continue
+      if not isinstance(ids, list): ids = (ids,)
+      for i in ids:
+        if i in seen: continue
+        seen.add(i)
+        candidate = self.words[i]
+        distance = edit_distance(word, candidate, max_distance)
+        if distance <= max_distance:
+          found.append((distance, sorted(candidate) != letters,
+                        abs(len(candidate) - len(word)), candidate))
+    found.sort()
+    return [(f[0], f[3]) for f in found[:k]]
+
+  def suggest(self, word, k=5):
+    '''Return up to "k" corrections for the unrecognized "word". The case
+    of a capitalized word is kept. Capitalized runs such as "New York",
+    and numbers, get no suggestions.'''
+    if not word or len(word) > 40 or word.isdigit() or \
+       any(c.isspace() for c in word):
+      return []
+    key = (word, k)
+    result = self._memo.get(key)
+    if result is not None: return result
+
+    result = [w for d,w in self.lookup(word.lower(), k)]
+    if word[0].isupper():
+      result = [w[:1].upper() + w[1:] for w in result]
+    if len(self._memo) >= MEMO_SIZE: self._memo.clear()
+    self._memo[key] = result
+    return result
+
+def index_path(dict):
+  '''Return where the suggestion index for dictionary "dict" is kept.'''
+  return dict + '.sym'
+
+def load_index(dict, path=None, build=True):
+  '''Return the suggestion index for dictionary "dict". A saved index is
+  used when it was built from the dictionary as it is now; otherwise the
+  index is built and saved, or None is returned if "build" is False.'''
+  path = path or index_path(dict)
+  version = uc.file_version(dict)
+  if os.path.exists(path):
+    index = SuggestionIndex.load(path)
+    if index.source == version: return index
+  if not build: return None
+  index = SuggestionIndex.build(uc.load_dictionary(dict), source=version)
+  index.save(path)
+  return index
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(
+    description='Build the suggestion index or look up corrections.')
+  parser.add_argument('words', nargs='*', help='words to find corrections for')
+  parser.add_argument('--dict', default=uc.DICT)
+  parser.add_argument('--index', help='index file (default: DICT.sym)')
+  parser.add_argument('--build', action='store_true',
+                      help='build the index even if it is up to date')
+  parser.add_argument('-k', type=int, default=5, help='corrections per word')
+  args = parser.parse_args(argv)
+
+  if args.build:
+    index = SuggestionIndex.build(uc.load_dictionary(args.dict),
+                                  source=uc.file_version(args.dict))
+    index.save(args.index or index_path(args.dict))
+    print 'indexed %d words' % len(index.words)
+  else:
+    index = load_index(args.dict, args.index)
+  for word in args.words:
+    word = word.decode('utf-8')
+    line = u'%s: %s' % (word, u', '.join(index.suggest(word, args.k)))
+    print line.encode('utf-8')
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
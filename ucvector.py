@@ -0,0 +1,149 @@
+# coding=utf-8
+'''Dictionary lookups for a whole document at a time with NumPy.
+
+uc.check_table() looks up one word per interpreter loop iteration. Here
+the words of a TokenTable are cut out of the text as rows of a code point
+matrix, hashed (64 bit FNV-1a, one column at a time) and looked up all at
+once with numpy.searchsorted() in the sorted hashes of the dictionary.
+Every hash hit is confirmed by comparing the strings, also vectorized, so a
+collision can never make a word known.
+
+Only plain words, words with a single hyphen that are in the dictionary
+whole, and ASCII numbers are settled this way. Every other word, which is
+mostly the few unrecognized ones, goes through uc.word_is_known() as
+before, so the verdicts are exactly those of uc.check_table().
+
+NumPy is optional; available() says whether it is installed.
+'''
+import sys
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+import uc
+
+#Longer words, and dictionary words, are left to uc.word_is_known().
+MAX_WIDTH = 48
+#Words looked up per batch, which bounds the size of the matrices.
+BATCH = 32768
+
+_FNV_OFFSET = 0xcbf29ce484222325
+_FNV_PRIME = 0x100000001b3
+
+def available():
+  return numpy is not None
+
+def _fnv1a(codes, lengths=None):
+  '''Hash each row of the code point matrix "codes". Rows shorter than the
+  matrix are given by "lengths" and padded with zeros.'''
+  h = numpy.empty(len(codes), dtype=numpy.uint64)
+  h.fill(_FNV_OFFSET)
+  prime = numpy.uint64(_FNV_PRIME)
+  codes = codes.astype(numpy.uint64)
+  for column in xrange(codes.shape[1]):
+    if lengths is None:
+      h ^= codes[:, column]
+      h *= prime
+    else:
+      h = numpy.where(column < lengths, (h ^ codes[:, column]) * prime, h)
+  return h
+
+class HashedDictionary(object):
+  '''The words of a dictionary up to MAX_WIDTH characters long as a sorted
+  array of hashes and, in the same order, an array of the words.'''
+
+  def __init__(self, dict):
+    words = [w if isinstance(w, unicode) else w.decode('utf-8')
+             for w in dict if 0 < len(w) <= MAX_WIDTH]
+    words = numpy.array(words or [u''], dtype=numpy.unicode_)
+    codes = words.view(numpy.uint32).reshape(len(words), -1)
+    hashes = _fnv1a(codes, (codes != 0).sum(axis=1))
+    order = numpy.argsort(hashes, kind='mergesort')
+    self.hashes = hashes[order]
+    self.words = words[order]
+
+  def nbytes(self):
+    return self.hashes.nbytes + self.words.nbytes
+
+  def contains(self, hashes, words):
+    '''Return a boolean array, True where "words" (a unicode array whose
+    hashes are "hashes") are in the dictionary.'''
+    pos = numpy.searchsorted(self.hashes, hashes)
+    pos[pos == len(self.hashes)] = 0
+    return (self.hashes[pos] == hashes) & (self.words[pos] == words)
+
+_hashed = (None, None)
+
+def hashed_dictionary(dict):
+  '''Return the HashedDictionary of "dict", which is kept until a
+  different dictionary is asked for (see uc.VerdictCache).'''
+  global _hashed
+  if isinstance(dict, uc.LayeredDictionary):
+    #Overlays change from request to request; whatever the base knows the
+    #stack knows too, and the rest is looked up word by word.
+    return hashed_dictionary(dict.base)
+  source,hashed = _hashed
+  if source is not dict:
+    hashed = HashedDictionary(dict)
+    _hashed = (dict, hashed)
+  return hashed
+
+def _text_codes(text):
+  '''Return the code points of "text" as an array indexed like it.'''
+  if sys.maxunicode > 0xffff:
+    return numpy.frombuffer(text.encode('utf-32-le'), dtype='<u4')
+  #Narrow builds index text in UTF-16 code units. Characters outside the
+  #BMP then never match and are settled by uc.word_is_known().
+  return numpy.frombuffer(text.encode('utf-16-le'),
+                          dtype='<u2').astype(numpy.uint32)
+
+def known_words(table, dict):
+  '''Return a boolean array, True for the words of the TokenTable "table"
+  that are certainly in "dict". False means the word has to be looked up
+  with uc.word_is_known().'''
+  count = len(table)
+  known = numpy.zeros(count, dtype=bool)
+  if not count: return known
+  lowered = uc.fold_apostrophes(table.text).lower()
+  if len(lowered) != len(table.text): return known
+  codes = _text_codes(lowered)
+  hashed = hashed_dictionary(dict)
+  starts = numpy.frombuffer(table.starts, dtype=numpy.int_)
+  lengths = numpy.frombuffer(table.ends, dtype=numpy.int_) - starts
+  digits = (numpy.uint32(ord('0')), numpy.uint32(ord('9')))
+  hyphen = numpy.uint32(ord('-'))
+
+  #Words of the same length are cut out and hashed together, so no work is
+  #spent on padding.
+  for width in xrange(1, min(int(lengths.max()), MAX_WIDTH) + 1):
+    group = numpy.flatnonzero(lengths == width)
+    for first in xrange(0, len(group), BATCH):
+      which = group[first:first + BATCH]
+      rows = codes[starts[which][:, None] + numpy.arange(width)]
+      words = rows.view('<U%d' % width).ravel()
+      found = hashed.contains(_fnv1a(rows), words)
+      #Words with several hyphens are only known if every part is.
+      if width > 2: found &= (rows == hyphen).sum(axis=1) <= 1
+      found |= ((rows >= digits[0]) & (rows <= digits[1])).all(axis=1)
+      known[which] = found
+  return known
+
+def check_table(table, dict, cache=uc.VERDICTS):
+  '''Same as uc.check_table(), with the lookups done in batches.'''
+  known = known_words(table, dict)
+  text = uc.fold_apostrophes(table.text)
+  starts, ends = table.starts, table.ends
+  verdicts = {}
+  unknown_word_set = set()
+  lookup = uc.verdict_lookup(dict, cache)
+  for i in numpy.flatnonzero(~known).tolist():
+    word = text[starts[i]:ends[i]]
+    verdict = verdicts.get(word)
+    if verdict is None:
+      verdict = verdicts[word] = lookup(word)
+    if not verdict:
+      table.set_unknown(i)
+      unknown_word_set.add(word)
+  return unknown_word_set
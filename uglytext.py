@@ -1,23 +1,381 @@
 import webapp2
 import uc
+import ucsuggest
+import ucprofile
 import codecs
+import os
+import json
+import hashlib
+import threading
+import zlib
+import cStringIO
+import calendar
+import time
+import random
+from collections import OrderedDict
+
+#Stage timings, sizes and rates of the checks, served at /metrics. Set
+#UGLYTEXT_METRICS=0 to turn them off.
+uc.METRICS.enabled = os.environ.get('UGLYTEXT_METRICS', '1') != '0'
+uc.METRICS.describe('uglytext_request_seconds', 'Time to answer a request.')
+
+#Load the dictionary while the instance starts up instead of on the first
+#request. See uc.DictionaryRegistry.
+uc.warm_dictionary(uc.DICT)
+
+class Suggestions(object):
+  '''The suggestion index of dictionary "dict", built by "python
+  ucsuggest.py --build". It is loaded again when the index file changes,
+  and dropped while it was built from another copy of the dictionary, so
+  corrections always come from the dictionary the text is checked with.'''
+
+  def __init__(self, dict):
+    self.dict = dict
+    self._versions = None
+    self._index = None
+    self._lock = threading.Lock()
+
+  def get(self):
+    '''Return the current ucsuggest.SuggestionIndex, or None.'''
+    path = ucsuggest.index_path(self.dict)
+    versions = uc.file_version(self.dict), \
+               os.path.exists(path) and uc.file_version(path)
+    with self._lock:
+      if versions != self._versions:
+        self._index = ucsuggest.load_index(self.dict, build=False)
+        self._versions = versions
+      return self._index
+
+#Corrections for unknown words come from the index built by
+#"python ucsuggest.py --build"; without one no suggestions are shown.
+SUGGESTIONS = Suggestions(uc.DICT)
+
+def request_suggestions():
+  '''Return the function suggesting corrections, or None, and a string
+  that identifies the index it uses for caching.'''
+  index = SUGGESTIONS.get()
+  if index is None: return None, ''
+  return index.suggest, '+suggest=' + index.source
+
+def timed(post):
+  '''Record how long the handler method "post" takes.'''
+  def wrapper(self, *args):
+    start = time.time()
+    try:
+      return post(self, *args)
+    finally:
+      uc.METRICS.observe('uglytext_request_seconds', time.time() - start,
+                         handler=type(self).__name__)
+  return wrapper
 
 class MainPage(webapp2.RequestHandler):
   def get(self):
       self.response.out.write(open('input.html').read())
 
+#Rendered pages of recent submissions. Set UGLYTEXT_CACHE_DIR to keep them
+#on disk across restarts as well.
+RESULTS = uc.ResultCache(
+  int(os.environ.get('UGLYTEXT_CACHE_BYTES', uc.RESULT_CACHE_BYTES)),
+  os.environ.get('UGLYTEXT_CACHE_DIR'))
+
+#Requests to /checktext with "profile=1" are profiled (see ucprofile.py)
+#when UGLYTEXT_PROFILE_DIR is set, but only a UGLYTEXT_PROFILE_RATE fraction
+#of them, so the flag cannot be used to slow the server down at will.
+PROFILE_DIR = os.environ.get('UGLYTEXT_PROFILE_DIR')
+PROFILE_RATE = float(os.environ.get('UGLYTEXT_PROFILE_RATE', '0.1'))
+PROFILE_KEEP = int(os.environ.get('UGLYTEXT_PROFILE_KEEP',
+                                  ucprofile.PROFILE_KEEP))
+
+def profiled(request):
+  '''Return whether to profile "request".'''
+  return bool(PROFILE_DIR) and request.get('profile') == '1' and \
+         random.random() < PROFILE_RATE
+
+def request_dictionary(request):
+  '''Return the dictionary to check "request" against, and a string that
+  identifies it for caching: the shared dictionary, with the words of the
+  optional "words" field (one per line) layered on top.'''
+  words = uc.word_list(request.get('words').splitlines())
+  version = uc.REGISTRY.version(uc.DICT)
+  if words: version += '\0' + '\n'.join(sorted(words)).encode('utf-8')
+  return uc.layered_dictionary(uc.DICT, words=words), version
+
+def request_engine(request):
+  '''Return the name of the uc.Engine to check "request" with: the one
+  named by the optional "engine" field. Raises ValueError if it names none
+  that can run here.'''
+  return uc.get_engine(request.get('engine') or None).name
+
 class textProcessor(webapp2.RequestHandler):
+  @timed
   def post(self):
+      t = uc.METRICS.clock()
       input_text = self.request.get('text')
-      self.response.out.write(uc.html_output(input_text))
+      uc.METRICS.lap('decode', t)
+      dict,version = request_dictionary(self.request)
+      try:
+        engine = request_engine(self.request)
+      except ValueError, e:
+        self.abort(400, detail=str(e))
+      suggest,suffix = request_suggestions()
+      if profiled(self.request):
+        #Never answered from the cache, which would leave nothing to profile.
+        out = cStringIO.StringIO()
+        with ucprofile.Profile(PROFILE_DIR, 'checktext',
+                               PROFILE_KEEP) as profile:
+          table = uc.write_output(out, dict, input_text, 'html', suggest,
+                                  engine)
+          profile.count(input_text, table)
+        self.response.out.write(out.getvalue())
+        return
+      key = RESULTS.key(input_text, version,
+                        'html' + suffix + '@' + engine)
+      page = RESULTS.get(key)
+      if page is None:
+        out = cStringIO.StringIO()
+        uc.write_output(out, dict, input_text, 'html', suggest, engine)
+        page = out.getvalue()
+        RESULTS.put(key, page)
+      self.response.out.write(page)
+
+def gzip_bytes(data):
+  '''Return "data" compressed in the gzip format.'''
+  compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+  return compressor.compress(data) + compressor.flush()
+
+def accepts_gzip(request):
+  '''Return whether "request" takes a gzip body: its Accept-Encoding gives
+  gzip, or "*", a quality above 0. Without the header it gets none.'''
+  if 'Accept-Encoding' not in request.headers: return False
+  return (request.accept_encoding.quality('gzip') or 0) > 0
+
+class checkApi(webapp2.RequestHandler):
+  '''Check the posted "text" and reply with the unknown word spans and the
+  statistics line as compact JSON (see uc.JsonRenderer). The optional
+  "engine" field names the uc.Engine to check with. The ETag is a hash of
+  the text, the dictionary version, any extra "words", the suggestion index
+  and the engine, with "-gzip" appended for the compressed body, so a
+  client that sends the same text again with If-None-Match gets a 304
+  without the text being checked.'''
+
+  @timed
+  def post(self):
+      t = uc.METRICS.clock()
+      input_text = self.request.get('text')
+      uc.METRICS.lap('decode', t)
+      dict,version = request_dictionary(self.request)
+      try:
+        engine = request_engine(self.request)
+      except ValueError, e:
+        self.abort(400, detail=str(e))
+      suggest,suffix = request_suggestions()
+      etag = hashlib.sha1(version + suffix + '@' + engine + '\0' +
+                          input_text.encode('utf-8')).hexdigest()
+      use_gzip = accepts_gzip(self.request)
+      self.response.headers['Vary'] = 'Accept-Encoding'
+      self.response.etag = etag + '-gzip' if use_gzip else etag
+      if etag in self.request.if_none_match or \
+         etag + '-gzip' in self.request.if_none_match:
+        self.response.status = 304
+        return
+
+      out = cStringIO.StringIO()
+      uc.write_output(out, dict, input_text, 'json', suggest, engine)
+      body = out.getvalue()
+      self.response.headers['Content-Type'] = 'application/json'
+      if use_gzip:
+        body = gzip_bytes(body)
+        self.response.headers['Content-Encoding'] = 'gzip'
+      self.response.out.write(body)
+
+DOCUMENT_BYTES = 16 * 1024 * 1024
+
+class DocumentStore(object):
+  '''Check states of the documents being edited through /checktext/edit,
+  keyed by the client's document id. The states take up at most
+  "max_bytes", counting the text and the token table of each, and the
+  least recently used documents are dropped first. Once a state checked
+  against a newly loaded dictionary is put, the states that still hold
+  the old one are dropped too, so the old dictionary can be freed.'''
+
+  def __init__(self, max_bytes=DOCUMENT_BYTES):
+    self.max_bytes = max_bytes
+    self.bytes = 0
+    self._states = OrderedDict()
+    self._dict = None
+    self._lock = threading.Lock()
+
+  @staticmethod
+  def _size(state):
+    return len(state.text) + state.table.nbytes()
+
+  def get(self, doc):
+    with self._lock:
+      state = self._states.pop(doc, None)
+      if state is not None: self._states[doc] = state
+      return state
+
+  def put(self, doc, state):
+    with self._lock:
+      old = self._states.pop(doc, None)
+      if old is not None: self.bytes -= self._size(old)
+      if state.dict is not self._dict:
+        self._dict = state.dict
+        for stale in [d for d,s in self._states.items()
+                      if s.dict is not state.dict]:
+          self.bytes -= self._size(self._states.pop(stale))
+      size = self._size(state)
+      if size > self.max_bytes: return
+      self._states[doc] = state
+      self.bytes += size
+      while self.bytes > self.max_bytes:
+        evicted_doc,evicted = self._states.popitem(last=False)
+        self.bytes -= self._size(evicted)
+
+#Set UGLYTEXT_DOCUMENT_BYTES to change how much the documents being edited
+#may take up.
+DOCUMENTS = DocumentStore(
+  int(os.environ.get('UGLYTEXT_DOCUMENT_BYTES', DOCUMENT_BYTES)))
+
+class incrementalChecker(webapp2.RequestHandler):
+  '''Check a document once, then only the parts of it that edits touch.
+
+  Post "doc", a non-empty id chosen by the client, and "text" to start.
+  After that post "doc" with an edit: "offset", "deleted" (a character
+  count) and "inserted". The JSON reply gives the region of the new text
+  that was checked again, the unknown words in it and how far everything
+  after the region moved; see uc.recheck(). When the server no longer
+  knows the document it replies 404 and the client should send the full
+  text again.'''
+
+  @timed
+  def post(self):
+      doc = self.request.get('doc')
+      if not doc:
+        return self.reply(400, {'error': 'no document id'})
+      dict = uc.get_dictionary(uc.DICT)
+      if 'text' in self.request.params:
+        text = self.request.get('text')
+        state = uc.check_state(text, dict)
+        delta = uc.CheckDelta(0, len(text), 0, list(state.unknown_idxs()))
+      else:
+        state = DOCUMENTS.get(doc)
+        if state is None:
+          return self.reply(404, {'error': 'unknown document'})
+        try:
+          offset = int(self.request.get('offset'))
+          deleted = int(self.request.get('deleted', '0'))
+          state,delta = uc.recheck(state, offset, deleted,
+                                   self.request.get('inserted'), dict)
+        except ValueError, e:
+          return self.reply(400, {'error': str(e)})
+
+      DOCUMENTS.put(doc, state)
+      self.reply(200, {'doc': doc, 'start': delta.start, 'end': delta.end,
+                       'shift': delta.shift, 'unknown': delta.unknown})
+
+  def reply(self, status, body):
+      self.response.status = status
+      self.response.headers['Content-Type'] = 'application/json'
+      self.response.out.write(json.dumps(body, separators=(',', ':')))
+
+class StaticFile(object):
+  '''A file kept in memory as raw bytes together with its gzip variant and
+  validators. It is read again when its mtime or size changes.'''
+
+  def __init__(self, path):
+    self.path = path
+    self._state = None
+    self._lock = threading.Lock()
+
+  def current(self):
+    '''Return (data, gzipped data, etag, mtime) for the file as it is now.'''
+    st = os.stat(self.path)
+    state = self._state
+    if state is None or state[3] != st.st_mtime or len(state[0]) != st.st_size:
+      with self._lock:
+        f = open(self.path, 'rb')
+        data = f.read()
+        f.close()
+        etag = '%x-%x' % (int(st.st_mtime * 1000), len(data))
+        state = self._state = (data, gzip_bytes(data), etag, st.st_mtime)
+    return state
+
+DICT_FILE = StaticFile(uc.DICT)
 
 class dictdisplay(webapp2.RequestHandler):
+  '''Serve the dictionary for clients that keep a copy in sync. Responses
+  carry an ETag and Last-Modified so a client only downloads the file again
+  when it changed, are gzip compressed when the client accepts it, and
+  support single byte ranges for resuming a download.'''
+
+  def get(self):
+      data,gzipped,etag,mtime = DICT_FILE.current()
+      use_gzip = accepts_gzip(self.request)
+      headers = self.response.headers
+      headers['Content-Type'] = 'text/plain; charset=iso-8859-1'
+      headers['Accept-Ranges'] = 'bytes'
+      headers['Vary'] = 'Accept-Encoding'
+      self.response.last_modified = mtime
+      self.response.etag = etag + '-gzip' if use_gzip else etag
+
+      if self.request.if_none_match:
+        if etag in self.request.if_none_match or \
+           etag + '-gzip' in self.request.if_none_match:
+          self.response.status = 304
+          return
+      elif self.request.if_modified_since:
+        since = calendar.timegm(self.request.if_modified_since.utctimetuple())
+        if int(mtime) <= since:
+          self.response.status = 304
+          return
+
+      byte_range = self.request.range
+      if_range = self.request.headers.get('If-Range')
+      if if_range and if_range.strip('"') != etag and \
+         if_range != headers['Last-Modified']:
+        byte_range = None #the client's copy is stale, send it all
+      if byte_range is not None:
+        self.response.etag = etag
+        span = byte_range.range_for_length(len(data))
+        if span is None:
+          self.response.status = 416
+          headers['Content-Range'] = 'bytes */%d' % len(data)
+          return
+        start,stop = span
+        self.response.status = 206
+        headers['Content-Range'] = 'bytes %d-%d/%d' % (start, stop - 1,
+                                                       len(data))
+        self.response.out.write(data[start:stop])
+      elif use_gzip:
+        headers['Content-Encoding'] = 'gzip'
+        self.response.out.write(gzipped)
+      else:
+        self.response.out.write(data)
+
+#Cache statistics that only ever grow; the others are current sizes.
+CACHE_COUNTERS = frozenset(['hits', 'disk_hits', 'misses', 'evictions'])
+
+class metrics(webapp2.RequestHandler):
+  '''Everything recorded in uc.METRICS, plus the state of the caches, in
+  the Prometheus text format.'''
+
   def get(self):
-      self.response.headers['Content-Type'] = 'text/plain'
-      self.response.headers['charset']='iso8859'
-      self.response.out.write(codecs.open('dict/words',encoding="iso8859").read())
+      for prefix,stats in [('uglytext_result_cache_', RESULTS.stats()),
+                           ('uc_verdict_cache_', uc.VERDICTS.stats())]:
+        for name,value in stats.items():
+          if name in CACHE_COUNTERS:
+            uc.METRICS.counter(prefix + name + '_total', value)
+          else:
+            uc.METRICS.gauge(prefix + name, value)
+      self.response.headers['Content-Type'] = 'text/plain; version=0.0.4'
+      self.response.out.write(uc.METRICS.render())
 
+#Served by App Engine (see app.yaml), or on any host by ucserver.py.
 app = webapp2.WSGIApplication([('/', MainPage),
                                ('/checktext',textProcessor),
-                               ('/dict/words',dictdisplay)],
+                               ('/checktext/edit',incrementalChecker),
+                               ('/api/check',checkApi),
+                               ('/dict/words',dictdisplay),
+                               ('/metrics',metrics)],
                               debug=True)